@@ -7,7 +7,79 @@ class Config:
     DB_PASSWORD = os.getenv("DB_PASSWORD", "3004")
     DB_PORT = os.getenv("DB_PORT", 25432)
 
+    # One pooled engine per process (utils/db.py); sessions beyond size + overflow wait up to timeout
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 30 * 60))
+
 from pathlib import Path
 
 IMAGES_DIR = Path("images")
-IMAGES_DIR.mkdir(parents=True, exist_ok=True)
\ No newline at end of file
+IMAGES_DIR.mkdir(parents=True, exist_ok=True)
+
+# Cities with a table in the database and a folder under IMAGES_DIR (search order for /image)
+CITIES = ["berlin", "paris", "washington", "singapore"]
+
+# In-memory budget for loaded query results (bytes, default 1 GiB)
+RESULT_STORE_MAX_BYTES = int(os.getenv("RESULT_STORE_MAX_BYTES", 1024 ** 3))
+
+# Query results live under a query id; idle results expire after this long (seconds)
+RESULTS_DIR = Path("results")
+QUERY_RESULT_TTL_SECONDS = float(os.getenv("QUERY_RESULT_TTL_SECONDS", 6 * 60 * 60))
+# user_id -> id of that user's latest query, kept across restarts (outside RESULTS_DIR, which is purged)
+LATEST_QUERIES_PATH = Path(os.getenv("LATEST_QUERIES_PATH", "latest_queries.json"))
+
+# Worker threads for background /query/ jobs (each holds one PostGIS session while running)
+QUERY_WORKERS = int(os.getenv("QUERY_WORKERS", 2))
+
+# Slice tables kept in PostGIS for reuse (one per city/buffer/area combination)
+MAX_SLICE_TABLES = int(os.getenv("MAX_SLICE_TABLES", 16))
+
+# On-disk cache of pair-query results, keyed by canonical query parameters
+QUERY_CACHE_DIR = Path("query_cache")
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+
+# Rows per fetch when /query/ streams the pair join from a server-side cursor to disk
+QUERY_FETCH_ROWS = int(os.getenv("QUERY_FETCH_ROWS", 50_000))
+
+# How /query/ finds pairs: "postgis" (slice tables + spatial join) or "kdtree" (in-process, utils/pair_engine.py)
+PAIR_ENGINE = os.getenv("PAIR_ENGINE", "postgis").lower()
+
+# Split /query/'s PostGIS join into grid tiles run on this many connections at once (1 = single statement);
+# QUERY_WORKERS * QUERY_SHARD_WORKERS should fit in DB_POOL_SIZE + DB_MAX_OVERFLOW
+QUERY_SHARD_WORKERS = int(os.getenv("QUERY_SHARD_WORKERS", 1))
+
+# /query/ requests with explain set get the planner's EXPLAIN (FORMAT JSON) of the join; only with
+# QUERY_EXPLAIN_ANALYZE=1 is it EXPLAIN ANALYZE, which runs the whole join a second time
+QUERY_EXPLAIN_ANALYZE = os.getenv("QUERY_EXPLAIN_ANALYZE", "0") == "1"
+
+# /query/ runs (parameters, engine, timings, plans) for /query/history, kept apart from the likes in liked.db
+QUERY_HISTORY_PATH = Path(os.getenv("QUERY_HISTORY_PATH", "query_history.db"))
+QUERY_TILES_PER_WORKER = int(os.getenv("QUERY_TILES_PER_WORKER", 4))
+
+# Anchors sampled by /query/estimate; more is tighter but slower (about one index probe each)
+ESTIMATE_SAMPLE_ANCHORS = int(os.getenv("ESTIMATE_SAMPLE_ANCHORS", 500))
+
+# Rows read per batch when streaming an export of a query result
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", 20_000))
+
+# Parallel image downloads in /download/ (utils/download.py); also the size of its keep-alive connection pool
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", 16))
+# Background /download/ jobs run at once (each with DOWNLOAD_WORKERS threads), and how often
+# /download/jobs/{job_id}/events pushes progress (seconds)
+DOWNLOAD_JOBS = int(os.getenv("DOWNLOAD_JOBS", 2))
+DOWNLOAD_EVENT_INTERVAL = float(os.getenv("DOWNLOAD_EVENT_INTERVAL", 0.5))
+
+# Mapillary Graph API metadata: ids per ?ids= lookup and lookups in flight at once (utils/mapillary.py)
+MAPILLARY_BATCH_IDS = int(os.getenv("MAPILLARY_BATCH_IDS", 50))
+MAPILLARY_METADATA_WORKERS = int(os.getenv("MAPILLARY_METADATA_WORKERS", 4))
+# Retries of a lookup the API rate-limits (429), fails (5xx) or that errors on the network, waiting
+# MAPILLARY_RETRY_BACKOFF * 2**attempt seconds (or the Retry-After header) between tries
+MAPILLARY_RETRIES = int(os.getenv("MAPILLARY_RETRIES", 4))
+MAPILLARY_RETRY_BACKOFF = float(os.getenv("MAPILLARY_RETRY_BACKOFF", 0.5))
+
+# Resolved Mapillary image URLs (image id, field) -> URL, shared by the downloaders; entries older than
+# the TTL are resolved again, so keep it below the lifetime of the signed CDN URLs
+URL_CACHE_PATH = Path(os.getenv("URL_CACHE_PATH", "url_cache.db"))
+URL_CACHE_TTL_SECONDS = float(os.getenv("URL_CACHE_TTL_SECONDS", 24 * 60 * 60))
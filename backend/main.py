@@ -1,24 +1,89 @@
 import pandas as pd
 from pathlib import Path
-from datetime import datetime
+import json
+import os
 import re
 import sqlite3
+import threading
+import uuid
 
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy.exc import OperationalError
 
 from utils.plot_slice import plot_slice
-from utils.query import run_query
-from utils.create_slice import create_materialized_view
+from utils.query import stream_query, stream_query_sharded, explain_query, summarize_plan
+from utils.pair_engine import get_pair_engine, narrow_pairs, ring_contains
+from utils.estimate import estimate_pairs
+from utils.export import EXPORT_FORMATS, export_filename, iter_export
+from utils.create_slice import SliceCache, slice_key
+from utils.query_cache import query_cache
+from utils.db import dispose_engine, pool_status
 from utils.download import download_pairs
 from utils.helper_db import *
+from utils.query_history import ensure_query_history, record_query, fetch_query_history
 from utils.pydantic_models import *
+from utils.result_store import ResultStore
+from utils.pages import build_page_items
+from utils.image_index import image_index
+from utils.download_journal import atomic_write_bytes
+from utils.http_cache import cached_file_response
+from utils.jobs import JobManager, FINISHED, job_events
+from utils.variants import SIZE_PRESETS, FORMATS, MIN_WIDTH, MAX_WIDTH, get_variant, media_type
 
-from config import IMAGES_DIR
+from config import CITIES, RESULT_STORE_MAX_BYTES, RESULTS_DIR, QUERY_RESULT_TTL_SECONDS, LATEST_QUERIES_PATH, QUERY_WORKERS, MAX_SLICE_TABLES, PAIR_ENGINE, QUERY_SHARD_WORKERS, QUERY_EXPLAIN_ANALYZE, DOWNLOAD_JOBS, DOWNLOAD_EVENT_INTERVAL
 
-PKL_PATH = Path("latest_query.pkl")
+QUERY_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+# Each /query/ result lives under its own query id; results stay in memory
+# so paging and likes don't unpickle the frame per request
+result_store = ResultStore(RESULT_STORE_MAX_BYTES, ttl_seconds=QUERY_RESULT_TTL_SECONDS)
+def _read_latest_query_ids():
+    try:
+        return json.loads(LATEST_QUERIES_PATH.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+# user_id -> id of that user's most recent query (used when a request has no query_id),
+# saved to LATEST_QUERIES_PATH so it survives restarts
+latest_query_ids = _read_latest_query_ids()
+latest_query_ids_lock = threading.Lock()
+# Liked pairs, built once at startup and updated by /like/
+liked_index = LikedIndex().load()
+ensure_liked_indexes()
+ensure_query_history()
+# uuid -> image file, built once at startup and updated by download_pairs
+image_index.build()
+# Slow PostGIS work runs here instead of on the event loop
+jobs = JobManager(max_workers=QUERY_WORKERS)
+# Image downloads for query results; (query_id, city) -> id of the job downloading it, until it finishes
+download_jobs = JobManager(max_workers=DOWNLOAD_JOBS)
+active_downloads = {}
+active_downloads_lock = threading.Lock()
+# Slice tables shared by queries with the same parameters
+slice_cache = SliceCache(max_tables=MAX_SLICE_TABLES)
+
+def _load_result(query_id=None, user_id="default"):
+    """Return the store entry for query_id, or for the user's latest query if none is given."""
+    if not query_id:
+        query_id = latest_query_ids.get(user_id)
+    if not query_id:
+        raise HTTPException(status_code=400, detail="No query result found. Run /query/ first.")
+    if not QUERY_ID_RE.match(query_id):
+        raise HTTPException(status_code=400, detail="Invalid query_id.")
+    entry = result_store.load(query_id, RESULTS_DIR / f"{query_id}.parquet")
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"Query {query_id} not found or expired. Please re-run query.")
+    # results shared with the query cache carry another query's id, or none
+    entry.df.attrs["query_id"] = query_id
+    return entry
+
+def _remember_latest_query(user_id, query_id):
+    with latest_query_ids_lock:
+        latest_query_ids[user_id] = query_id
+        atomic_write_bytes(LATEST_QUERIES_PATH, json.dumps(latest_query_ids).encode("utf-8"))
 
 app = FastAPI()
 
@@ -34,6 +99,15 @@ app.add_middleware(
 async def root():
     return {"message": "Hello World"}
 
+@app.on_event("shutdown")
+def close_db_pool():
+    dispose_engine()
+
+@app.get("/metrics/db")
+def db_metrics():
+    """Connection pool counters: checkouts, checkout wait and hold times, timeouts, pool size."""
+    return pool_status()
+
 
 @app.post("/plot-slice/")
 async def plot(data: PlotRequest):
@@ -45,23 +119,31 @@ async def plot(data: PlotRequest):
 
 @app.post("/query/")
 async def query(data: PlotRequest):
+    """
+    Starts a query job and returns its id right away.
+    Poll /query/jobs/{job_id} for the current stage; once done, its result
+    holds count, city, the query_id to page with and the export_url.
+    """
+    city = _query_city(data)
+    job = jobs.submit("query", _run_query_job, data, city)
+    return JSONResponse(status_code=202, content={"job_id": job.id, "status": job.status})
+
+def _query_city(data):
     # Validate city
     if not data.city:
         raise HTTPException(status_code=400, detail="City parameter is required")
     
     city = data.city.lower()
-    valid_cities = ["berlin", "paris", "washington", "singapore"]
-    if city not in valid_cities:
-        raise HTTPException(status_code=400, detail=f"Invalid city. Must be one of: {valid_cities}")
-    
-    lat = None
-    lng = None
-    radius_m = None
+    if city not in CITIES:
+        raise HTTPException(status_code=400, detail=f"Invalid city. Must be one of: {CITIES}")
+    return city
+
+def _query_params(data, city):
+    lat = lng = radius_m = None
     if data.area:
         lng, lat = data.area.center
         radius_m = data.area.radius_m
-    
-    create_materialized_view(
+    return dict(
         city=city,
         inner_buffer=data.inner_buffer or 0.0,
         outer_buffer=data.outer_buffer or 0.0,
@@ -69,54 +151,287 @@ async def query(data: PlotRequest):
         lng=lng,
         radius_m=radius_m,
     )
-    count, df = run_query(city=city)
-    df.to_pickle("latest_query.pkl")
-    
-    save_dir = Path("queries")
-    save_dir.mkdir(exist_ok=True)
-    
-    # Clean values for filename (replace None with "all")
-    def safe_num(val, decimals=5):
-        if val is None:
-            return "none"
-        return str(round(val, decimals)).replace(".", "_")
-    
-    inner_str = safe_num(data.inner_buffer)
-    outer_str = safe_num(data.outer_buffer)
-    lat_str = safe_num(lat)
-    lng_str = safe_num(lng)
-    radius_str = safe_num(radius_m, 2)
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    base_name = f"city_{city}_count_{count}_inner_{inner_str}_outer_{outer_str}_lat_{lat_str}_lng_{lng_str}_r_{radius_str}_{timestamp}"
-    
-    # Save as CSV
-    csv_path = save_dir / f"{base_name}.csv"
-    df.to_csv(csv_path, index=False)
-    print(f"Query saved to: {csv_path}")
-    
-    return JSONResponse(content={
+
+@app.post("/query/estimate")
+def query_estimate(data: PlotRequest):
+    """
+    Approximate pair count for these parameters from a sample of anchors, with a 95%
+    confidence interval, without building slice tables. Exact if the result is cached.
+    """
+    city = _query_city(data)
+    params = _query_params(data, city)
+    cached_count = query_cache.count(slice_key(**params))
+    if cached_count is not None:
+        return {
+            "estimate": cached_count,
+            "ci_low": cached_count,
+            "ci_high": cached_count,
+            "confidence": 1.0,
+            "sampled_anchors": None,
+            "method": "cached result",
+            "exact": True,
+            "elapsed_s": 0.0,
+        }
+    try:
+        return estimate_pairs(**params)
+    except OperationalError as e:
+        if "statement timeout" in str(e):
+            raise HTTPException(status_code=504, detail="Estimate timed out; try a smaller area or buffer.")
+        raise
+
+@app.get("/query/jobs/{job_id}")
+def query_job_status(job_id: str):
+    """
+    Returns status (queued, running, done, failed) and stage (preparing, materializing,
+    indexing, explaining, joining, fetching, writing) of a query job, the seconds spent
+    per stage so far, plus its result when done.
+    """
+    job = jobs.get(job_id)
+    if job is None or job.kind != "query":
+        raise HTTPException(status_code=404, detail=f"Query job {job_id} not found")
+    return job.to_dict()
+
+def _persist_result(df, dest, cached_path=None):
+    """Write df to dest, hard-linking the query cache's copy when there is one."""
+    if cached_path is not None:
+        try:
+            os.link(cached_path, dest)
+            return
+        except OSError:
+            pass  # evicted meanwhile, or cache on another filesystem
+    df.to_parquet(dest, index=False)
+
+PROJECTED_COLUMNS = {"x_1", "y_1", "x_2", "y_2"}
+
+def _as_key(key):
+    city, inner, outer, area = key
+    return (city, inner, outer, tuple(area) if area else None)
+
+def _wider_result(key, generation):
+    """
+    A result held in memory or in the query cache whose ring contains key's ring (same city
+    and area), so key's pairs can be cut from it. Prefers the smallest candidate.
+    """
+    candidates = []
+    for entry in result_store.entries():
+        attrs = entry.df.attrs
+        if (
+            attrs.get("slice_key")
+            and attrs.get("generation") == generation
+            and PROJECTED_COLUMNS <= set(entry.df.columns)
+            and ring_contains(_as_key(attrs["slice_key"]), key)
+        ):
+            candidates.append((len(entry.df), entry.df))
+    if candidates:
+        return min(candidates, key=lambda c: c[0])[1]
+    
+    def file_size(k):
+        try:
+            return query_cache.path_for(k).stat().st_size
+        except FileNotFoundError:
+            return 0
+    
+    cached = [k for k in query_cache.keys(key[0]) if k != key and ring_contains(k, key)]
+    for wider_key in sorted(cached, key=file_size):
+        hit = query_cache.get(wider_key)
+        if hit is not None and PROJECTED_COLUMNS <= set(hit[0].columns):
+            return hit[0]
+    return None
+
+def _write_pairs(df, attrs, result_path):
+    # replace, not merge: a result cut from a wider one still carries that query's attrs
+    df.attrs = dict(attrs)
+    df.to_parquet(result_path, index=False)
+    return len(df)
+
+def _find_pairs(job, params, result_path, attrs, explain=False, stats=None):
+    """
+    Run the pair join for params with PAIR_ENGINE, writing result_path. Returns the pair count.
+    Narrower rings are cut from a cached wider result instead, unless explain is set.
+    attrs are stored with the result file (city, slice_key, generation).
+    stats (dict) receives write_s and, with explain on the PostGIS engines, the join's EXPLAIN plan.
+    """
+    city = params["city"]
+    key = _as_key(attrs["slice_key"])
+    wider = None if explain else _wider_result(key, attrs["generation"])
+    if wider is not None:
+        job.set_stage("narrowing")
+        # key holds the rounded buffers the slice tables would be built with
+        return _write_pairs(narrow_pairs(wider, key[1], key[2]), attrs, result_path)
+    
+    if PAIR_ENGINE == "kdtree":
+        job.set_stage("loading")
+        engine = get_pair_engine(city)
+        job.set_stage("joining")
+        df = engine.pairs(params["inner_buffer"], params["outer_buffer"], params["lat"], params["lng"], params["radius_m"])
+        return _write_pairs(df, attrs, result_path)
+    
+    slice_table = slice_cache.acquire(**params, on_stage=job.set_stage)
+    try:
+        if explain:
+            job.set_stage("explaining")
+            stats["plan"] = explain_query(city, slice_table, analyze=QUERY_EXPLAIN_ANALYZE)
+        if QUERY_SHARD_WORKERS > 1:
+            return stream_query_sharded(
+                city,
+                result_path,
+                halo=params["outer_buffer"],
+                workers=QUERY_SHARD_WORKERS,
+                on_stage=job.set_stage,
+                on_progress=lambda rows: job.update(rows=rows),
+                slice_table=slice_table,
+                stats=stats,
+                attrs=attrs,
+            )
+        # stream the join to disk chunk by chunk instead of holding it in memory
+        return stream_query(
+            city,
+            result_path,
+            on_stage=job.set_stage,
+            on_progress=lambda rows: job.update(rows=rows),
+            slice_table=slice_table,
+            stats=stats,
+            attrs=attrs,
+        )
+    finally:
+        slice_cache.release(slice_table)
+
+def _run_query_job(job, data, city):
+    """
+    Worker side of /query/: answer from the query cache, or build the slice and run
+    the join, then write and register the result. Stage timings (and the EXPLAIN plan
+    when data.explain is set) are returned and kept in query_history.
+    """
+    job.set_stage("preparing")
+    params = _query_params(data, city)
+    key = slice_key(**params)
+    query_id = uuid.uuid4().hex
+    RESULTS_DIR.mkdir(exist_ok=True)
+    result_path = RESULTS_DIR / f"{query_id}.parquet"
+    
+    stats = {}
+    # explain needs the join to actually run
+    cached = None if data.explain else query_cache.get(key)
+    if cached is not None:
+        job.set_stage("cached")
+        df, _ = cached
+        count = len(df)
+        _persist_result(df, result_path, query_cache.path_for(key))
+    else:
+        # read before querying so rows deleted meanwhile keep this result out of the cache
+        generation = query_cache.generation(city)
+        try:
+            attrs = {"city": city, "slice_key": list(key), "generation": generation}
+            count = _find_pairs(job, params, result_path, attrs, data.explain, stats)
+        except BaseException:
+            result_path.unlink(missing_ok=True)
+            raise
+        
+        job.set_stage("writing")
+        query_cache.put_file(key, result_path, generation)
+    job.update(count=int(count), cached=cached is not None)
+    
+    if cached is not None:
+        # Register the result for paging under its query id; streamed results are loaded on first use
+        df.attrs["city"] = city
+        df.attrs["query_id"] = query_id
+        result_store.put(query_id, df, result_path)
+    _remember_latest_query(data.user_id, query_id)
+    result_store.purge_expired(RESULTS_DIR)
+    
+    timings = job.stage_timings()
+    plan = stats.get("plan")
+    summary = summarize_plan(plan) if plan else None
+    record_query({
+        "query_id": query_id,
+        "city": city,
+        "inner_buffer": params["inner_buffer"],
+        "outer_buffer": params["outer_buffer"],
+        "area": data.area.model_dump() if data.area else None,
+        "engine": _engine_label(cached is not None, timings),
+        "cached": cached is not None,
         "count": int(count),
-        "csv_path": str(csv_path),
-        "city": city
+        "total_s": round(sum(timings.values()), 3),
+        "timings": {**timings, "write_s": stats.get("write_s")},
+        "plan_summary": summary,
+        "plan": plan,
     })
+    
+    return {
+        "count": int(count),
+        "city": city,
+        "query_id": query_id,
+        "export_url": f"/query/{query_id}/export",
+        "cached": cached is not None,
+        # seconds per stage; write_s is the part of fetching spent writing the result file
+        "timings": timings,
+        "write_s": stats.get("write_s"),
+        "explain": {"summary": summary, "plan": plan} if plan else None,
+    }
+
+def _engine_label(cached, timings):
+    if cached:
+        return "cache"
+    if "narrowing" in timings:
+        return "narrowed"
+    if PAIR_ENGINE == "kdtree":
+        return "kdtree"
+    return f"postgis-sharded-{QUERY_SHARD_WORKERS}" if QUERY_SHARD_WORKERS > 1 else "postgis"
+
+@app.get("/query/history")
+def query_history(city: str = None, limit: int = 50):
+    """Recent /query/ runs, newest first: parameters, engine, count, stage timings and plan summary."""
+    if not 1 <= limit <= 500:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 500")
+    return {"items": fetch_query_history(city=city, limit=limit)}
+
+@app.get("/query/history/{query_id}")
+def query_history_entry(query_id: str):
+    """One /query/ run including its full EXPLAIN plan, if one was captured."""
+    items = fetch_query_history(query_id=query_id, limit=1, with_plan=True)
+    if not items:
+        raise HTTPException(status_code=404, detail=f"No history for query {query_id}")
+    return items[0]
+
+@app.get("/query/{query_id}/export")
+def export_query(query_id: str, format: str = "csv"):
+    """
+    Streams a stored query result as csv, csv.gz, parquet or geojson (one LineString per pair).
+    Rows are converted batch by batch while the download runs.
+    """
+    if not QUERY_ID_RE.match(query_id):
+        raise HTTPException(status_code=400, detail="Invalid query_id.")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format. Must be one of: {list(EXPORT_FORMATS)}")
+    path = RESULTS_DIR / f"{query_id}.parquet"
+    if not path.exists():
+        raise HTTPException(status_code=404, detail=f"Query {query_id} not found or expired. Please re-run query.")
+    
+    media_type = EXPORT_FORMATS[format][0]
+    filename = export_filename(path, query_id, format)
+    return StreamingResponse(
+        iter_export(path, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
 @app.post("/download/")
 def download(body: dict = None):
     """
-    Downloads images for the current query.
-    Expects optional body with city name, or reads from latest_query.pkl metadata.
+    Starts downloading the images of a query result and returns a job id right away.
+    Expects optional body with query_id (defaults to the user's latest query)
+    and city name, otherwise the city is read from the result metadata.
+    While a download of the same result is running, its job is returned instead of a new one.
+    Follow it with /download/jobs/{job_id} (polling) or /download/jobs/{job_id}/events (SSE).
     """
-    pkl = Path("latest_query.pkl")
-    if not pkl.exists():
-        raise HTTPException(status_code=400, detail="No latest_query.pkl found.")
-    
-    df = pd.read_pickle(pkl)
+    body = body or {}
+    df = _load_result(body.get("query_id"), body.get("user_id", "default")).df
     if df.empty:
-        raise HTTPException(status_code=400, detail="No rows found in latest_query.pkl")
+        raise HTTPException(status_code=400, detail="No rows found in query result")
     
     # Try to get city from request body, or from dataframe metadata
     city = None
-    if body and "city" in body:
+    if body.get("city"):
         city = body["city"].lower()
     elif hasattr(df, 'attrs') and 'city' in df.attrs:
         city = df.attrs['city']
@@ -128,6 +443,12 @@ def download(body: dict = None):
     if missing:
         raise HTTPException(status_code=400, detail=f"Missing columns: {missing}")
     
+    key = (df.attrs["query_id"], city)
+    with active_downloads_lock:
+        running = download_jobs.get(active_downloads.get(key, ""))
+    if running is not None and running.status not in FINISHED:
+        return JSONResponse(status_code=202, content={"job_id": running.id, "status": running.status})
+
     # Build pairs: (fetch_id -> Mapillary image id, dest_name -> UUID)
     pairs = []
     for _, row in df.iterrows():
@@ -139,30 +460,82 @@ def download(body: dict = None):
     if not pairs:
         raise HTTPException(status_code=400, detail="No valid image pairs found in dataframe.")
     
-    # Perform the download with city context
-    result = download_pairs(pairs, city=city)
-    return result
+    with active_downloads_lock:
+        running = download_jobs.get(active_downloads.get(key, ""))
+        if running is not None and running.status not in FINISHED:
+            return JSONResponse(status_code=202, content={"job_id": running.id, "status": running.status})
+        job = download_jobs.submit("download", _run_download_job, pairs, city, key)
+        active_downloads[key] = job.id
+    return JSONResponse(status_code=202, content={"job_id": job.id, "status": job.status})
+
+def _run_download_job(job, pairs, city, key):
+    try:
+        result = download_pairs(
+            pairs,
+            city=city,
+            on_stage=job.set_stage,
+            on_progress=lambda counts: job.update(**counts),
+            should_cancel=lambda: job.cancel_requested,
+        )
+        job.check_cancelled()
+        return result
+    finally:
+        with active_downloads_lock:
+            if active_downloads.get(key) == job.id:
+                del active_downloads[key]
+
+def _download_job(job_id):
+    job = download_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Download job {job_id} not found")
+    return job
+
+@app.get("/download/jobs/{job_id}")
+def download_job_status(job_id: str):
+    """
+    Status of a download job: progress holds total, skipped, done, failed, missing_meta,
+    bytes and bytes_per_s; once done, result holds the download summary.
+    """
+    return _download_job(job_id).to_dict()
+
+@app.get("/download/jobs/{job_id}/events")
+def download_job_stream(job_id: str):
+    """Server-Sent Events with the job status: "progress" events, then one "done", "failed" or "cancelled"."""
+    job = _download_job(job_id)
+    return StreamingResponse(
+        job_events(job, DOWNLOAD_EVENT_INTERVAL),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/download/jobs/{job_id}/cancel")
+def cancel_download_job(job_id: str):
+    """Stops a download job; images already in flight finish, nothing new is started."""
+    job = _download_job(job_id)
+    job.cancel()
+    return job.to_dict()
 
 @app.post("/pairs/")
-def get_pairs(body: dict):
+def get_pairs(body: PairsRequest):
     """
-    Returns paginated pairs from latest_query.pkl.
+    Returns paginated pairs from a query result (held in memory).
+    The result is picked by query_id, or the user's latest query if omitted.
     Pagination is numeric-based (cursor = row index).
     Now includes coordinate data for map display.
     """
-    limit = body.get("limit", 50)
-    cursor = body.get("cursor", 0)
-    
-    pkl = Path("latest_query.pkl")
-    if not pkl.exists():
-        raise HTTPException(status_code=400, detail="No latest_query.pkl found.")
+    limit = body.limit
+    try:
+        cursor = int(body.cursor or 0)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
     
-    df = pd.read_pickle(pkl)
+    entry = _load_result(body.query_id, body.user_id)
+    df = entry.df
     if df.empty:
-        raise HTTPException(status_code=400, detail="No rows found in latest_query.pkl")
+        raise HTTPException(status_code=400, detail="No rows found in query result")
     
     # Get city from dataframe metadata or request
-    city = body.get("city")
+    city = body.city
     if not city and hasattr(df, 'attrs') and 'city' in df.attrs:
         city = df.attrs['city']
     
@@ -171,95 +544,95 @@ def get_pairs(body: dict):
     if missing:
         raise HTTPException(status_code=400, detail=f"Missing columns: {missing}")
     
-    # Check which pairs are already liked
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("SELECT uuid_1, uuid_2 FROM liked")
-    liked_pairs = {(row[0], row[1]) for row in cur.fetchall()}
-    con.close()
-    
     start = int(cursor)
     end = start + int(limit)
     total = len(df)
     slice_df = df.iloc[start:end]
     
-    items = []
-    for _, row in slice_df.iterrows():
-        uuid1 = row["uuid"]
-        uuid2 = row["relation_uuid"]
-        
-        # Build left image data with coordinates
-        left = {
-            "uuid": uuid1, 
-            "orig_id": row["orig_id"]
-        }
-        
-        # Add lat/lng from lat_1 and lon_1
-        if "lat_1" in row and pd.notna(row["lat_1"]):
-            left["lat"] = float(row["lat_1"])
-        if "lon_1" in row and pd.notna(row["lon_1"]):
-            left["lng"] = float(row["lon_1"])
-        
-        # Build right image data with coordinates
-        right = {
-            "uuid": uuid2, 
-            "orig_id": row["relation_orig_id"]
-        }
-        
-        # Add lat/lng from lat_2 and lon_2
-        if "lat_2" in row and pd.notna(row["lat_2"]):
-            right["lat"] = float(row["lat_2"])
-        if "lon_2" in row and pd.notna(row["lon_2"]):
-            right["lng"] = float(row["lon_2"])
-        
-        # Check if this pair is liked
-        is_liked = (uuid1, uuid2) in liked_pairs
-        
-        items.append({
-            "id": f"{uuid1}|{uuid2}",
-            "left": left,
-            "right": right,
-            "liked": is_liked,
-            "distance": row.get("distance_meters", row.get("distance", None)),
-            "city": city
-        })
+    # Liked flags come from the in-memory index, not a scan of the liked table
+    items = build_page_items(slice_df, liked_index, city)
     
     next_cursor = end if end < total else None
     return {
         "items": items,
         "total": total,
         "nextCursor": next_cursor,
-        "city": city
+        "city": city,
+        "query_id": df.attrs.get("query_id")
     }
 
 @app.get("/image")
-def get_image(uuid: str, city: str = None):
+def get_image(request: Request, uuid: str, city: str = None, size: str = None, width: int = None, format: str = "jpeg"):
     """
     Serves an image from IMAGES_DIR by UUID.
-    Searches city folders if city not specified.
+    Resolved through the in-memory image index: the given city's folder, or
+    every city folder and then the legacy root if city is not specified.
+    Optional size preset (tile, medium, full) or explicit width returns a resized
+    copy, rendered once per version of the source and then served from images/variants;
+    format may be jpeg or webp. A source that cannot be decoded gives a 422.
+    Images never change for a uuid, so responses carry an ETag and immutable
+    caching headers; revalidations get a 304 and Range requests are honoured.
     """
-    if city:
-        # Look in specific city folder
-        city = city.lower()
-        img_path = Path(IMAGES_DIR) / city / f"{uuid}.jpg"
-        if img_path.exists():
-            return FileResponse(img_path, media_type="image/jpeg")
-        raise HTTPException(status_code=404, detail=f"Image {uuid}.jpg not found in {city}")
-    
-    # Search all city folders
-    cities = ["berlin", "paris", "washington", "singapore"]
-    for city_name in cities:
-        img_path = Path(IMAGES_DIR) / city_name / f"{uuid}.jpg"
-        if img_path.exists():
-            return FileResponse(img_path, media_type="image/jpeg")
-    
-    # Fallback: check root IMAGES_DIR (for backward compatibility with old berlin images)
-    img_path = Path(IMAGES_DIR) / f"{uuid}.jpg"
-    if img_path.exists():
-        return FileResponse(img_path, media_type="image/jpeg")
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format. Must be one of: {list(FORMATS)}")
+    if width is not None:
+        if not MIN_WIDTH <= width <= MAX_WIDTH:
+            raise HTTPException(status_code=400, detail=f"width must be between {MIN_WIDTH} and {MAX_WIDTH}")
+    elif size is not None:
+        if size not in SIZE_PRESETS:
+            raise HTTPException(status_code=400, detail=f"Invalid size. Must be one of: {list(SIZE_PRESETS)}")
+        width = SIZE_PRESETS[size]
+    
+    img_path = image_index.lookup(uuid, city)
+    if img_path is not None:
+        try:
+            variant = get_variant(img_path, width, format)
+            return cached_file_response(request, variant, media_type=media_type(format))
+        except FileNotFoundError:
+            pass
+        except OSError:
+            # PIL's UnidentifiedImageError included: a truncated or corrupt download
+            raise HTTPException(status_code=422, detail=f"Image {uuid}.jpg could not be decoded")
     
+    if city:
+        raise HTTPException(status_code=404, detail=f"Image {uuid}.jpg not found in {city.lower()}")
     raise HTTPException(status_code=404, detail=f"Image {uuid}.jpg not found in any folder")
 
+def _like_change(entry, pair_id, liked, city):
+    """Resolve a 'uuid1|uuid2' id against a query result into an apply_likes() change."""
+    if not pair_id or "|" not in pair_id:
+        raise HTTPException(status_code=400, detail="Invalid pair id format. Expected 'uuid1|uuid2'")
+    
+    uuid_1, uuid_2 = pair_id.split("|", 1)
+    
+    # Find the matching row
+    row = entry.row_for(uuid_1, uuid_2)
+    if row is None:
+        raise HTTPException(status_code=404, detail=f"Pair {pair_id} not found in query results")
+    
+    return (
+        liked,
+        uuid_1,
+        uuid_2,
+        row.get("orig_id"),
+        row.get("relation_orig_id"),
+        row.get("distance_meters"),
+        city,
+    )
+
+def _apply_like_changes(changes):
+    """Write like changes in one transaction, then mirror them into the liked index."""
+    try:
+        apply_likes(changes)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    for liked, uuid_1, uuid_2, *_ in changes:
+        if liked:
+            liked_index.add(uuid_1, uuid_2)
+        else:
+            liked_index.discard(uuid_1, uuid_2)
+
 @app.post("/like/")
 def toggle_like(data: dict):
     """
@@ -267,140 +640,65 @@ def toggle_like(data: dict):
     Expected body: {
         "id": "uuid1|uuid2",
         "liked": true/false,
-        "city": "berlin" (optional, will try to get from dataframe if not provided)
+        "city": "berlin" (optional, will try to get from dataframe if not provided),
+        "query_id": "..." (optional, defaults to the user's latest query)
     }
     """
     pair_id = data.get("id")
     liked = data.get("liked", True)
-    city = data.get("city")
-    
-    if not pair_id or "|" not in pair_id:
-        raise HTTPException(status_code=400, detail="Invalid pair id format. Expected 'uuid1|uuid2'")
-    
-    uuid_1, uuid_2 = pair_id.split("|", 1)
     
     # Load the dataframe to get full pair details
-    pkl = Path("latest_query.pkl")
-    if not pkl.exists():
-        raise HTTPException(status_code=400, detail="No latest_query.pkl found.")
-    
-    df = pd.read_pickle(pkl)
+    entry = _load_result(data.get("query_id"), data.get("user_id", "default"))
     
     # Get city from dataframe if not provided
-    if not city:
-        if hasattr(df, 'attrs') and 'city' in df.attrs:
-            city = df.attrs['city']
-        else:
-            # Try to infer from query results or default to None
-            city = None
-    
-    # Find the matching row
-    row = df[(df["uuid"] == uuid_1) & (df["relation_uuid"] == uuid_2)]
-    
-    if row.empty:
-        raise HTTPException(status_code=404, detail=f"Pair {pair_id} not found in query results")
-    
-    row = row.iloc[0]
-    orig_id_1 = row.get("orig_id")
-    orig_id_2 = row.get("relation_orig_id")
-    distance = row.get("distance_meters")
-    lat_1 = row.get("lat_1")
-    lon_1 = row.get("lon_1")
-    lat_2 = row.get("lat_2")
-    lon_2 = row.get("lon_2")
+    city = data.get("city") or entry.df.attrs.get("city")
     
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    
-    try:
-        if liked:
-            # Add like (avoid duplicates using ON CONFLICT)
-            cur.execute("""
-                INSERT INTO liked (uuid_1, uuid_2, orig_id_1, orig_id_2, distance, city, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-                ON CONFLICT(uuid_1, uuid_2) DO UPDATE SET
-                    distance = excluded.distance,
-                    city = excluded.city,
-                    created_at = CURRENT_TIMESTAMP
-            """, (uuid_1, uuid_2, orig_id_1, orig_id_2, distance, city))
-        else:
-            # Remove like
-            cur.execute("""
-                DELETE FROM liked WHERE uuid_1 = ? AND uuid_2 = ?
-            """, (uuid_1, uuid_2))
-        
-        con.commit()
-        return JSONResponse(content={"success": True, "liked": liked})
-    except Exception as e:
-        con.rollback()
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        con.close()
+    _apply_like_changes([_like_change(entry, pair_id, liked, city)])
+    return JSONResponse(content={"success": True, "liked": liked})
+
+@app.post("/like/batch")
+def toggle_likes(data: LikeBatchRequest):
+    """
+    Applies many like toggles in one transaction.
+    Toggles are applied in order, so the last one wins for a repeated pair.
+    Pairs that are not in the query result are skipped and reported in not_found.
+    """
+    entry = _load_result(data.query_id, data.user_id)
+    city = data.city or entry.df.attrs.get("city")
+    
+    changes = []
+    not_found = []
+    for item in data.items:
+        try:
+            changes.append(_like_change(entry, item.id, item.liked, city))
+        except HTTPException as e:
+            if e.status_code != 404:
+                raise
+            not_found.append(item.id)
+    
+    if changes:
+        _apply_like_changes(changes)
+    return JSONResponse(content={
+        "success": True,
+        "applied": len(changes),
+        "not_found": not_found
+    })
 
 
 @app.get("/liked/")
-def get_liked(city: str = None):
+def get_liked(city: str = None, limit: int = None, cursor: str = None):
     """
-    Returns all liked pairs, optionally filtered by city.
-    Query parameter: city (optional) - filter results by city name
+    Returns liked pairs, newest first, optionally filtered by city.
+    Query parameters: city (optional) - filter results by city name,
+    limit (optional) - page size, cursor (optional) - nextCursor of the previous page.
+    Without a limit every liked pair is returned in one response.
     """
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    
-    # Check which columns exist
-    cur.execute("PRAGMA table_info(liked)")
-    columns = [row[1] for row in cur.fetchall()]
-    has_created_at = "created_at" in columns
-    has_city = "city" in columns
-    
-    # Build query based on available columns and filters
-    select_cols = ["uuid_1", "uuid_2", "orig_id_1", "orig_id_2", "distance"]
-    if has_city:
-        select_cols.append("city")
-    if has_created_at:
-        select_cols.append("created_at")
-    
-    query = f"SELECT {', '.join(select_cols)} FROM liked"
-    params = []
-    
-    if city and has_city:
-        query += " WHERE city = ?"
-        params.append(city.lower())
-    
-    if has_created_at:
-        query += " ORDER BY created_at DESC"
-    
-    cur.execute(query, params)
-    rows = cur.fetchall()
-    con.close()
-    
-    items = []
-    for row in rows:
-        # Handle potential bytes values
-        def safe_value(val):
-            if isinstance(val, bytes):
-                try:
-                    return val.decode('utf-8')
-                except:
-                    return str(val)
-            return val
-        
-        item = {
-            "uuid_1": safe_value(row[0]),
-            "uuid_2": safe_value(row[1]),
-            "orig_id_1": safe_value(row[2]),
-            "orig_id_2": safe_value(row[3]),
-            "distance": row[4] if row[4] is not None else None
-        }
-        
-        col_idx = 5
-        if has_city and len(row) > col_idx:
-            item["city"] = safe_value(row[col_idx])
-            col_idx += 1
-        
-        if has_created_at and len(row) > col_idx:
-            item["created_at"] = safe_value(row[col_idx])
-        
-        items.append(item)
+    if limit is not None and not 1 <= limit <= 1000:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 1000")
+    try:
+        items, next_cursor, total = fetch_liked_page(city, limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
     
-    return {"items": items, "total": len(items)}
\ No newline at end of file
+    # total is only counted for the first page
+    return {"items": items, "total": total, "nextCursor": next_cursor}
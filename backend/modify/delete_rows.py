@@ -12,6 +12,8 @@ import os
 from typing import List
 from sqlalchemy import text, bindparam
 from utils.db import get_db_connection
+from utils.create_slice import drop_slice_tables
+from utils.query_cache import invalidate_city
 
 # -------- Config (no CLI args) --------
 DELETE_LIST_PATH = "delete_uuids_by_quality.txt"   # one UUID per line
@@ -86,5 +88,10 @@ def main():
         print(f"  Rows matched before delete: {pre_count_total}")
     print(f"  Rows deleted: {deleted_total}")
 
+    if deleted_total:
+        # cached pairs and slices may still reference the deleted rows
+        invalidate_city(TABLE_NAME)
+        drop_slice_tables(TABLE_NAME)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
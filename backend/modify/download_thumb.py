@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
 import re
-import json
 import time
 import pathlib
 from typing import Optional
@@ -13,13 +12,20 @@ from dotenv import load_dotenv
 from tqdm import tqdm
 import os
 
+from config import MAPILLARY_BATCH_IDS
+from utils.mapillary import resolve_urls
+from utils.url_cache import url_cache
+from utils.download_journal import DownloadJournal, atomic_open
+
 # --- Config (no CLI args) ---
 CSV_PATH = "all_groups_with_orig.csv"       # columns: uuid, orig_id, group_id
 OUTPUT_DIR = pathlib.Path("singapore")           # base folder for images
 MANIFEST_PATH = "download_manifest.csv"     # log of attempts/results
+JOURNAL_PATH = "download_journal.jsonl"     # appended per image; a rerun resumes from it
 API_BASE = "https://graph.mapillary.com"
 FIELDS = "thumb_1024_url"
 GROUP_FOLDER_FMT = "group_{:05d}"
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png", ".webp")
 # ----------------------------
 
 def load_token() -> str:
@@ -50,24 +56,21 @@ def requests_session_with_retries(total=5, backoff=0.5) -> requests.Session:
     s.headers.update({"User-Agent": "mapillary-thumb-downloader/1.0"})
     return s
 
-def fetch_thumb_url(session: requests.Session, token: str, image_id: str) -> Optional[str]:
-    url = f"{API_BASE}/{image_id}"
-    params = {"access_token": token, "fields": FIELDS}
-    r = session.get(url, params=params, timeout=20)
-    if r.status_code != 200:
-        return None
-    try:
-        data = r.json()
-    except json.JSONDecodeError:
-        return None
-    return data.get("thumb_1024_url")
+def _local_path(gid: int, image_id: str, url: Optional[str] = None) -> pathlib.Path:
+    """OUTPUT_DIR/group_XXXXX/{image_id}, with the URL's image extension if it has one, else .jpg"""
+    ext = pathlib.Path(url.split("?")[0]).suffix.lower() if url else ""
+    return OUTPUT_DIR / GROUP_FOLDER_FMT.format(gid) / f"{image_id}{ext if ext in IMAGE_SUFFIXES else '.jpg'}"
+
+def _existing_file(gid: int, image_id: str) -> Optional[pathlib.Path]:
+    """The image saved by an earlier run, whichever extension its URL gave it"""
+    path = _local_path(gid, image_id)
+    return next((p for p in map(path.with_suffix, IMAGE_SUFFIXES) if p.exists()), None)
 
 def download_file(session: requests.Session, url: str, dest: pathlib.Path) -> bool:
     with session.get(url, stream=True, timeout=60) as r:
         if r.status_code != 200:
             return False
-        dest.parent.mkdir(parents=True, exist_ok=True)
-        with open(dest, "wb") as f:
+        with atomic_open(dest) as f:
             for chunk in r.iter_content(chunk_size=8192):
                 if chunk:
                     f.write(chunk)
@@ -97,43 +100,46 @@ def main():
         return
 
     session = requests_session_with_retries()
-
-    results = []
-    for _idx, row in tqdm(df.iterrows(), total=len(df), desc="Downloading thumb_1024", unit="img"):
-        image_id = row["orig_id"]
-        gid = int(row["group_id"])  # guaranteed not NA now
-        out_dir = OUTPUT_DIR / GROUP_FOLDER_FMT.format(gid)
-
-        filename = f"{image_id}.jpg"
-        dest = out_dir / filename
-
-        if dest.exists():
-            results.append({"orig_id": image_id, "group_id": gid, "status": "exists", "path": str(dest), "thumb_1024_url": ""})
-            continue
-
-        thumb_url = fetch_thumb_url(session, token, image_id)
-        if not thumb_url:
-            results.append({"orig_id": image_id, "group_id": gid, "status": "no_thumb_url", "path": "", "thumb_1024_url": ""})
-            continue
-
-        # choose extension from URL if present
-        ext = pathlib.Path(thumb_url.split("?")[0]).suffix.lower()
-        if ext in {".jpg", ".jpeg", ".png", ".webp"}:
-            dest = dest.with_suffix(ext)
-
-        ok = download_file(session, thumb_url, dest)
-        results.append({
-            "orig_id": image_id,
-            "group_id": gid,
-            "status": "ok" if ok else "failed",
-            "path": str(dest if ok else ""),
-            "thumb_1024_url": thumb_url,
-        })
-
-        time.sleep(0.01)  # polite pacing
-
-    # Manifest
-    man = pd.DataFrame(results)
+    journal = DownloadJournal(JOURNAL_PATH)
+    done = journal.done()  # finished by an earlier run: skipped without checking the files
+
+    # URLs are resolved one ?ids= batch at a time, right before that batch is downloaded,
+    # so they cannot expire while earlier batches are still downloading
+    # (URLs resolved by an earlier run within URL_CACHE_TTL_SECONDS come from the cache)
+    rows = [(image_id, int(gid)) for image_id, gid in df[["orig_id", "group_id"]].itertuples(index=False)]
+    with tqdm(total=len(rows), desc="Downloading thumb_1024", unit="img") as bar:
+        for start in range(0, len(rows), MAPILLARY_BATCH_IDS):
+            batch = [(image_id, gid) for image_id, gid in rows[start:start + MAPILLARY_BATCH_IDS] if image_id not in done]
+            existing = {image_id: _existing_file(gid, image_id) for image_id, gid in batch}
+            pending = [image_id for image_id, _gid in batch if existing[image_id] is None]
+            thumb_urls = resolve_urls(pending, FIELDS, token, session, api_base=API_BASE, cache=url_cache) if pending else {}
+
+            for image_id, gid in batch:
+                bar.update()
+                dest = existing[image_id]
+                if dest is not None:
+                    journal.record(image_id, "exists", group_id=gid, path=str(dest), thumb_1024_url="")
+                    continue
+
+                thumb_url = thumb_urls.get(image_id)
+                if not thumb_url:
+                    journal.record(image_id, "no_thumb_url", group_id=gid, path="", thumb_1024_url="")
+                    continue
+
+                dest = _local_path(gid, image_id, thumb_url)
+                ok = download_file(session, thumb_url, dest)
+                journal.record(image_id, "ok" if ok else "failed", group_id=gid, path=str(dest if ok else ""), thumb_1024_url=thumb_url)
+
+                time.sleep(0.01)  # polite pacing
+            bar.update(min(MAPILLARY_BATCH_IDS, len(rows) - start) - len(batch))  # rows finished by an earlier run
+
+    # Manifest: latest journal entry of every row, including those finished by earlier runs
+    entries = journal.entries()
+    journal.close()
+    man = pd.DataFrame([
+        {"orig_id": e["key"], "group_id": e["group_id"], "status": e["status"], "path": e["path"], "thumb_1024_url": e["thumb_1024_url"]}
+        for e in (entries[i] for i in df["orig_id"] if i in entries)
+    ])
     man.to_csv(MANIFEST_PATH, index=False)
 
     total = len(man)
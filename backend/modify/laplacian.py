@@ -21,7 +21,6 @@ Requires:
 from __future__ import annotations
 import os
 import re
-import json
 import time
 import math
 import pathlib
@@ -36,6 +35,11 @@ from tqdm import tqdm
 import cv2
 from sqlalchemy import text, bindparam
 from utils.db import get_db_connection
+from utils.mapillary import resolve_urls
+from utils.url_cache import url_cache
+from utils.download_journal import DownloadJournal, atomic_open
+from utils.create_slice import drop_slice_tables
+from utils.query_cache import invalidate_city
 
 # ------------------- Config -------------------
 TABLE_NAME = "singapore"
@@ -49,6 +53,7 @@ OUTPUT_DIR = pathlib.Path("thumb_256")
 QUALITY_CSV = "image_quality_laplacian.csv"
 DELETE_LIST_PATH = "delete_uuids_by_quality.txt"
 MANIFEST_CSV = "thumb_256_manifest.csv"
+JOURNAL_PATH = "thumb_256_journal.jsonl"    # appended per image (status + score); a rerun resumes from it
 
 # Selection mode: "percentile" (dataset-relative) or "absolute"
 SELECTION_MODE = "percentile"   # "percentile" | "absolute"
@@ -93,18 +98,6 @@ def requests_session_with_retries(total=5, backoff=0.5) -> requests.Session:
     s.headers.update({"User-Agent": "quality-pruner/1.0"})
     return s
 
-def fetch_thumb256_url(session: requests.Session, token: str, image_id: str) -> Optional[str]:
-    url = f"{API_BASE}/{image_id}"
-    params = {"access_token": token, "fields": FIELDS}
-    r = session.get(url, params=params, timeout=20)
-    if r.status_code != 200:
-        return None
-    try:
-        data = r.json()
-    except json.JSONDecodeError:
-        return None
-    return data.get("thumb_256_url")
-
 def clean_id(x: Optional[str]) -> Optional[str]:
     if x is None:
         return None
@@ -136,8 +129,7 @@ def download_file(session: requests.Session, url: str, dest: pathlib.Path) -> bo
     with session.get(url, stream=True, timeout=60) as r:
         if r.status_code != 200:
             return False
-        dest.parent.mkdir(parents=True, exist_ok=True)
-        with open(dest, "wb") as f:
+        with atomic_open(dest) as f:
             for chunk in r.iter_content(chunk_size=8192):
                 if chunk:
                     f.write(chunk)
@@ -200,6 +192,10 @@ def delete_rows(uuids: List[str]) -> int:
             res = conn.execute(stmt, {"ids": chunk})
             rc = res.rowcount if res.rowcount is not None and res.rowcount >= 0 else 0
             deleted_total += rc
+    if deleted_total:
+        # cached pairs and slices may still reference the deleted rows
+        invalidate_city(TABLE_NAME)
+        drop_slice_tables(TABLE_NAME)
     return deleted_total
 
 def main():
@@ -215,11 +211,22 @@ def main():
     print(f"Found {total_rows} rows in {TABLE_NAME}.")
 
     session = requests_session_with_retries(RETRY_TOTAL, BACKOFF_FACTOR)
+    journal = DownloadJournal(JOURNAL_PATH)
+    # downloaded and scored by an earlier run: skipped without touching the files
+    done = journal.done() if SKIP_EXISTING else set()
+
+    # resolve the URLs of all thumbs still to download, in batched ?ids= lookups
+    # (URLs resolved by an earlier run within URL_CACHE_TTL_SECONDS come from the cache)
+    pending = [
+        o for u, o in df_ids[["uuid", "orig_id"]].itertuples(index=False)
+        if u not in done and not (SKIP_EXISTING and (OUTPUT_DIR / f"{o}.jpg").exists())
+    ]
+    thumb_urls = resolve_urls(pending, FIELDS, token, session, api_base=API_BASE, cache=url_cache)
 
     # 2) Download and score
-    records = []
-    manifest = []
     for uuid, orig_id in tqdm(df_ids[["uuid","orig_id"]].itertuples(index=False), total=total_rows, desc="thumb_256 + Laplacian"):
+        if uuid in done:
+            continue
         # set destination path
         dest = OUTPUT_DIR / f"{orig_id}.jpg"
 
@@ -227,9 +234,9 @@ def main():
         if SKIP_EXISTING and dest.exists():
             status = "exists"
         else:
-            url = fetch_thumb256_url(session, token, orig_id)
+            url = thumb_urls.get(orig_id)
             if not url:
-                manifest.append({"uuid": uuid, "orig_id": orig_id, "status": "no_thumb_url", "path": "", "thumb_256_url": ""})
+                journal.record(uuid, "no_thumb_url", orig_id=orig_id, path="")
                 continue
             # choose extension by URL
             ext = pathlib.Path(url.split("?")[0]).suffix.lower()
@@ -239,15 +246,22 @@ def main():
             status = "ok" if ok else "failed"
             time.sleep(SLEEP_BETWEEN)
 
-        manifest.append({"uuid": uuid, "orig_id": orig_id, "status": status, "path": str(dest if dest.exists() else ""), "thumb_256_url": ""})
-
         # 3) score (only if file present)
         if dest.exists():
             score = laplacian_sharpness_from_path(dest)
         else:
             score = float("nan")
 
-        records.append({"uuid": uuid, "orig_id": orig_id, "path": str(dest), "sharpness": score})
+        journal.record(uuid, status, orig_id=orig_id, path=str(dest if dest.exists() else ""), scored_path=str(dest), sharpness=score)
+
+    # latest journal entry of every row, including those finished by earlier runs
+    entries = journal.entries()
+    journal.close()
+    manifest, records = [], []
+    for e in (entries[u] for u in df_ids["uuid"] if u in entries):
+        manifest.append({"uuid": e["key"], "orig_id": e["orig_id"], "status": e["status"], "path": e["path"], "thumb_256_url": ""})
+        if e["status"] != "no_thumb_url":
+            records.append({"uuid": e["key"], "orig_id": e["orig_id"], "path": e["scored_path"], "sharpness": e["sharpness"]})
 
     # Write manifest & quality CSV
     pd.DataFrame(manifest).to_csv(MANIFEST_CSV, index=False)
@@ -0,0 +1,58 @@
+# bench_download.py
+# download_pairs throughput against a local stub Graph API with simulated latency:
+# the old sequential loop (plain requests.get per id, new connection per call) vs batched
+# metadata lookups and the pooled concurrent downloader.
+# Run from the backend dir: MAPILLARY_TOKEN=x PYTHONPATH=. python tests/bench_download.py
+import contextlib
+import io
+import tempfile
+import time
+from pathlib import Path
+
+import requests
+
+import utils.download as download
+from stub_graph import StubGraph
+from utils.image_index import ImageIndex
+
+IMAGES = 200
+LATENCY = 0.03  # seconds per request
+WORKER_COUNTS = (1, 4, 16, 32)
+
+
+def old_download(pairs, city):
+    """What download_pairs did before: one image at a time, two fresh requests.get calls each."""
+    for fid, dest in pairs:
+        meta = requests.get(f"{download.GRAPH_BASE}/{fid}?fields=id,{download.URL_FIELD}", timeout=12)
+        resp = requests.get(meta.json()[download.URL_FIELD], timeout=20)
+        download._local_path(dest, city).write_bytes(resp.content)
+
+
+def run(label, stub, fn):
+    with tempfile.TemporaryDirectory() as tmp:
+        download.IMAGES_DIR = Path(tmp)
+        download.image_index = ImageIndex(Path(tmp))
+        pairs = [(str(10_000 + i), f"u{i}") for i in range(IMAGES)]
+        stub.connections.clear()
+        stub.metadata_requests = 0
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            fn(pairs)
+        elapsed = time.perf_counter() - t0
+    print(f"{label:<28} {IMAGES / elapsed:>8.1f} images/s  "
+          f"({elapsed:.2f}s, {len(stub.connections)} connections, {stub.metadata_requests} metadata calls)")
+
+
+def main():
+    with StubGraph(latency=LATENCY) as stub:
+        download.GRAPH_BASE = stub.base
+        download.url_cache = None  # cold runs: every URL is resolved
+        print(f"{IMAGES} images, {LATENCY * 1000:.0f} ms per request")
+        run("sequential, no session", stub, lambda pairs: old_download(pairs, "berlin"))
+        for workers in WORKER_COUNTS:
+            run(f"pooled, {workers} workers", stub,
+                lambda pairs, w=workers: download.download_pairs(pairs, "berlin", workers=w))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# bench_likes.py
+# Like-write throughput: connect-per-click (old /like/ path) vs pooled WAL connections vs /like/batch.
+# Run from the backend dir: PYTHONPATH=. python tests/bench_likes.py
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import utils.helper_db as helper_db
+
+THREADS = 8
+CLICKS_PER_THREAD = 250
+BATCH_SIZE = 50
+
+
+def change(t, i):
+    return (i % 3 != 0, f"u{t}_{i}", f"v{t}_{i}", 1000 + i, 2000 + i, 12.5, "berlin")
+
+
+def old_click(t, i):
+    """What /like/ did before: fresh connection, default journal, commit per click."""
+    liked, u1, u2, o1, o2, dist, city = change(t, i)
+    con = sqlite3.connect(helper_db.DB_PATH, timeout=30)
+    cur = con.cursor()
+    if liked:
+        cur.execute(helper_db.LIKE_UPSERT, (u1, u2, o1, o2, dist, city))
+    else:
+        cur.execute(helper_db.LIKE_DELETE, (u1, u2))
+    con.commit()
+    con.close()
+
+
+def pooled_click(t, i):
+    helper_db.apply_likes([change(t, i)])
+
+
+def run(label, worker_fn):
+    def worker(t):
+        worker_fn(t)
+
+    threads = [threading.Thread(target=worker, args=(t,)) for t in range(THREADS)]
+    t0 = time.perf_counter()
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    elapsed = time.perf_counter() - t0
+    total = THREADS * CLICKS_PER_THREAD
+    print(f"{label:<28} {total / elapsed:>10.0f} likes/s  ({elapsed:.2f}s for {total})")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        old_db = str(Path(tmp) / "old.db")
+        helper_db.DB_PATH = old_db
+        helper_db.init_db()
+        run("connect per click", lambda t: [old_click(t, i) for i in range(CLICKS_PER_THREAD)])
+
+        helper_db.DB_PATH = str(Path(tmp) / "pooled.db")
+        helper_db.init_db()
+        run("pooled WAL, one per txn", lambda t: [pooled_click(t, i) for i in range(CLICKS_PER_THREAD)])
+
+        helper_db.DB_PATH = str(Path(tmp) / "batch.db")
+        helper_db.init_db()
+
+        def batches(t):
+            for start in range(0, CLICKS_PER_THREAD, BATCH_SIZE):
+                helper_db.apply_likes([change(t, i) for i in range(start, start + BATCH_SIZE)])
+
+        run(f"pooled WAL, batch of {BATCH_SIZE}", batches)
+
+
+if __name__ == "__main__":
+    main()
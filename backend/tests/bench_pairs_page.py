@@ -0,0 +1,84 @@
+# bench_pairs_page.py
+# Micro-benchmark for /pairs/ page serialization: the old iterrows loop vs build_page_items.
+# Run from the backend dir: PYTHONPATH=. python tests/bench_pairs_page.py
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.pages import build_page_items
+
+ROWS = 200_000
+PAGE_SIZES = (50, 200, 1000)
+REPEATS = 30
+
+
+def make_frame(n: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "uuid": [f"u{i:08d}" for i in range(n)],
+        "relation_uuid": [f"v{i:08d}" for i in range(n)],
+        "orig_id": rng.integers(10 ** 14, 10 ** 15, n),
+        "relation_orig_id": rng.integers(10 ** 14, 10 ** 15, n),
+        "h_1": rng.uniform(0, 360, n),
+        "h_2": rng.uniform(0, 360, n),
+        "lon_1": rng.uniform(13.3, 13.5, n),
+        "lon_2": rng.uniform(13.3, 13.5, n),
+        "lat_1": rng.uniform(52.4, 52.6, n),
+        "lat_2": rng.uniform(52.4, 52.6, n),
+        "distance_meters": rng.uniform(5, 20, n),
+        "source": "mapillary",
+    })
+    df.loc[df.sample(frac=0.05, random_state=0).index, "lat_2"] = np.nan
+    return df
+
+
+def iterrows_items(slice_df, liked_pairs, city):
+    """The per-row implementation /pairs/ used before build_page_items."""
+    items = []
+    for _, row in slice_df.iterrows():
+        uuid1 = row["uuid"]
+        uuid2 = row["relation_uuid"]
+        left = {"uuid": uuid1, "orig_id": row["orig_id"]}
+        if "lat_1" in row and pd.notna(row["lat_1"]):
+            left["lat"] = float(row["lat_1"])
+        if "lon_1" in row and pd.notna(row["lon_1"]):
+            left["lng"] = float(row["lon_1"])
+        right = {"uuid": uuid2, "orig_id": row["relation_orig_id"]}
+        if "lat_2" in row and pd.notna(row["lat_2"]):
+            right["lat"] = float(row["lat_2"])
+        if "lon_2" in row and pd.notna(row["lon_2"]):
+            right["lng"] = float(row["lon_2"])
+        items.append({
+            "id": f"{uuid1}|{uuid2}",
+            "left": left,
+            "right": right,
+            "liked": (uuid1, uuid2) in liked_pairs,
+            "distance": row.get("distance_meters", row.get("distance", None)),
+            "city": city,
+        })
+    return items
+
+
+def per_page_ms(fn, df, limit, liked):
+    start = len(df) // 2
+    best = float("inf")
+    for _ in range(REPEATS):
+        t0 = time.perf_counter()
+        fn(df.iloc[start:start + limit], liked, "berlin")
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def main():
+    df = make_frame(ROWS)
+    liked = {(f"u{i:08d}", f"v{i:08d}") for i in range(0, ROWS, 97)}
+    print(f"{'rows/page':>10} {'iterrows ms':>12} {'columnar ms':>12} {'speedup':>8}")
+    for limit in PAGE_SIZES:
+        before = per_page_ms(iterrows_items, df, limit, liked)
+        after = per_page_ms(build_page_items, df, limit, liked)
+        print(f"{limit:>10} {before:>12.3f} {after:>12.3f} {before / after:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
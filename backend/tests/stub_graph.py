@@ -0,0 +1,101 @@
+# stub_graph.py
+# Local stand-in for the Mapillary Graph API and its image CDN, for download tests and benchmarks.
+#   GET /{id}?fields=...   -> {"id": id, "thumb_original_url": ".../img/{id}.jpg"}  (404 for missing ids, 400 if not numeric)
+#   GET /?ids=a,b&fields=  -> {"a": {...}, "b": {...}}  (400 for the whole batch if any id is missing or not numeric)
+#   GET /img/{id}.jpg      -> image bytes
+# Statuses queued in `errors` (e.g. [429, 503]) answer the next metadata requests instead, one each.
+# Every request sleeps `latency` seconds to stand in for the network round trip.
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+IMAGE_BYTES = b"\xff\xd8\xff\xe0" + b"\x00" * 2048 + b"\xff\xd9"
+
+
+class StubGraph:
+    def __init__(self, latency=0.0, missing=(), broken=()):
+        self.latency = latency
+        self.missing = set(missing)   # ids without metadata
+        self.broken = set(broken)     # ids whose image request fails
+        self.errors = []              # statuses for the next metadata requests
+        self.requests = 0
+        self.metadata_requests = 0
+        self.connections = set()
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def metadata(self, image_id):
+        url = f"{self.base}/img/{image_id}.jpg"
+        return {"id": image_id, "thumb_original_url": url, "thumb_1024_url": url, "thumb_256_url": url}
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive
+            disable_nagle_algorithm = True  # headers and body go out in separate writes
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body, content_type):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                with stub._lock:
+                    stub.requests += 1
+                    stub.connections.add(self.client_address)
+                if stub.latency:
+                    time.sleep(stub.latency)
+                parts = urlsplit(self.path)
+                path = parts.path.strip("/")
+                if path.startswith("img/"):
+                    image_id = path[4:].removesuffix(".jpg")
+                    if image_id in stub.broken:
+                        self._send(500, b"boom", "text/plain")
+                    else:
+                        self._send(200, IMAGE_BYTES, "image/jpeg")
+                    return
+                with stub._lock:
+                    stub.metadata_requests += 1
+                    status = stub.errors.pop(0) if stub.errors else None
+                if status:
+                    self._send(status, b'{"error": {"message": "stub error"}}', "application/json")
+                    return
+                if not path:
+                    ids = parse_qs(parts.query).get("ids", [""])[0].split(",")
+                    bad = [i for i in ids if not i.isdigit() or i in stub.missing]
+                    if bad:
+                        body = {"error": {"message": f"Unsupported get request. Object with ID '{bad[0]}' does not exist"}}
+                        self._send(400, json.dumps(body).encode(), "application/json")
+                        return
+                    body = {i: stub.metadata(i) for i in ids}
+                    self._send(200, json.dumps(body).encode(), "application/json")
+                    return
+                if not path.isdigit():
+                    self._send(400, b'{"error": {"message": "Invalid id"}}', "application/json")
+                    return
+                if path in stub.missing:
+                    body = {"error": {"message": f"Unsupported get request. Object with ID '{path}' does not exist"}}
+                    self._send(404, json.dumps(body).encode(), "application/json")
+                    return
+                self._send(200, json.dumps(stub.metadata(path)).encode(), "application/json")
+
+        return Handler
@@ -0,0 +1,193 @@
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import utils.download as download
+import utils.helper_db as helper_db
+import utils.query_history as query_history
+import utils.variants as variants
+from stub_graph import StubGraph
+from utils.image_index import ImageIndex
+from utils.pair_engine import PairEngine
+from utils.result_store import ResultStore
+from utils.url_cache import UrlCache
+
+QUERY = {"city": "berlin", "inner_buffer": 5, "outer_buffer": 30}
+
+
+def _points(n=120, seed=3):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "uuid": [f"{i:05x}" for i in range(n)],
+        "orig_id": pd.array(325287995681000 + np.arange(n), dtype="Int64"),
+        "heading": rng.uniform(0, 360, n),
+        "x": rng.uniform(0, 150, n),
+        "y": rng.uniform(0, 150, n),
+        "lon": 13.4 + rng.uniform(0, 0.002, n),
+        "lat": 52.5 + rng.uniform(0, 0.001, n),
+        "source": "mly",
+    })
+
+
+@pytest.fixture(scope="module")
+def main_module(tmp_path_factory):
+    """main, imported in a scratch directory: at import it opens liked.db and scans images/."""
+    workdir = tmp_path_factory.mktemp("app")
+    with pytest.MonkeyPatch.context() as mp:
+        mp.chdir(workdir)
+        mp.setattr(helper_db, "DB_PATH", str(workdir / "liked.db"))
+        mp.setattr(query_history, "DB_PATH", str(workdir / "query_history.db"))
+        helper_db.init_db()
+        import main
+    return main
+
+
+@pytest.fixture
+def client(main_module, tmp_path, monkeypatch):
+    """The app on a fresh working directory, with the KD-tree engine over synthetic points instead of PostGIS."""
+    main = main_module
+    monkeypatch.chdir(tmp_path)  # results/, query_cache/, latest_queries.json
+    monkeypatch.setattr(helper_db, "DB_PATH", str(tmp_path / "liked.db"))
+    helper_db.init_db()
+    helper_db.ensure_liked_indexes()
+    monkeypatch.setattr(query_history, "DB_PATH", str(tmp_path / "query_history.db"))
+    query_history.ensure_query_history()
+    monkeypatch.setattr(main, "result_store", ResultStore(1024 ** 3, ttl_seconds=3600))
+    monkeypatch.setattr(main, "latest_query_ids", {})
+    monkeypatch.setattr(main, "liked_index", helper_db.LikedIndex().load())
+    monkeypatch.setattr(main, "PAIR_ENGINE", "kdtree")
+    engine = PairEngine(_points())
+    monkeypatch.setattr(main, "get_pair_engine", lambda city: engine)
+
+    monkeypatch.setattr(download, "IMAGES_DIR", tmp_path / "images")
+    monkeypatch.setattr(download, "image_index", ImageIndex(tmp_path / "images"))
+    monkeypatch.setattr(download, "url_cache", UrlCache(tmp_path / "urls.db", ttl_seconds=3600))
+    return TestClient(main.app)
+
+
+def _wait(client, url, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        state = client.get(url).json()
+        if state["status"] in ("done", "failed", "cancelled"):
+            return state
+        assert time.monotonic() < deadline, state
+        time.sleep(0.02)
+
+
+def _run_query(client, **params):
+    r = client.post("/query/", json={**QUERY, **params})
+    assert r.status_code == 202
+    state = _wait(client, f"/query/jobs/{r.json()['job_id']}")
+    assert state["status"] == "done", state["error"]
+    return state["result"]
+
+
+def test_query_pairs_like_export_round_trip(client):
+    result = _run_query(client)
+    query_id, count = result["query_id"], result["count"]
+    assert count > 20 and not result["cached"]
+    assert result["export_url"] == f"/query/{query_id}/export"
+
+    page = client.post("/pairs/", json={"query_id": query_id, "limit": 10}).json()
+    assert (page["total"], page["nextCursor"], page["query_id"], page["city"]) == (count, 10, query_id, "berlin")
+    assert len(page["items"]) == 10 and not any(item["liked"] for item in page["items"])
+    assert isinstance(page["items"][0]["left"]["orig_id"], int)
+    ids = [item["id"] for item in page["items"][:3]]
+
+    r = client.post("/like/batch", json={"query_id": query_id, "items": [
+        {"id": ids[0]}, {"id": ids[1]}, {"id": ids[2]}, {"id": ids[2], "liked": False}, {"id": "nope|nope"},
+    ]})
+    assert r.json() == {"success": True, "applied": 4, "not_found": ["nope|nope"]}
+    assert client.post("/like/", json={"id": ids[2], "liked": True}).json()["liked"] is True
+    # without a query_id, /pairs/ and /like/ use the user's latest query
+    page = client.post("/pairs/", json={"limit": 10}).json()
+    assert page["query_id"] == query_id
+    assert [item["liked"] for item in page["items"][:4]] == [True, True, True, False]
+
+    first = client.get("/liked/", params={"limit": 2}).json()
+    assert first["total"] == 3 and len(first["items"]) == 2
+    rest = client.get("/liked/", params={"limit": 2, "cursor": first["nextCursor"]}).json()
+    assert rest["total"] is None and len(rest["items"]) == 1 and rest["nextCursor"] is None
+    assert {(i["uuid_1"], i["uuid_2"]) for i in first["items"] + rest["items"]} == {tuple(i.split("|")) for i in ids}
+    assert client.get("/liked/", params={"cursor": "garbage"}).status_code == 400
+
+    r = client.get(f"/query/{query_id}/export")
+    assert r.status_code == 200 and r.headers["content-type"].startswith("text/csv")
+    lines = r.text.splitlines()
+    assert len(lines) == count + 1
+    assert ",325287995681" in lines[1] and ".0," not in lines[1].split(",325287995681")[1][:4]
+
+    history = client.get("/query/history").json()["items"]
+    assert history[0]["query_id"] == query_id and history[0]["engine"] == "kdtree"
+    estimate = client.post("/query/estimate", json=QUERY).json()
+    assert estimate["exact"] and estimate["estimate"] == count
+
+
+def test_repeated_query_is_served_from_the_cache(client):
+    first = _run_query(client)
+    second = _run_query(client)
+    assert second["cached"] and second["count"] == first["count"]
+    assert second["query_id"] != first["query_id"]
+    assert client.post("/pairs/", json={"limit": 1}).json()["query_id"] == second["query_id"]
+    # the earlier result can still be paged by its id
+    assert client.post("/pairs/", json={"query_id": first["query_id"], "limit": 1}).json()["total"] == first["count"]
+
+
+def test_unknown_results_and_jobs(client):
+    assert client.post("/pairs/", json={"limit": 5}).status_code == 400
+    assert client.post("/pairs/", json={"query_id": "not-an-id"}).status_code == 400
+    assert client.post("/pairs/", json={"query_id": "0" * 32}).status_code == 404
+    assert client.get(f"/query/{'0' * 32}/export").status_code == 404
+    assert client.get("/query/jobs/nope").status_code == 404
+    assert client.get("/download/jobs/nope").status_code == 404
+    assert client.post("/query/", json={"city": "atlantis"}).status_code == 400
+
+
+def test_download_job_status_events_and_cancel(client, tmp_path, monkeypatch):
+    query_id = _run_query(client)["query_id"]
+    with StubGraph(latency=0.02) as stub:
+        monkeypatch.setattr(download, "GRAPH_BASE", stub.base)
+        r = client.post("/download/", json={"query_id": query_id})
+        assert r.status_code == 202
+        job_id = r.json()["job_id"]
+        # the same result is not downloaded twice at once
+        assert client.post("/download/", json={"query_id": query_id}).json()["job_id"] == job_id
+        assert client.post(f"/download/jobs/{job_id}/cancel").json()["job_id"] == job_id
+        assert _wait(client, f"/download/jobs/{job_id}")["status"] == "cancelled"
+
+        # a finished job no longer blocks a new one for the same result
+        stub.latency = 0
+        r = client.post("/download/", json={"query_id": query_id})
+        assert r.json()["job_id"] != job_id
+        events = client.get(f"/download/jobs/{r.json()['job_id']}/events").text
+        state = client.get(f"/download/jobs/{r.json()['job_id']}").json()
+
+    assert "event: done" in events
+    assert state["status"] == "done"
+    saved = len(list((tmp_path / "images" / "berlin").glob("*.jpg")))
+    assert saved == state["progress"]["total"] > 0
+    assert state["result"]["downloaded"] + state["result"]["skipped_existing"] == saved
+
+
+def test_image_variants_and_corrupt_sources(client, main_module, tmp_path, monkeypatch):
+    images = tmp_path / "images"
+    (images / "berlin").mkdir(parents=True)
+    Image.new("RGB", (800, 600), (10, 200, 30)).save(images / "berlin" / "ok.jpg", "JPEG")
+    (images / "berlin" / "bad.jpg").write_bytes(b"<html>rate limited</html>")
+    index = ImageIndex(images)
+    index.build()
+    monkeypatch.setattr(main_module, "image_index", index)
+    monkeypatch.setattr(variants, "IMAGES_DIR", images)
+    monkeypatch.setattr(variants, "VARIANTS_DIR", images / "variants")
+
+    r = client.get("/image", params={"uuid": "ok", "city": "berlin", "size": "tile"})
+    assert r.status_code == 200 and r.headers["content-type"] == "image/jpeg"
+    assert client.get("/image", params={"uuid": "ok", "city": "berlin", "size": "tile"},
+                      headers={"If-None-Match": r.headers["etag"]}).status_code == 304
+    assert client.get("/image", params={"uuid": "bad", "city": "berlin", "size": "tile"}).status_code == 422
+    assert client.get("/image", params={"uuid": "gone", "city": "berlin"}).status_code == 404
@@ -0,0 +1,52 @@
+import threading
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+
+from config import Config
+import utils.db as db
+
+
+@pytest.fixture
+def sqlite_engine(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "DB_POOL_SIZE", 1)
+    monkeypatch.setattr(Config, "DB_MAX_OVERFLOW", 0)
+    monkeypatch.setattr(Config, "DB_POOL_TIMEOUT", 0.2)
+    monkeypatch.setattr(db, "_database_url", lambda: f"sqlite:///{tmp_path / 'pool.db'}")
+    db.dispose_engine()
+    db.pool_metrics.reset()
+    yield db.get_db_connection()
+    db.dispose_engine()
+
+
+def test_engine_is_shared_and_connections_are_reused(sqlite_engine):
+    assert db.get_db_connection() is sqlite_engine
+    for _ in range(5):
+        with db.get_db_connection().connect() as conn:
+            conn.execute(text("SELECT 1"))
+
+    status = db.pool_status()
+    assert status["connects"] == 1
+    assert status["checkouts"] == 5
+    assert status["in_use"] == 0
+    assert status["checked_out"] == 0
+
+
+def test_waits_and_timeouts_are_recorded(sqlite_engine):
+    held = sqlite_engine.connect()
+    released = threading.Timer(0.05, held.close)
+    released.start()
+    with sqlite_engine.connect() as conn:  # waits for the timer to return the connection
+        conn.execute(text("SELECT 1"))
+    released.join()
+
+    status = db.pool_status()
+    assert status["wait_max_ms"] >= 30
+    assert status["held_max_ms"] >= 30
+
+    held = sqlite_engine.connect()
+    with pytest.raises(PoolTimeout):
+        sqlite_engine.connect()
+    held.close()
+    assert db.pool_status()["timeouts"] == 1
@@ -0,0 +1,35 @@
+import pytest
+
+from utils.download_journal import DownloadJournal, atomic_open, atomic_write_bytes
+
+
+def test_atomic_open_leaves_nothing_behind_on_failure(tmp_path):
+    dest = tmp_path / "city" / "u1.jpg"
+    with pytest.raises(RuntimeError):
+        with atomic_open(dest) as f:
+            f.write(b"half an image")
+            raise RuntimeError("connection dropped")
+    assert list((tmp_path / "city").iterdir()) == []
+
+    atomic_write_bytes(dest, b"whole image")
+    assert dest.read_bytes() == b"whole image"
+    assert [p.name for p in (tmp_path / "city").iterdir()] == ["u1.jpg"]
+
+
+def test_journal_resumes_from_last_entry_per_key(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    with DownloadJournal(path) as journal:
+        journal.record("u1", "ok", id="1")
+        journal.record("u2", "failed", id="2")
+        journal.record("u3", "exists", id="3")
+        journal.record("u2", "ok", id="2")
+        journal.record("u4", "no_url", id="4")
+    # a run killed mid-write leaves a partial last line
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"key": "u5", "stat')
+
+    journal = DownloadJournal(path)
+    assert journal.done() == {"u1", "u2", "u3"}
+    assert journal.entries()["u4"]["status"] == "no_url"
+    assert "u5" not in journal.entries()
+    journal.close()
@@ -0,0 +1,113 @@
+import pytest
+
+import utils.download as download
+import utils.mapillary as mapillary
+from stub_graph import StubGraph, IMAGE_BYTES
+from utils.image_index import ImageIndex
+from utils.url_cache import UrlCache
+
+
+@pytest.fixture
+def images_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(download, "IMAGES_DIR", tmp_path)
+    monkeypatch.setattr(download, "image_index", ImageIndex(tmp_path))
+    monkeypatch.setattr(download, "url_cache", UrlCache(tmp_path / "urls.db", ttl_seconds=3600))
+    return tmp_path
+
+
+def test_concurrent_download_keeps_summary(images_dir, monkeypatch):
+    pairs = [(1000 + i, f"u{i}") for i in range(20)]
+    pairs += [pairs[0], ("1999", "missing"), ("1998", "broken")]
+    (images_dir / "berlin").mkdir()
+    (images_dir / "berlin" / "u0.jpg").write_bytes(b"already here")
+
+    with StubGraph(latency=0.01, missing={"1999"}, broken={"1998"}) as stub:
+        monkeypatch.setattr(download, "GRAPH_BASE", stub.base)
+        result = download.download_pairs(pairs, "Berlin", workers=4)
+
+    assert result == {
+        "city": "berlin",
+        "requested_pairs": 22,
+        "skipped_existing": 1,
+        "attempted": 21,
+        "downloaded": 19,
+        "missing_meta": ["1999"],
+        "failed": [("1998", "broken")],
+        "images_dir": str((images_dir / "berlin").resolve()),
+    }
+    assert (images_dir / "berlin" / "u5.jpg").read_bytes() == IMAGE_BYTES
+    assert download.image_index.lookup("u5", "berlin") == images_dir / "berlin" / "u5.jpg"
+    # keep-alive: at most one connection per worker, not two per image
+    assert len(stub.connections) <= 4
+    # images: 19 saved + 1 broken; metadata: batched lookups instead of one call per id
+    assert stub.requests - stub.metadata_requests == 20
+    assert stub.metadata_requests < 21
+
+
+def test_rerun_resumes_from_journal(images_dir, monkeypatch):
+    pairs = [(str(3000 + i), f"v{i}") for i in range(6)]
+    with StubGraph(broken={"3004"}) as stub:
+        monkeypatch.setattr(download, "GRAPH_BASE", stub.base)
+        first = download.download_pairs(pairs, "paris", workers=3)
+        # journaled images are not stat'ed again: a removed file stays done
+        (images_dir / "paris" / "v0.jpg").unlink()
+        stub.broken.clear()
+        second = download.download_pairs(pairs, "paris", workers=3)
+
+    assert (first["downloaded"], first["failed"]) == (5, [("3004", "v4")])
+    assert (second["skipped_existing"], second["attempted"], second["downloaded"]) == (5, 1, 1)
+    assert sorted(p.name for p in (images_dir / "paris").iterdir() if not p.name.startswith(".")) == \
+        [f"v{i}.jpg" for i in range(1, 6)]
+
+
+def test_progress_and_cancellation(images_dir, monkeypatch):
+    pairs = [(str(4000 + i), f"w{i}") for i in range(40)]
+    updates, stages = [], []
+
+    def cancel_after_ten():
+        return len(updates) > 1 and updates[-1]["done"] >= 10
+
+    with StubGraph(latency=0.01) as stub:
+        monkeypatch.setattr(download, "GRAPH_BASE", stub.base)
+        result = download.download_pairs(pairs, "berlin", workers=2, on_stage=stages.append,
+                                         on_progress=updates.append, should_cancel=cancel_after_ten)
+
+    assert stages == ["resolving", "downloading"]
+    assert updates[0] == {"total": 40, "skipped": 0, "done": 0, "failed": 0, "missing_meta": 0,
+                          "bytes": 0, "bytes_per_s": 0}
+    assert [u["done"] for u in updates[2:]] == list(range(1, len(updates) - 1))
+    assert updates[-1]["bytes"] == updates[-1]["done"] * len(IMAGE_BYTES) and updates[-1]["bytes_per_s"] > 0
+    # queued downloads are dropped; the two in flight finish and are counted
+    saved = len(list((images_dir / "berlin").glob("*.jpg")))
+    assert 10 <= saved <= 12
+    assert result["downloaded"] == updates[-1]["done"] == saved
+    assert len(download.get_journal(images_dir / "berlin" / download.JOURNAL_NAME).done()) == saved
+
+
+def test_cancel_while_resolving_stops_before_downloading(images_dir, monkeypatch):
+    pairs = [(str(5000 + i), f"x{i}") for i in range(40)]
+    stages = []
+    with StubGraph() as stub:
+        monkeypatch.setattr(download, "GRAPH_BASE", stub.base)
+        result = download.download_pairs(pairs, "berlin", workers=2, on_stage=stages.append,
+                                         should_cancel=lambda: "resolving" in stages)
+
+    assert stages == ["resolving"]
+    assert stub.requests == 0
+    assert (result["attempted"], result["downloaded"], result["missing_meta"]) == (40, 0, [])
+    # nothing was journaled as missing, so the next run looks the ids up again
+    assert download.get_journal(images_dir / "berlin" / download.JOURNAL_NAME).entries() == {}
+
+
+def test_failing_metadata_batch_counts_as_missing(images_dir, monkeypatch):
+    monkeypatch.setattr(mapillary, "MAPILLARY_RETRIES", 0)
+    pairs = [(str(6000 + i), f"y{i}") for i in range(100)]
+    updates = []
+    with StubGraph() as stub:
+        monkeypatch.setattr(download, "GRAPH_BASE", stub.base)
+        stub.errors = [503]  # one of the two batches of 50
+        result = download.download_pairs(pairs, "berlin", workers=4, on_progress=updates.append)
+
+    assert (result["downloaded"], updates[-1]["missing_meta"], len(result["missing_meta"])) == (50, 50, 5)
+    entries = download.get_journal(images_dir / "berlin" / download.JOURNAL_NAME).entries()
+    assert sorted(e["status"] for e in entries.values()) == ["no_url"] * 50 + ["ok"] * 50
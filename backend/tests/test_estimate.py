@@ -0,0 +1,39 @@
+import random
+
+from utils.estimate import bernoulli_estimate, sample_mean_estimate, sample_percent
+
+
+def test_bernoulli_estimate_covers_the_true_total():
+    rng = random.Random(3)
+    population = [rng.choice([0, 0, 1, 3, 20]) for _ in range(20_000)]
+    truth = sum(population)
+    fraction = 0.05
+
+    covered = 0
+    for _ in range(200):
+        sample = [c for c in population if rng.random() < fraction]
+        estimate, se = bernoulli_estimate(sample, fraction)
+        covered += estimate - 1.96 * se <= truth <= estimate + 1.96 * se
+    assert covered >= 180  # nominal 95%
+
+
+def test_bernoulli_full_sample_is_exact():
+    assert bernoulli_estimate([1, 2, 3], 1.0) == (6.0, 0.0)
+
+
+def test_sample_mean_estimate():
+    rng = random.Random(5)
+    population = [rng.randint(0, 50) for _ in range(2_000)]
+    sample = rng.sample(population, 400)
+    estimate, se = sample_mean_estimate(sample, len(population))
+    assert abs(estimate - sum(population)) <= 3 * se
+    # a census has no sampling error
+    assert sample_mean_estimate(population, len(population)) == (float(sum(population)), 0.0)
+    assert sample_mean_estimate([], 10) == (0.0, 0.0)
+
+
+def test_sample_percent_is_sized_from_the_anchors():
+    # 2,000 anchors among 100,000 rows: 500 sampled anchors need 25%, not 0.5%
+    assert sample_percent(500, 2_000) == 25.0
+    assert sample_percent(500, 400) == 100.0
+    assert sample_percent(500, 0) == sample_percent(500, None) == 100.0
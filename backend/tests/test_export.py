@@ -0,0 +1,57 @@
+import gzip
+import io
+import json
+
+import pandas as pd
+
+from utils.export import export_filename, iter_export
+
+
+def _result(tmp_path, n=25):
+    df = pd.DataFrame({
+        "uuid": [f"a{i}" for i in range(n)],
+        "relation_uuid": [f"b{i}" for i in range(n)],
+        "orig_id": [float(i) for i in range(n)],
+        "relation_orig_id": [float("nan")] * n,
+        "h_1": 10.0, "h_2": 20.0,
+        "lon_1": 13.4, "lon_2": 13.5, "lat_1": 52.5, "lat_2": 52.6,
+        "distance_meters": [i * 0.5 for i in range(n)],
+        "source": "mly",
+        "relation_id": [f"a{i}__b{i}" for i in range(n)],
+    })
+    df.attrs.update(city="berlin", slice_key=["berlin", 5.0, 20.0, None])
+    path = tmp_path / "q.parquet"
+    df.to_parquet(path, index=False)
+    return df, path
+
+
+def _read(path, fmt):
+    return b"".join(iter_export(path, fmt, batch_rows=10))
+
+
+def test_csv_and_gzip_stream_in_batches(tmp_path):
+    df, path = _result(tmp_path)
+    assert len(list(iter_export(path, "csv", batch_rows=10))) == 3
+
+    csv = pd.read_csv(io.BytesIO(_read(path, "csv")))
+    pd.testing.assert_frame_equal(csv, df, check_dtype=False)
+    assert gzip.decompress(_read(path, "csv.gz")) == _read(path, "csv")
+
+
+def test_parquet_and_geojson(tmp_path):
+    df, path = _result(tmp_path)
+    assert _read(path, "parquet") == path.read_bytes()
+
+    collection = json.loads(_read(path, "geojson"))
+    assert len(collection["features"]) == len(df)
+    feature = collection["features"][3]
+    assert feature["geometry"]["coordinates"] == [[13.4, 52.5], [13.5, 52.6]]
+    assert feature["properties"]["uuid"] == "a3"
+    assert feature["properties"]["relation_orig_id"] is None
+
+
+def test_empty_result_and_filename(tmp_path):
+    df, path = _result(tmp_path, n=0)
+    assert _read(path, "csv").decode().strip().split(",")[0] == "uuid"
+    assert json.loads(_read(path, "geojson")) == {"type": "FeatureCollection", "features": []}
+    assert export_filename(path, "3f2a9c1b7d4e", "csv.gz") == "berlin_inner_5_0_outer_20_0_3f2a9c1b.csv.gz"
@@ -0,0 +1,86 @@
+import utils.helper_db as helper_db
+
+
+def test_liked_index_loads_and_tracks_toggles(tmp_path, monkeypatch):
+    monkeypatch.setattr(helper_db, "DB_PATH", str(tmp_path / "liked.db"))
+    helper_db.init_db()
+    con = helper_db.sqlite3.connect(helper_db.DB_PATH)
+    con.executemany("INSERT INTO liked (uuid_1, uuid_2) VALUES (?, ?)", [("a", "b"), ("c", "d")])
+    con.commit()
+    con.close()
+
+    index = helper_db.LikedIndex().load()
+    assert ("a", "b") in index and ("c", "d") in index
+    assert len(index) == 2
+
+    index.add("e", "f")
+    index.discard("a", "b")
+    assert ("e", "f") in index
+    assert ("a", "b") not in index
+
+
+def test_apply_likes_is_one_ordered_transaction(tmp_path, monkeypatch):
+    import numpy as np
+
+    monkeypatch.setattr(helper_db, "DB_PATH", str(tmp_path / "liked.db"))
+    helper_db.init_db()
+    helper_db.apply_likes([
+        (True, "a", "b", np.int64(1), np.int64(2), np.float64(3.5), "berlin"),
+        (True, "c", "d", 5, 6, float("nan"), "berlin"),
+        (False, "c", "d", None, None, None, None),
+    ])
+
+    con = helper_db.get_connection()
+    assert con.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    rows = con.execute("SELECT uuid_1, uuid_2, orig_id_1, distance FROM liked").fetchall()
+    assert rows == [("a", "b", 1, 3.5)]
+
+
+def test_fetch_liked_page_walks_keyset_pages(tmp_path, monkeypatch):
+    monkeypatch.setattr(helper_db, "DB_PATH", str(tmp_path / "liked.db"))
+    helper_db.init_db()
+    helper_db.ensure_liked_indexes()
+    con = helper_db.get_connection()
+    rows = [(f"a{i}", f"b{i}", i, i, float(i), "berlin" if i % 2 else "paris", f"2025-01-01 00:00:{i % 3:02d}")
+            for i in range(10)]
+    with con:
+        con.executemany("INSERT INTO liked VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    seen = []
+    items, cursor, total = helper_db.fetch_liked_page(limit=4)
+    assert total == 10
+    seen += items
+    while cursor:
+        items, cursor, total = helper_db.fetch_liked_page(limit=4, cursor=cursor)
+        assert total is None
+        seen += items
+    assert len(seen) == 10
+    keys = [(i["created_at"], i["uuid_1"], i["uuid_2"]) for i in seen]
+    assert keys == sorted(keys, reverse=True)
+
+    berlin, _, total = helper_db.fetch_liked_page(city="Berlin")
+    assert total == 5 and {i["city"] for i in berlin} == {"berlin"}
+
+    plan = con.execute(
+        "EXPLAIN QUERY PLAN SELECT uuid_1 FROM liked WHERE city = ? ORDER BY created_at DESC, uuid_1 DESC, uuid_2 DESC",
+        ("berlin",),
+    ).fetchall()
+    assert "liked_city_recent" in str(plan)
+
+
+def test_likes_without_created_at_are_paged_last(tmp_path, monkeypatch):
+    monkeypatch.setattr(helper_db, "DB_PATH", str(tmp_path / "liked.db"))
+    helper_db.init_db()
+    con = helper_db.get_connection()
+    with con:
+        con.executemany("INSERT INTO liked (uuid_1, uuid_2, created_at) VALUES (?, ?, ?)",
+                        [("a", "b", "2025-01-01 00:00:00"), ("c", "d", None), ("e", "f", None)])
+    helper_db.ensure_liked_indexes()
+
+    seen, cursor = [], None
+    while True:
+        items, cursor, _ = helper_db.fetch_liked_page(limit=1, cursor=cursor)
+        seen += [i["uuid_1"] for i in items]
+        if cursor is None:
+            break
+    assert seen == ["a", "e", "c"]
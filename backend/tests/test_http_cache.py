@@ -0,0 +1,39 @@
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from utils.http_cache import cached_file_response
+
+
+def _client(path):
+    app = FastAPI()
+
+    @app.get("/file")
+    def serve(request: Request):
+        return cached_file_response(request, path, media_type="image/jpeg")
+
+    return TestClient(app)
+
+
+def test_revalidation_returns_304(tmp_path):
+    path = tmp_path / "a.jpg"
+    path.write_bytes(b"0123456789")
+    client = _client(path)
+
+    first = client.get("/file")
+    assert first.status_code == 200
+    assert "immutable" in first.headers["cache-control"]
+    etag = first.headers["etag"]
+
+    assert client.get("/file", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/file", headers={"If-None-Match": f'"other", W/{etag}'}).status_code == 304
+    assert client.get("/file", headers={"If-None-Match": '"other"'}).status_code == 200
+    since = first.headers["last-modified"]
+    assert client.get("/file", headers={"If-Modified-Since": since}).status_code == 304
+
+
+def test_range_request(tmp_path):
+    path = tmp_path / "a.jpg"
+    path.write_bytes(b"0123456789")
+    resp = _client(path).get("/file", headers={"Range": "bytes=2-4"})
+    assert resp.status_code == 206
+    assert resp.content == b"234"
@@ -0,0 +1,24 @@
+from utils.image_index import ImageIndex
+
+
+def test_lookup_follows_city_then_root_order(tmp_path):
+    (tmp_path / "paris").mkdir()
+    (tmp_path / "berlin").mkdir()
+    (tmp_path / "paris" / "u1.jpg").write_bytes(b"p")
+    (tmp_path / "berlin" / "u1.jpg").write_bytes(b"b")
+    (tmp_path / "u2.jpg").write_bytes(b"r")
+    (tmp_path / "berlin" / "notes.txt").write_text("x")
+
+    index = ImageIndex(tmp_path).build()
+    assert index.lookup("u1") == tmp_path / "berlin" / "u1.jpg"
+    assert index.lookup("u1", "Paris") == tmp_path / "paris" / "u1.jpg"
+    assert index.lookup("u2") == tmp_path / "u2.jpg"
+    assert index.lookup("u2", "berlin") is None
+    assert index.lookup("notes") is None
+
+
+def test_add_makes_new_downloads_visible(tmp_path):
+    index = ImageIndex(tmp_path).build()
+    assert index.lookup("u3") is None
+    index.add("u3", "washington", tmp_path / "washington" / "u3.jpg")
+    assert index.lookup("u3") == tmp_path / "washington" / "u3.jpg"
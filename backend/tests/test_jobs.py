@@ -0,0 +1,94 @@
+import asyncio
+import json
+import threading
+import time
+
+from utils.jobs import JobManager, DONE, FAILED, CANCELLED, job_events
+
+
+def _wait(job, timeout=5):
+    deadline = time.time() + timeout
+    while job.finished_at is None and time.time() < deadline:
+        time.sleep(0.01)
+    return job
+
+
+def test_job_reports_stages_and_result():
+    manager = JobManager(max_workers=1)
+
+    def work(job, n):
+        job.set_stage("joining")
+        job.update(count=n)
+        job.set_stage("writing")
+        return {"count": n}
+
+    job = _wait(manager.submit("query", work, 3))
+    state = job.to_dict()
+    assert state["status"] == DONE
+    assert state["result"] == {"count": 3}
+    assert [s["stage"] for s in state["progress"]["stages"]] == ["joining", "writing"]
+    assert manager.get(job.id) is job
+
+
+def test_stage_timings_run_until_the_next_stage():
+    manager = JobManager(max_workers=1)
+
+    def work(job):
+        job.set_stage("joining")
+        time.sleep(0.05)
+        job.set_stage("writing")
+        time.sleep(0.02)
+        job.set_stage("joining")
+
+    job = _wait(manager.submit("query", work))
+    timings = job.to_dict()["timings"]
+    assert set(timings) == {"joining", "writing"}
+    assert timings["joining"] >= 0.05
+    assert 0.02 <= timings["writing"] < 0.05
+
+
+def test_failure_and_cancellation():
+    manager = JobManager(max_workers=2)
+    failed = _wait(manager.submit("query", lambda job: 1 / 0))
+    assert failed.status == FAILED and "division" in failed.error
+
+    release = threading.Event()
+
+    def loop(job):
+        release.wait(5)
+        job.check_cancelled()
+        return "not reached"
+
+    job = manager.submit("download", loop)
+    job.cancel()
+    release.set()
+    assert _wait(job).status == CANCELLED
+
+
+def test_job_events_stream_changes_then_final_status():
+    manager = JobManager(max_workers=1)
+    release = threading.Event()
+
+    def work(job):
+        job.update(done=1)
+        release.wait(5)
+        job.update(done=2)
+        return {"downloaded": 2}
+
+    job = manager.submit("download", work)
+
+    async def collect():
+        events = []
+        async for event in job_events(job, interval=0.01):
+            events.append(event)
+            if len(events) == 1:
+                await asyncio.sleep(0.05)  # unchanged state: no repeated events
+                release.set()
+        return events
+
+    events = asyncio.run(collect())
+    names = [e.split("\n")[0] for e in events]
+    assert names[-1] == "event: done" and set(names[:-1]) == {"event: progress"}
+    assert len(events) <= 3
+    final = json.loads(events[-1].split("data: ", 1)[1])
+    assert final["result"] == {"downloaded": 2} and final["progress"]["done"] == 2
@@ -0,0 +1,66 @@
+import pytest
+
+import utils.mapillary as mapillary
+from stub_graph import StubGraph
+from utils.mapillary import resolve_urls
+from utils.url_cache import UrlCache
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(mapillary, "MAPILLARY_RETRIES", 2)
+    monkeypatch.setattr(mapillary, "MAPILLARY_RETRY_BACKOFF", 0.001)
+
+
+def test_resolve_urls_batches_and_isolates_bad_ids():
+    ids = [str(5000 + i) for i in range(120)] + ["5000", "not-an-id"]
+    with StubGraph(missing={"5007", "5093"}) as stub:
+        urls = resolve_urls(ids, "thumb_1024_url", "token", batch_size=50, workers=3, api_base=stub.base)
+
+    assert len(urls) == 121
+    assert urls["5000"] == f"{stub.base}/img/5000.jpg"
+    assert urls["5119"] == f"{stub.base}/img/5119.jpg"
+    assert urls["5007"] is None and urls["5093"] is None and urls["not-an-id"] is None
+    assert sum(url is not None for url in urls.values()) == 118
+    # 3 batches, plus about 2 * log2(50) lookups to bisect each batch with a bad id
+    assert stub.metadata_requests <= 3 + 3 * 2 * 6
+
+
+def test_resolve_urls_without_ids_makes_no_calls():
+    with StubGraph() as stub:
+        assert resolve_urls([], "thumb_256_url", "token", api_base=stub.base) == {}
+    assert stub.metadata_requests == 0
+
+
+def test_resolve_urls_retries_rate_limits_without_splitting():
+    ids = [str(6000 + i) for i in range(100)]
+    with StubGraph() as stub:
+        stub.errors = [429, 503]
+        urls = resolve_urls(ids, "thumb_1024_url", "token", batch_size=50, workers=1, api_base=stub.base)
+
+    assert all(urls[i] == f"{stub.base}/img/{i}.jpg" for i in ids)
+    # the first batch is retried twice as a whole, the second goes through
+    assert stub.metadata_requests == 4
+
+
+def test_resolve_urls_fails_batch_once_retries_run_out(tmp_path):
+    cache = UrlCache(tmp_path / "urls.db", ttl_seconds=3600)
+    ids = [str(7000 + i) for i in range(100)]
+    with StubGraph() as stub:
+        stub.errors = [503] * 3
+        urls = resolve_urls(ids, "thumb_1024_url", "token", batch_size=50, workers=1, api_base=stub.base, cache=cache)
+
+    # 3 attempts at the first batch, no bisecting; its ids come back empty and are not cached
+    assert stub.metadata_requests == 4
+    assert all(urls[i] is None for i in ids[:50]) and all(urls[i] for i in ids[50:])
+    assert set(cache.get_many(ids, "thumb_1024_url")) == set(ids[50:])
+
+
+def test_resolve_urls_stops_between_batches_once_cancelled():
+    ids = [str(8000 + i) for i in range(50)]
+    with StubGraph() as stub:
+        urls = resolve_urls(ids, "thumb_256_url", "token", batch_size=10, workers=1, api_base=stub.base,
+                            should_cancel=lambda: stub.metadata_requests >= 2)
+
+    assert stub.metadata_requests == 2
+    assert sorted(urls) == ids[:20]
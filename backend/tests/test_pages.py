@@ -0,0 +1,25 @@
+import math
+
+import numpy as np
+
+from bench_pairs_page import iterrows_items, make_frame
+from utils.pages import build_page_items
+
+
+def test_matches_iterrows_output():
+    df = make_frame(500)
+    liked = {("u00000003", "v00000003"), ("u00000400", "v00000400")}
+    page = df.iloc[0:500]
+    assert build_page_items(page, liked, "berlin") == iterrows_items(page, liked, "berlin")
+
+
+def test_missing_values_become_none():
+    df = make_frame(3)
+    df = df.drop(columns=["lon_1"])
+    df["distance_meters"] = [1.0, np.nan, 3.0]
+    df["lat_2"] = [np.nan, 1.0, 2.0]
+    items = build_page_items(df, set(), None)
+    assert "lng" not in items[0]["left"]
+    assert "lat" not in items[0]["right"]
+    assert items[1]["distance"] is None
+    assert not any(isinstance(i["distance"], float) and math.isnan(i["distance"]) for i in items)
@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+shapely_geometry = pytest.importorskip("shapely.geometry")
+LineString, Point = shapely_geometry.LineString, shapely_geometry.Point
+
+from sqlalchemy import create_engine, event, text
+
+import utils.pair_engine as pair_engine
+from utils.create_slice import slice_key
+from utils.pair_engine import PairEngine, haversine_m, narrow_pairs, ring_contains
+
+
+def _points(n=250, seed=7):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "uuid": [f"{i:05x}" for i in rng.permutation(n)],
+        "orig_id": np.arange(n, dtype=float),
+        "heading": rng.uniform(0, 360, n),
+        "x": rng.uniform(0, 200, n),
+        "y": rng.uniform(0, 200, n),
+        "lon": 13.4 + rng.uniform(0, 0.003, n),
+        "lat": 52.5 + rng.uniform(0, 0.002, n),
+        "source": "mly",
+    })
+
+
+def _slice_geom(x, y, heading, inner, outer):
+    """The slice polygon exactly as create_slice.py asks PostGIS for it (quad_segs 8 is its default)."""
+    h = np.radians(heading)
+    corridor = LineString([
+        (x + outer * np.sin(h), y + outer * np.cos(h)),
+        (x - outer * np.sin(h), y - outer * np.cos(h)),
+    ]).buffer(inner, cap_style="square", join_style="mitre")
+    point = Point(x, y)
+    return point.buffer(outer, quad_segs=8).difference(point.buffer(inner, quad_segs=8)).difference(corridor)
+
+
+def _sql_pairs(points, inner, outer, anchors=None):
+    pairs = set()
+    for a in points.itertuples():
+        if anchors is not None and a.uuid not in anchors:
+            continue
+        geom = _slice_geom(a.x, a.y, a.heading, inner, outer)
+        for b in points.itertuples():
+            diff = abs(a.heading - b.heading)
+            if b.uuid > a.uuid and min(diff, 360 - diff) <= 45 and geom.contains(Point(b.x, b.y)):
+                pairs.add((a.uuid, b.uuid))
+    return pairs
+
+
+def test_matches_postgis_slice_semantics():
+    points = _points()
+    engine = PairEngine(points)
+    for inner, outer in [(5, 30), (0, 12.5), (10, 60)]:
+        df = engine.pairs(inner, outer)
+        assert set(zip(df["uuid"], df["relation_uuid"])) == _sql_pairs(points, inner, outer)
+
+
+def test_schema_and_distances():
+    df = PairEngine(_points()).pairs(5, 30)
+    assert list(df.columns) == [
+        "uuid", "relation_uuid", "orig_id", "relation_orig_id", "h_1", "h_2",
+        "lon_1", "lon_2", "lat_1", "lat_2", "distance_meters", "source", "relation_id",
+        "x_1", "y_1", "x_2", "y_2",
+    ]
+    assert len(df) > 0
+    assert (df["relation_id"] == df["uuid"] + "__" + df["relation_uuid"]).all()
+    points = _points().set_index("uuid")
+    a, b = points.loc[df["uuid"]], points.loc[df["relation_uuid"]]
+    expected = np.hypot(b["x"].to_numpy() - a["x"].to_numpy(), b["y"].to_numpy() - a["y"].to_numpy())
+    np.testing.assert_allclose(df["distance_meters"], expected)
+
+
+def test_area_filter_applies_to_anchors_only():
+    points = _points()
+    lat, lng, radius = 52.501, 13.4015, 60.0
+    inside = set(points.loc[haversine_m(points["lat"], points["lon"], lat, lng) <= radius, "uuid"])
+    assert 0 < len(inside) < len(points)
+
+    df = PairEngine(points).pairs(5, 30, lat=lat, lng=lng, radius_m=radius)
+    assert set(zip(df["uuid"], df["relation_uuid"])) == _sql_pairs(points, 5, 30, anchors=inside)
+    assert not set(df["relation_uuid"]) <= inside
+
+
+def test_narrower_ring_is_cut_from_a_wider_result():
+    points = _points()
+    engine = PairEngine(points)
+    wider = engine.pairs(5, 30)
+    for inner, outer in [(8, 20), (5, 30), (12.5, 25)]:
+        narrowed = narrow_pairs(wider, inner, outer)
+        assert set(zip(narrowed["uuid"], narrowed["relation_uuid"])) == _sql_pairs(points, inner, outer)
+        pd.testing.assert_frame_equal(narrowed, engine.pairs(inner, outer))
+
+
+def test_ring_contains():
+    area = (52.5, 13.4, 500.0)
+    assert ring_contains(slice_key("berlin", 5, 20), slice_key("berlin", 8, 15))
+    assert ring_contains(slice_key("berlin", 5, 20, *area), slice_key("berlin", 5, 20, *area))
+    assert not ring_contains(slice_key("berlin", 5, 20), slice_key("berlin", 4, 15))
+    assert not ring_contains(slice_key("berlin", 5, 20), slice_key("berlin", 8, 25))
+    assert not ring_contains(slice_key("berlin", 5, 20), slice_key("berlin", 8, 15, *area))
+    assert not ring_contains(slice_key("paris", 5, 20), slice_key("berlin", 8, 15))
+    # keys read back from JSON carry the area as a list
+    assert ring_contains(("berlin", 5.0, 20.0, list(area)), slice_key("berlin", 8, 15, *area))
+
+
+def test_ids_stay_integers_with_null_orig_ids(tmp_path, monkeypatch):
+    """A NULL orig_id must not turn the ids into floats (exports and /download/ would send "123.0")."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'points.db'}")
+    # SQLite stand-ins for the PostGIS accessors; geometries are stored as "x,y"
+    event.listen(engine, "connect", lambda con, _: (
+        con.create_function("ST_X", 1, lambda g: float(g.split(",")[0])),
+        con.create_function("ST_Y", 1, lambda g: float(g.split(",")[1])),
+    ))
+    big = 100_000_000_000_097
+    rows = [("a", None, "0,0"), ("b", big, "10,0"), ("c", None, "5,0")]
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE berlin (uuid, orig_id_x, heading, geometry_comp_32633, comp_lon, comp_lat, "
+            "source_x, mly_quality_score)"
+        ))
+        for uuid, orig_id, geom in rows:
+            conn.execute(text("INSERT INTO berlin VALUES (:uuid, :orig_id, 0, :geom, 13.4, 52.5, 'mly', 1)"),
+                         {"uuid": uuid, "orig_id": orig_id, "geom": geom})
+    monkeypatch.setattr(pair_engine, "get_db_connection", lambda: engine)
+
+    df = PairEngine.from_db("berlin").pairs(2, 20)
+
+    assert list(zip(df["uuid"], df["relation_uuid"])) == [("a", "b"), ("a", "c"), ("b", "c")]
+    assert df["orig_id"].dtype == "Int64" and df["relation_orig_id"].dtype == "Int64"
+    assert df["orig_id"].tolist() == [pd.NA, pd.NA, big]
+    assert df["relation_orig_id"].tolist() == [big, pd.NA, pd.NA]
+    assert f",{big}," in df.to_csv(index=False)
@@ -0,0 +1,68 @@
+import os
+
+import pandas as pd
+
+from utils.create_slice import slice_key
+from utils.query_cache import QueryCache
+
+
+def _frame(n):
+    return pd.DataFrame({
+        "uuid": [f"a{i}" for i in range(n)],
+        "relation_uuid": [f"b{i}" for i in range(n)],
+        "distance_meters": [float(i) for i in range(n)],
+    })
+
+
+def test_equivalent_parameters_hit(tmp_path):
+    cache = QueryCache(tmp_path, max_bytes=10 ** 9)
+    key = slice_key("Berlin", 5, 20.0)
+    assert cache.get(key) is None
+
+    cache.put(key, _frame(3), cache.generation("berlin"), {"csv_path": "queries/x.csv"})
+    df, meta = cache.get(slice_key("berlin", 5.001, 20))
+    pd.testing.assert_frame_equal(df, _frame(3))
+    assert meta["csv_path"] == "queries/x.csv"
+    assert cache.get(slice_key("berlin", 5, 25)) is None
+
+
+def test_invalidate_drops_results_and_refuses_stale_puts(tmp_path):
+    cache = QueryCache(tmp_path, max_bytes=10 ** 9)
+    key = slice_key("paris", 5, 20)
+    generation = cache.generation("paris")
+    cache.put(key, _frame(3), generation)
+
+    assert cache.invalidate_city("paris") == 1
+    assert cache.get(key) is None
+    # a query that started before the deletion must not repopulate the cache
+    assert cache.put(key, _frame(3), generation) is None
+    assert cache.get(key) is None
+    assert cache.put(key, _frame(2), cache.generation("paris")) is not None
+    assert len(cache.get(key)[0]) == 2
+
+
+def test_evicts_least_recently_read(tmp_path):
+    cache = QueryCache(tmp_path, max_bytes=10 ** 9)
+    first, second = slice_key("berlin", 1, 10), slice_key("berlin", 2, 10)
+    size = cache.put(first, _frame(50), 0).stat().st_size
+    cache.put(second, _frame(50), 0)
+    for key in (first, second):
+        os.utime(cache.path_for(key), (1000.0, 1000.0))
+    cache.get(first)
+
+    cache.max_bytes = 2 * size + size // 2
+    cache.put(slice_key("berlin", 3, 10), _frame(50), 0)
+    assert cache.get(second) is None
+    assert cache.get(first) is not None
+
+
+def test_put_file_links_an_existing_result(tmp_path):
+    cache = QueryCache(tmp_path / "cache", max_bytes=10 ** 9)
+    src = tmp_path / "result.parquet"
+    _frame(4).to_parquet(src, index=False)
+    key = slice_key("berlin", 5, 20)
+
+    path = cache.put_file(key, src, 0, {"csv_path": "queries/x.csv"})
+    assert path.stat().st_ino == src.stat().st_ino
+    df, meta = cache.get(key)
+    assert len(df) == 4 and meta["csv_path"] == "queries/x.csv"
@@ -0,0 +1,22 @@
+import utils.query_history as query_history
+
+
+def test_query_history_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(query_history, "DB_PATH", str(tmp_path / "query_history.db"))
+    query_history.ensure_query_history()
+    plan = {"Plan": {"Node Type": "Nested Loop"}, "Execution Time": 12.5}
+    query_history.record_query({
+        "query_id": "q1", "city": "berlin", "inner_buffer": 5.0, "outer_buffer": 20.0, "area": None,
+        "engine": "postgis", "cached": False, "count": 10, "total_s": 1.5,
+        "timings": {"joining": 1.0, "writing": 0.5}, "plan_summary": {"execution_ms": 12.5}, "plan": plan,
+    })
+    query_history.record_query({"query_id": "q2", "city": "paris", "cached": True, "count": 3, "timings": {"cached": 0.1}})
+
+    recent = query_history.fetch_query_history()
+    assert [item["query_id"] for item in recent] == ["q2", "q1"]
+    assert "plan" not in recent[0]
+    assert recent[1]["timings"] == {"joining": 1.0, "writing": 0.5}
+    assert recent[0]["cached"] is True
+
+    assert [item["query_id"] for item in query_history.fetch_query_history(city="Berlin")] == ["q1"]
+    assert query_history.fetch_query_history(query_id="q1", with_plan=True)[0]["plan"] == plan
@@ -0,0 +1,103 @@
+import os
+
+import pandas as pd
+
+from utils.result_store import ResultStore
+
+
+def _frame(n, prefix="a"):
+    return pd.DataFrame({
+        "uuid": [f"{prefix}{i}" for i in range(n)],
+        "relation_uuid": [f"{prefix}{i}_b" for i in range(n)],
+        "distance_meters": [float(i) for i in range(n)],
+    })
+
+
+def test_load_reads_pickle_once(tmp_path, monkeypatch):
+    pkl = tmp_path / "latest_query.pkl"
+    _frame(10).to_pickle(pkl)
+    calls = []
+    real_read = pd.read_pickle
+    monkeypatch.setattr(pd, "read_pickle", lambda p: calls.append(p) or real_read(p))
+
+    store = ResultStore(max_bytes=10 ** 9)
+    first = store.load("latest", pkl)
+    second = store.load("latest", pkl)
+    assert first is second
+    assert len(calls) == 1
+
+
+def test_put_replaces_and_evicts_lru():
+    one, two = _frame(100, "x"), _frame(100, "y")
+    store = ResultStore(max_bytes=store_size(one) + 1)
+    store.put("one", one)
+    store.put("two", two)
+    assert store.get("one") is None
+    assert store.get("two").df is two
+
+    replacement = _frame(5, "z")
+    store.put("two", replacement)
+    assert store.get("two").df is replacement
+
+
+def test_row_for_uses_pair_index():
+    store = ResultStore(max_bytes=10 ** 9)
+    entry = store.put("latest", _frame(50))
+    row = entry.row_for("a7", "a7_b")
+    assert row["distance_meters"] == 7.0
+    assert entry.row_for("a7", "missing") is None
+
+
+def store_size(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def test_idle_entries_expire_with_their_pickle(tmp_path, monkeypatch):
+    import utils.result_store as rs
+
+    now = [1000.0]
+    monkeypatch.setattr(rs.time, "time", lambda: now[0])
+    store = ResultStore(max_bytes=10 ** 9, ttl_seconds=60)
+
+    path = tmp_path / "q1.pkl"
+    _frame(3).to_pickle(path)
+    store.put("q1", pd.read_pickle(path), path)
+    now[0] += 30
+    assert store.get("q1") is not None  # access refreshes the TTL
+    now[0] += 45
+    assert store.get("q1") is not None
+
+    now[0] += 61
+    assert store.get("q1") is None
+    # the pickle was last touched when the entry was created
+    os.utime(path, (1000.0, 1000.0))
+    assert store.load("q1", path) is None
+    assert store.purge_expired(tmp_path) == 1
+    assert not path.exists()
+
+
+def test_eviction_leaves_shared_files_untouched(tmp_path, monkeypatch):
+    import utils.result_store as rs
+
+    now = [5000.0]
+    monkeypatch.setattr(rs.time, "time", lambda: now[0])
+    cached = tmp_path / "cache.parquet"
+    _frame(100, "x").to_parquet(cached)
+    os.utime(cached, (1000.0, 1000.0))
+    path = tmp_path / "q1.parquet"
+    os.link(cached, path)  # as _persist_result does for a cache hit
+
+    one = pd.read_parquet(path)
+    store = ResultStore(max_bytes=store_size(one) + 1, ttl_seconds=60)
+    store.put("q1", one, path)
+    now[0] += 30
+    store.put("q2", _frame(100, "y"))
+    # the query cache orders its eviction by this mtime
+    assert cached.stat().st_mtime == 1000.0
+
+    # the TTL still runs from the last access, not from the old mtime
+    assert store.load("q1", path) is not None
+    store.put("q2", _frame(100, "y"))
+    now[0] += 61
+    assert store.purge_expired(tmp_path, "q*.parquet") == 1
+    assert not path.exists() and cached.exists()
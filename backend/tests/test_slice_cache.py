@@ -0,0 +1,96 @@
+import re
+from contextlib import contextmanager
+
+import utils.create_slice as create_slice
+
+
+class FakeEngine:
+    """Records statements and keeps a set of existing tables, enough for SliceCache."""
+
+    def __init__(self):
+        self.tables = set()
+        self.statements = []
+
+    @contextmanager
+    def begin(self):
+        yield self
+
+    connect = begin
+
+    def execute(self, stmt, params=None):
+        sql = str(stmt).strip()
+        self.statements.append(sql)
+        engine = self
+
+        class Result:
+            def scalar(self):
+                return params["name"] if params["name"] in engine.tables else None
+
+            def fetchall(self):
+                return [(t,) for t in sorted(engine.tables)]
+
+            def __iter__(self):
+                # pg_tables lookup: tablename ~ :pattern
+                return iter([(t,) for t in sorted(engine.tables) if re.search(params["pattern"], t)])
+
+        if sql.startswith("CREATE UNLOGGED TABLE"):
+            self.tables.add(sql.split()[3])
+        elif sql.startswith("DROP TABLE"):
+            self.tables.discard(sql.split()[-1])
+        return Result()
+
+    def created(self):
+        return [s for s in self.statements if s.startswith("CREATE UNLOGGED TABLE")]
+
+
+def test_same_parameters_share_one_table(monkeypatch):
+    engine = FakeEngine()
+    monkeypatch.setattr(create_slice, "get_db_connection", lambda: engine)
+    cache = create_slice.SliceCache(max_tables=4)
+
+    a = cache.acquire("Berlin", 5, 10.0)
+    b = cache.acquire("berlin", 5.001, 10)
+    assert a == b and a.startswith("slice_berlin_")
+    assert len(engine.created()) == 1
+    cache.release(a)
+    cache.release(b)
+
+    c = cache.acquire("berlin", 5, 10, lat=52.5, lng=13.4, radius_m=500)
+    assert c != a
+    assert len(engine.created()) == 2
+
+
+def test_idle_tables_are_evicted_lru(monkeypatch):
+    engine = FakeEngine()
+    monkeypatch.setattr(create_slice, "get_db_connection", lambda: engine)
+    cache = create_slice.SliceCache(max_tables=2)
+
+    held = cache.acquire("paris", 1, 2)
+    idle = cache.acquire("paris", 2, 3)
+    cache.release(idle)
+    newest = cache.acquire("paris", 3, 4)
+
+    assert idle not in engine.tables
+    assert held in engine.tables and newest in engine.tables
+
+    # a dropped parameter set is simply rebuilt
+    cache.release(newest)
+    assert cache.acquire("paris", 2, 3) == idle
+    assert idle in engine.tables
+
+
+def test_only_generated_slice_tables_are_adopted_and_dropped(monkeypatch):
+    engine = FakeEngine()
+    generated = create_slice.slice_table_name(create_slice.slice_key("berlin", 5, 10))
+    engine.tables |= {generated, "slice_notes", "slice_berlin_backup", "slice_paris_3f2a9c1b7d4e"}
+    monkeypatch.setattr(create_slice, "get_db_connection", lambda: engine)
+
+    cache = create_slice.SliceCache(max_tables=0)
+    cache.release(cache.acquire("paris", 1, 2))
+    # the idle generated tables were evicted, the user's tables survive
+    assert "slice_notes" in engine.tables and "slice_berlin_backup" in engine.tables
+    assert generated not in engine.tables and "slice_paris_3f2a9c1b7d4e" not in engine.tables
+
+    engine.tables = {generated, "slice_notes", "slice_berlin_backup", "slice_paris_3f2a9c1b7d4e"}
+    assert create_slice.drop_slice_tables("Berlin") == 1
+    assert engine.tables == {"slice_notes", "slice_berlin_backup", "slice_paris_3f2a9c1b7d4e"}
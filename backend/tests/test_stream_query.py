@@ -0,0 +1,175 @@
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, text
+
+import utils.query as query
+from utils.query import PAIR_SCHEMA, stream_query
+
+
+@pytest.fixture
+def pairs_db(tmp_path, monkeypatch):
+    """A SQLite table shaped like the pair join, standing in for PostGIS."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'pairs.db'}")
+    columns = PAIR_SCHEMA.names
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE TABLE pairs ({', '.join(columns)})"))
+        for i in range(7):
+            conn.execute(
+                text(f"INSERT INTO pairs VALUES ({', '.join(':' + c for c in columns)})"),
+                {
+                    "uuid": f"a{i}", "relation_uuid": f"b{i}", "orig_id": i, "relation_orig_id": None,
+                    "h_1": 10.0, "h_2": 20.0, "lon_1": 13.4, "lon_2": 13.5, "lat_1": 52.5, "lat_2": 52.6,
+                    "distance_meters": i * 1.5, "source": "mly", "relation_id": f"a{i}__b{i}",
+                    "x_1": 0.0, "y_1": 0.0, "x_2": i * 1.5, "y_2": 0.0,
+                },
+            )
+    monkeypatch.setattr(query, "get_db_connection", lambda: engine)
+    monkeypatch.setattr(query, "_pair_query", lambda city, slice_table=None: "SELECT * FROM pairs ORDER BY uuid")
+    return engine
+
+
+def test_chunks_are_appended_to_parquet_and_csv(pairs_db, tmp_path):
+    progress = []
+    count = stream_query("Berlin", tmp_path / "r.parquet", tmp_path / "r.csv", chunk_rows=3, on_progress=progress.append)
+
+    assert count == 7
+    assert progress == [3, 6, 7]
+    df = pd.read_parquet(tmp_path / "r.parquet")
+    assert list(df.columns) == PAIR_SCHEMA.names
+    assert df["uuid"].tolist() == [f"a{i}" for i in range(7)]
+    assert df["relation_orig_id"].isna().all()
+    assert df.attrs["city"] == "berlin"
+    csv = pd.read_csv(tmp_path / "r.csv")
+    assert len(csv) == 7
+    assert csv["distance_meters"].tolist() == df["distance_meters"].tolist()
+
+
+def test_mapillary_ids_round_trip_as_integers(pairs_db, tmp_path):
+    big = 2 ** 53 + 1  # not representable as a float
+    with pairs_db.begin() as conn:
+        conn.execute(text("UPDATE pairs SET orig_id = :big, relation_orig_id = 325287995681911 WHERE uuid = 'a0'"), {"big": big})
+    stream_query("berlin", tmp_path / "r.parquet", tmp_path / "r.csv", chunk_rows=3)
+
+    df = pd.read_parquet(tmp_path / "r.parquet")
+    assert df["orig_id"].dtype == "Int64"
+    assert df["orig_id"].tolist() == [big] + list(range(1, 7))
+    assert df.loc[0, "relation_orig_id"] == 325287995681911 and df["relation_orig_id"].isna().sum() == 6
+    row = open(tmp_path / "r.csv").read().splitlines()[1]
+    assert f",{big},325287995681911," in row
+
+
+def test_empty_result_still_writes_both_files(pairs_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(query, "_pair_query", lambda city, slice_table=None: "SELECT * FROM pairs WHERE 0")
+    assert stream_query("berlin", tmp_path / "r.parquet", tmp_path / "r.csv") == 0
+    assert pd.read_parquet(tmp_path / "r.parquet").empty
+    assert list(pd.read_csv(tmp_path / "r.csv").columns) == PAIR_SCHEMA.names
+
+
+def test_tile_grid_partitions_the_extent():
+    tiles = query.tile_grid((0.0, 0.0, 10.0, 10.0), 8)
+    assert len(tiles) >= 8
+    points = [(x, y) for x in range(11) for y in range(11)]
+    for x, y in points:
+        owners = [t for t in tiles if t[0] <= x < t[2] and t[1] <= y < t[3]]
+        assert len(owners) == 1
+
+
+def test_sharded_query_merges_every_tile(pairs_db, tmp_path, monkeypatch):
+    with pairs_db.begin() as conn:
+        conn.execute(text("ALTER TABLE pairs ADD COLUMN ax REAL"))
+        conn.execute(text("ALTER TABLE pairs ADD COLUMN ay REAL"))
+        conn.execute(text("UPDATE pairs SET ax = distance_meters, ay = 10 - distance_meters"))
+    columns = ", ".join(PAIR_SCHEMA.names)
+    tiles = []
+
+    def tile_query(city, slice_table=None, tile=None, halo=0.0):
+        tiles.append(tile)
+        xmin, ymin, xmax, ymax = tile
+        return f"SELECT {columns} FROM pairs WHERE ax >= {xmin} AND ax < {xmax} AND ay >= {ymin} AND ay < {ymax}"
+
+    monkeypatch.setattr(query, "_pair_query", tile_query)
+    monkeypatch.setattr(query, "_slice_extent", lambda city, slice_table=None: (0.0, 1.0, 9.0, 10.0))
+    progress = []
+    count = query.stream_query_sharded("berlin", tmp_path / "r.parquet", tmp_path / "r.csv", halo=30, workers=3,
+                                       chunk_rows=1, on_progress=progress.append)
+
+    assert count == 7
+    # tiles arrive chunk by chunk, not as whole tile results
+    assert progress == list(range(1, 8))
+    assert len(tiles) >= 3 * query.QUERY_TILES_PER_WORKER
+    df = pd.read_parquet(tmp_path / "r.parquet")
+    assert sorted(df["uuid"]) == [f"a{i}" for i in range(7)]
+    assert len(pd.read_csv(tmp_path / "r.csv")) == 7
+
+
+def test_summarize_plan():
+    plan = {
+        "Planning Time": 1.2,
+        "Execution Time": 340.5,
+        "Plan": {
+            "Node Type": "Nested Loop", "Actual Rows": 42, "Shared Hit Blocks": 100, "Shared Read Blocks": 7,
+            "Plans": [
+                {"Node Type": "Seq Scan", "Relation Name": "slice_berlin_abc"},
+                {"Node Type": "Index Scan", "Relation Name": "berlin"},
+            ],
+        },
+    }
+    summary = query.summarize_plan(plan)
+    assert summary["execution_ms"] == 340.5
+    assert summary["join_node"] == "Nested Loop"
+    assert summary["scans"] == ["Index Scan on berlin", "Seq Scan on slice_berlin_abc"]
+    assert summary["rows"] == 42
+
+
+def test_explain_only_runs_the_join_with_analyze(monkeypatch):
+    statements = []
+
+    class Conn:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            pass
+
+        def execute(self, statement):
+            statements.append(str(statement))
+            return SimpleNamespace(scalar_one=lambda: '[{"Plan": {"Node Type": "Nested Loop", "Plan Rows": 9}}]')
+
+    monkeypatch.setattr(query, "get_db_connection", lambda: SimpleNamespace(connect=Conn))
+    monkeypatch.setattr(query, "_pair_query", lambda city, slice_table=None: "SELECT 1")
+    plan = query.explain_query("berlin")
+    query.explain_query("berlin", analyze=True)
+
+    assert statements == ["EXPLAIN (FORMAT JSON) SELECT 1", "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) SELECT 1"]
+    summary = query.summarize_plan(plan)
+    assert (summary["estimated_rows"], summary["rows"], summary["execution_ms"]) == (9, None, None)
+
+
+def test_sharded_query_raises_a_failing_tile(pairs_db, tmp_path, monkeypatch):
+    def tile_query(city, slice_table=None, tile=None, halo=0.0):
+        return "SELECT * FROM no_such_table" if tile[0] > 0 else "SELECT * FROM pairs"
+
+    monkeypatch.setattr(query, "_pair_query", tile_query)
+    monkeypatch.setattr(query, "_slice_extent", lambda city, slice_table=None: (0.0, 0.0, 9.0, 9.0))
+    with pytest.raises(Exception, match="no_such_table"):
+        query.stream_query_sharded("berlin", tmp_path / "r.parquet", workers=2, chunk_rows=1)
+
+
+class WorkerDied(BaseException):
+    pass
+
+
+@pytest.mark.parametrize("outcome, error", [(WorkerDied, WorkerDied), (None, RuntimeError)])
+def test_sharded_query_does_not_wait_on_a_dead_tile_worker(pairs_db, tmp_path, monkeypatch, outcome, error):
+    def tile_worker(query_sql, chunks, chunk_rows, stop):
+        if outcome is not None:
+            raise outcome()  # not an Exception, so nothing reaches the queue
+
+    monkeypatch.setattr(query, "_stream_tile", tile_worker)
+    monkeypatch.setattr(query, "_pair_query", lambda city, slice_table=None, tile=None, halo=0.0: "")
+    monkeypatch.setattr(query, "_POLL_SECONDS", 0.01)
+    monkeypatch.setattr(query, "_slice_extent", lambda city, slice_table=None: (0.0, 0.0, 9.0, 9.0))
+    with pytest.raises(error):
+        query.stream_query_sharded("berlin", tmp_path / "r.parquet", workers=2)
@@ -0,0 +1,46 @@
+import time
+
+from stub_graph import StubGraph
+from utils.mapillary import resolve_urls
+from utils.url_cache import UrlCache
+
+
+def test_get_many_returns_unexpired_urls_per_field(tmp_path):
+    cache = UrlCache(tmp_path / "urls.db", ttl_seconds=100)
+    cache.put_many("thumb_256_url", {"1": "u1", "2": "u2", "3": None}, now=1000)
+    cache.put_many("thumb_1024_url", {"1": "big1"}, now=1050)
+
+    assert cache.get_many(["1", "2", "3", "4"], "thumb_256_url", now=1050) == {"1": "u1", "2": "u2"}
+    assert cache.get_many(["1"], "thumb_1024_url", now=1050) == {"1": "big1"}
+    # past the TTL the URL has to be resolved again
+    assert cache.get_many(["1", "2"], "thumb_256_url", now=1101) == {}
+    cache.put_many("thumb_256_url", {"2": "u2-new"}, now=1100)
+    assert cache.get_many(["1", "2"], "thumb_256_url", now=1101) == {"2": "u2-new"}
+
+    assert cache.purge_expired(now=1101) == 1
+    assert cache.get_many(["1"], "thumb_1024_url", now=1101) == {"1": "big1"}
+
+
+def test_rerun_skips_metadata_calls_for_cached_ids(tmp_path):
+    cache = UrlCache(tmp_path / "urls.db", ttl_seconds=3600)
+    ids = [str(7000 + i) for i in range(30)]
+    with StubGraph(missing={"7003"}) as stub:
+        first = resolve_urls(ids, "thumb_256_url", "token", api_base=stub.base, cache=cache)
+        calls = stub.metadata_requests
+        second = resolve_urls(ids[:10], "thumb_256_url", "token", api_base=stub.base, cache=cache)
+
+    assert second == {i: first[i] for i in ids[:10]}
+    assert second["7003"] is None
+    # only the id without a URL is asked again
+    assert stub.metadata_requests == calls + 1
+
+
+def test_resolve_urls_purges_expired_entries(tmp_path):
+    cache = UrlCache(tmp_path / "urls.db", ttl_seconds=3600)
+    cache.put_many("thumb_256_url", {"1": "stale", "2": "fresh"}, now=time.time() - 3601)
+    cache.put_many("thumb_256_url", {"2": "fresh"})
+    with StubGraph() as stub:
+        resolve_urls(["8000"], "thumb_256_url", "token", api_base=stub.base, cache=cache)
+
+    count = cache._connection().execute("SELECT COUNT(*) FROM url_cache").fetchone()[0]
+    assert count == 2 and cache.get_many(["1", "2"], "thumb_256_url") == {"2": "fresh"}
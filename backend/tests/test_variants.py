@@ -0,0 +1,54 @@
+import os
+
+import pytest
+from PIL import Image
+
+import utils.variants as variants
+
+
+def test_variant_is_rendered_once_and_reused(tmp_path, monkeypatch):
+    monkeypatch.setattr(variants, "IMAGES_DIR", tmp_path)
+    monkeypatch.setattr(variants, "VARIANTS_DIR", tmp_path / "variants")
+    src = tmp_path / "berlin" / "u1.jpg"
+    src.parent.mkdir()
+    Image.new("RGB", (2048, 1536), (120, 30, 200)).save(src, "JPEG")
+
+    tile = variants.get_variant(src, 480, "jpeg")
+    assert tile == tmp_path / "variants" / "w480" / "berlin" / "u1.jpg"
+    with Image.open(tile) as img:
+        assert img.size == (480, 360)
+
+    mtime = tile.stat().st_mtime_ns
+    assert variants.get_variant(src, 480, "jpeg") == tile
+    assert tile.stat().st_mtime_ns == mtime
+
+    webp = variants.get_variant(src, None, "webp")
+    with Image.open(webp) as img:
+        assert img.format == "WEBP" and img.size == (2048, 1536)
+    assert variants.get_variant(src, None, "jpeg") == src
+
+
+def test_variant_follows_a_redownloaded_source(tmp_path, monkeypatch):
+    monkeypatch.setattr(variants, "IMAGES_DIR", tmp_path)
+    monkeypatch.setattr(variants, "VARIANTS_DIR", tmp_path / "variants")
+    src = tmp_path / "berlin" / "u1.jpg"
+    src.parent.mkdir()
+    Image.new("RGB", (1024, 768), (255, 0, 0)).save(src, "JPEG")
+    tile = variants.get_variant(src, 480, "jpeg")
+
+    Image.new("RGB", (1024, 512), (0, 0, 255)).save(src, "JPEG")
+    os.utime(src, ns=(src.stat().st_mtime_ns + 10 ** 9,) * 2)
+    assert variants.get_variant(src, 480, "jpeg") == tile
+    with Image.open(tile) as img:
+        assert img.size == (480, 240)
+
+
+def test_corrupt_source_raises_oserror(tmp_path, monkeypatch):
+    monkeypatch.setattr(variants, "IMAGES_DIR", tmp_path)
+    monkeypatch.setattr(variants, "VARIANTS_DIR", tmp_path / "variants")
+    src = tmp_path / "berlin" / "u1.jpg"
+    src.parent.mkdir()
+    src.write_bytes(b"<html>rate limited</html>")
+    with pytest.raises(OSError):
+        variants.get_variant(src, 480, "webp")
+    assert not (tmp_path / "variants" / "w480" / "berlin" / "u1.webp").exists()
@@ -1,27 +1,23 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
 from utils.db import get_db_connection
 from sqlalchemy import text
 
-def create_materialized_view(city, inner_buffer, outer_buffer, lat=None, lng=None, radius_m=None):
-    assert isinstance(inner_buffer, (int, float)) and isinstance(outer_buffer, (int, float)), \
-        "Buffer distances must be numeric"
-    
-    # Validate city and get EPSG code
-    city_epsg = {
-        "berlin": 32633,
-        "paris": 32631,
-        "washington": 32618,
-        "singapore": 32648
-    }
-    
-    city = city.lower()
-    if city not in city_epsg:
-        raise ValueError(f"Invalid city '{city}'. Must be one of: {list(city_epsg.keys())}")
-    
-    epsg = city_epsg[city]
-    
-    area_filter = ""
-    if lat is not None and lng is not None and radius_m is not None:
-        area_filter = f"""
+CITY_EPSG = {
+    "berlin": 32633,
+    "paris": 32631,
+    "washington": 32618,
+    "singapore": 32648
+}
+
+def area_filter_sql(epsg, lat=None, lng=None, radius_m=None):
+    """AND-clause keeping points within radius_m of (lat, lng), or "" without an area."""
+    if lat is None or lng is None or radius_m is None:
+        return ""
+    return f"""
             AND ST_Intersects(
                 geometry_comp_{epsg},
                 ST_Transform(
@@ -33,27 +29,10 @@ def create_materialized_view(city, inner_buffer, outer_buffer, lat=None, lng=Non
                 )
             )
         """
-    
-    # Dynamic view and table names based on city
-    view_name = f"{city}_slice"
-    table_name = city
-    index_name = f"{city}_slice_gist"
-    
-    query = f"""
-    DROP MATERIALIZED VIEW IF EXISTS {view_name};
-    CREATE MATERIALIZED VIEW {view_name} AS
-    SELECT
-        uuid,
-        orig_id_x,
-        view_direction,
-        platform,
-        place,
-        source_x,
-        heading,
-        geometry_comp_{epsg},
-        comp_lat,
-        comp_lon,
-        ST_Difference(
+
+def slice_geom_sql(epsg, inner_buffer, outer_buffer):
+    """Slice polygon of one row: ring between the buffers minus the corridor along its heading."""
+    return f"""ST_Difference(
             ST_Difference(
                 ST_Buffer(geometry_comp_{epsg}, {outer_buffer}),
                 ST_Buffer(geometry_comp_{epsg}, {inner_buffer})
@@ -73,17 +52,208 @@ def create_materialized_view(city, inner_buffer, outer_buffer, lat=None, lng=Non
                 ),
                 {inner_buffer}, 'endcap=square join=mitre'
             )
-        ) AS slice_geom
+        )"""
+
+def _slice_select(city, inner_buffer, outer_buffer, lat=None, lng=None, radius_m=None):
+    """SELECT producing one slice polygon (ring minus heading corridor) per high-quality image."""
+    assert isinstance(inner_buffer, (int, float)) and isinstance(outer_buffer, (int, float)), \
+        "Buffer distances must be numeric"
+    
+    city = city.lower()
+    if city not in CITY_EPSG:
+        raise ValueError(f"Invalid city '{city}'. Must be one of: {list(CITY_EPSG.keys())}")
+    
+    epsg = CITY_EPSG[city]
+    area_filter = area_filter_sql(epsg, lat, lng, radius_m)
+    table_name = city
+    
+    return f"""
+    SELECT
+        uuid,
+        orig_id_x,
+        view_direction,
+        platform,
+        place,
+        source_x,
+        heading,
+        geometry_comp_{epsg},
+        comp_lat,
+        comp_lon,
+        {slice_geom_sql(epsg, inner_buffer, outer_buffer)} AS slice_geom
     FROM {table_name}
     WHERE mly_quality_score >= 0.95
-    {area_filter};
+    {area_filter}
+    """
+
+def create_materialized_view(city, inner_buffer, outer_buffer, lat=None, lng=None, radius_m=None, on_stage=None):
+    """
+    Rebuild the shared {city}_slice view. Kept for manual use; the API uses SliceCache,
+    which does not race when several queries run at once.
+    on_stage: optional callback, called with "materializing" and "indexing" as work proceeds.
+    """
+    select = _slice_select(city, inner_buffer, outer_buffer, lat, lng, radius_m)
+    city = city.lower()
     
+    # Dynamic view and index names based on city
+    view_name = f"{city}_slice"
+    index_name = f"{city}_slice_gist"
+    
+    query = f"""
+    DROP MATERIALIZED VIEW IF EXISTS {view_name};
+    CREATE MATERIALIZED VIEW {view_name} AS
+    {select};
+    """
+    
+    index_query = f"""
     DROP INDEX IF EXISTS {index_name};
     CREATE INDEX {index_name} ON {view_name} USING gist (slice_geom);
     """
     
     engine = get_db_connection()
     with engine.begin() as connection:
+        if on_stage:
+            on_stage("materializing")
         connection.execute(text(query))
+        if on_stage:
+            on_stage("indexing")
+        connection.execute(text(index_query))
     
-    print(f"Materialized view '{view_name}' created successfully for {city}.")
\ No newline at end of file
+    print(f"Materialized view '{view_name}' created successfully for {city}.")
+
+
+def slice_key(city, inner_buffer, outer_buffer, lat=None, lng=None, radius_m=None):
+    """Canonical parameter tuple: rounded so that equivalent requests share a slice table."""
+    area = None
+    if lat is not None and lng is not None and radius_m is not None:
+        area = (round(float(lat), 6), round(float(lng), 6), round(float(radius_m), 2))
+    return (city.lower(), round(float(inner_buffer), 2), round(float(outer_buffer), 2), area)
+
+def slice_table_name(key):
+    digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:12]
+    return f"slice_{key[0]}_{digest}"
+
+
+def slice_table_pattern(city=None):
+    """Regex for the names slice_table_name generates (of one city), so no other table is adopted or dropped."""
+    cities = re.escape(city.lower()) if city else "|".join(CITY_EPSG)
+    return f"^slice_({cities})_[0-9a-f]{{12}}$"
+
+
+def _slice_tables(conn, city=None):
+    """Slice tables in the current schema, optionally of one city."""
+    rows = conn.execute(
+        text("SELECT tablename FROM pg_tables WHERE schemaname = current_schema() AND tablename ~ :pattern"),
+        {"pattern": slice_table_pattern(city)},
+    )
+    return [name for (name,) in rows]
+
+
+class SliceCache:
+    """
+    One slice table per parameter set (city, inner, outer, area), e.g. slice_berlin_3f2a9c1b7d4e.
+    Repeated and concurrent queries with the same parameters share a table instead of
+    dropping and rebuilding {city}_slice. Tables in use are reference counted; once more
+    than max_tables exist, the least recently used unreferenced ones are dropped.
+    """
+
+    def __init__(self, max_tables):
+        self.max_tables = max_tables
+        self._tables = OrderedDict()  # table name -> refcount
+        self._building = {}           # table name -> lock held while it is built or dropped
+        self._lock = threading.Lock()
+        self._discovered = False
+
+    def acquire(self, city, inner_buffer, outer_buffer, lat=None, lng=None, radius_m=None, on_stage=None):
+        """
+        Return the slice table for these parameters, building it if needed.
+        Every acquire must be paired with release(table) once the join has run.
+        """
+        key = slice_key(city, inner_buffer, outer_buffer, lat, lng, radius_m)
+        name = slice_table_name(key)
+        engine = get_db_connection()
+        
+        with self._lock:
+            if not self._discovered:
+                self._discover(engine)
+            self._tables[name] = self._tables.get(name, 0) + 1
+            self._tables.move_to_end(name)
+            build_lock = self._building.setdefault(name, threading.Lock())
+        
+        try:
+            with build_lock:
+                self._ensure_table(engine, name, key, on_stage)
+        except BaseException:
+            self.release(name)
+            raise
+        
+        self._evict(engine)
+        return name
+
+    def release(self, name):
+        with self._lock:
+            if self._tables.get(name, 0) > 0:
+                self._tables[name] -= 1
+
+    def _discover(self, engine):
+        """Adopt slice tables left by earlier runs so they can be reused or evicted."""
+        with engine.connect() as conn:
+            names = _slice_tables(conn)
+        for name in names:
+            self._tables.setdefault(name, 0)
+            self._tables.move_to_end(name, last=False)
+        self._discovered = True
+
+    def _ensure_table(self, engine, name, key, on_stage):
+        city, inner_buffer, outer_buffer, area = key
+        lat, lng, radius_m = area if area else (None, None, None)
+        
+        with engine.begin() as conn:
+            # serialize builds of the same table across processes too
+            conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name))"), {"name": name})
+            exists = conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar()
+            if exists:
+                return
+            
+            select = _slice_select(city, inner_buffer, outer_buffer, lat, lng, radius_m)
+            if on_stage:
+                on_stage("materializing")
+            conn.execute(text(f"CREATE UNLOGGED TABLE {name} AS {select}"))
+            if on_stage:
+                on_stage("indexing")
+            conn.execute(text(f"CREATE INDEX {name}_gist ON {name} USING gist (slice_geom)"))
+            conn.execute(text(f"ANALYZE {name}"))
+        print(f"Slice table '{name}' created for {key}.")
+
+    def _evict(self, engine):
+        with self._lock:
+            idle = [name for name, refs in self._tables.items() if refs == 0]
+            excess = len(self._tables) - self.max_tables
+            victims = idle[:max(0, excess)]
+            for name in victims:
+                del self._tables[name]
+            locks = [self._building.setdefault(name, threading.Lock()) for name in victims]
+        
+        for name, build_lock in zip(victims, locks):
+            with build_lock:
+                with self._lock:
+                    if name in self._tables:
+                        # acquired again in the meantime
+                        continue
+                with engine.begin() as conn:
+                    conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name))"), {"name": name})
+                    conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+            print(f"Slice table '{name}' dropped.")
+
+def drop_slice_tables(city):
+    """
+    Drop every slice table of city, e.g. after rows were deleted from its table.
+    A running API process rebuilds them on the next acquire.
+    """
+    engine = get_db_connection()
+    with engine.connect() as conn:
+        names = _slice_tables(conn, city)
+    for name in names:
+        with engine.begin() as conn:
+            conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name))"), {"name": name})
+            conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+    return len(names)
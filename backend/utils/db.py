@@ -1,7 +1,148 @@
-from sqlalchemy import create_engine
+import os
+import threading
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import QueuePool
 from config import Config
 
+
+class PoolMetrics:
+    """Counters for the engine's connection pool, fed by pool events."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connects = 0
+            self.checkouts = 0
+            self.timeouts = 0
+            self.in_use = 0
+            self.wait_total_s = 0.0
+            self.wait_max_s = 0.0
+            self.held_total_s = 0.0
+            self.held_max_s = 0.0
+            self.checkins = 0
+
+    def record_wait(self, seconds, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.in_use += 1
+            self.wait_total_s += seconds
+            self.wait_max_s = max(self.wait_max_s, seconds)
+
+    def record_connect(self):
+        with self._lock:
+            self.connects += 1
+
+    def record_checkin(self, held_seconds):
+        with self._lock:
+            self.checkins += 1
+            self.in_use = max(0, self.in_use - 1)
+            self.held_total_s += held_seconds
+            self.held_max_s = max(self.held_max_s, held_seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "in_use": self.in_use,
+                "wait_avg_ms": round(1000 * self.wait_total_s / self.checkouts, 3) if self.checkouts else 0.0,
+                "wait_max_ms": round(1000 * self.wait_max_s, 3),
+                "held_avg_ms": round(1000 * self.held_total_s / self.checkins, 3) if self.checkins else 0.0,
+                "held_max_ms": round(1000 * self.held_max_s, 3),
+            }
+
+
+pool_metrics = PoolMetrics()
+
+
+class _TimedQueuePool(QueuePool):
+    """QueuePool that reports how long each checkout waited for a free connection."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeout:
+            pool_metrics.record_wait(time.perf_counter() - start, timed_out=True)
+            raise
+        pool_metrics.record_wait(time.perf_counter() - start)
+        return conn
+
+
+def _on_connect(dbapi_connection, connection_record):
+    pool_metrics.record_connect()
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    connection_record.info["checked_out_at"] = time.perf_counter()
+
+def _on_checkin(dbapi_connection, connection_record):
+    started = connection_record.info.pop("checked_out_at", None)
+    if started is not None:
+        pool_metrics.record_checkin(time.perf_counter() - started)
+
+
+_engine = None
+_engine_pid = None
+_engine_lock = threading.Lock()
+
+def _database_url():
+    return f"postgresql+psycopg://{Config.DB_USER}:{Config.DB_PASSWORD}@{Config.DB_HOST}:{Config.DB_PORT}/{Config.DB_NAME}"
+
+def _create_engine(url):
+    engine = create_engine(
+        url,
+        poolclass=_TimedQueuePool,
+        pool_size=Config.DB_POOL_SIZE,
+        max_overflow=Config.DB_MAX_OVERFLOW,
+        pool_timeout=Config.DB_POOL_TIMEOUT,
+        pool_recycle=Config.DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
+    event.listen(engine, "connect", _on_connect)
+    event.listen(engine, "checkout", _on_checkout)
+    event.listen(engine, "checkin", _on_checkin)
+    return engine
+
 def get_db_connection():
-    url = f"postgresql+psycopg://{Config.DB_USER}:{Config.DB_PASSWORD}@{Config.DB_HOST}:{Config.DB_PORT}/{Config.DB_NAME}"
-    engine = create_engine(url)
-    return engine
\ No newline at end of file
+    """
+    The process-wide pooled engine, created on first use.
+    Callers take sessions with engine.connect()/engine.begin(); don't dispose it.
+    """
+    global _engine, _engine_pid
+    pid = os.getpid()
+    if _engine is None or _engine_pid != pid:
+        with _engine_lock:
+            if _engine is None or _engine_pid != pid:
+                if _engine is not None:
+                    # forked child: never reuse the parent's sockets
+                    _engine.dispose(close=False)
+                _engine = _create_engine(_database_url())
+                _engine_pid = pid
+    return _engine
+
+def dispose_engine():
+    """Close pooled connections, e.g. when the process shuts down."""
+    global _engine, _engine_pid
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose()
+        _engine = None
+        _engine_pid = None
+
+def pool_status():
+    """Pool metrics plus the pool's current size and checked-out count."""
+    status = pool_metrics.snapshot()
+    if _engine is not None:
+        pool = _engine.pool
+        status.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow())
+    return status
@@ -1,12 +1,20 @@
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Iterable, Tuple, Dict, List
+from typing import Callable, Iterable, Tuple, Dict, List, Optional
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
-from config import IMAGES_DIR
+from config import IMAGES_DIR, DOWNLOAD_WORKERS
+from utils.download_journal import atomic_write_bytes, get_journal
+from utils.image_index import image_index
+from utils.mapillary import GRAPH_BASE, resolve_urls
+from utils.url_cache import url_cache
 
-GRAPH_BASE = "https://graph.mapillary.com"
 URL_FIELD = "thumb_original_url"
+# per-city record of finished downloads (utils/download_journal.py), keyed by uuid
+JOURNAL_NAME = ".download_journal.jsonl"
 
 load_dotenv()
 TOKEN = os.getenv("MAPILLARY_TOKEN")
@@ -19,33 +27,60 @@ def _local_path(dest_name: str, city: str) -> Path:
     city_dir.mkdir(parents=True, exist_ok=True)
     return city_dir / f"{dest_name}.jpg"
 
-def _fetch_url_single(image_id: str) -> str | None:
-    """Fetch thumb_original_url for a single image id (no batching)."""
-    url = f"{GRAPH_BASE}/{image_id}?fields=id,{URL_FIELD}&access_token={TOKEN}"
-    r = requests.get(url, timeout=12)
-    if r.status_code != 200:
-        print(f"[META-HTTP-{r.status_code}] id={image_id} body={r.text[:200]}", flush=True)
-        return None
-    j = r.json()
-    u = j.get(URL_FIELD)
-    if not u:
-        print(f"[META-MISS] id={image_id} has no {URL_FIELD}", flush=True)
-        return None
-    return u
-
-def download_pairs(pairs: Iterable[Tuple[str, str]], city: str) -> Dict:
+def make_session(workers: int = DOWNLOAD_WORKERS) -> requests.Session:
+    """
+    Session whose connection pool keeps up to `workers` keep-alive connections per host,
+    so parallel downloads reuse TLS connections instead of opening two per image.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(1, workers), pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def _download_one(session: requests.Session, fid: str, dest: str, city: str, url: str, journal) -> Optional[int]:
+    """Download one image from its resolved URL; its size once saved, indexed and journaled, else None."""
+    try:
+        resp = session.get(url, timeout=20)
+        if resp.status_code == 200 and resp.content:
+            path = _local_path(dest, city)
+            atomic_write_bytes(path, resp.content)
+            image_index.add(dest, city, path)
+            journal.record(dest, "ok", id=fid, bytes=len(resp.content))
+            print(f"Image {fid} downloaded and saved under {path}", flush=True)
+            return len(resp.content)
+        print(f"[FAIL] download HTTP {resp.status_code} for id={fid}", flush=True)
+    except requests.RequestException as e:
+        print(f"[FAIL] exception for id={fid}: {e}", flush=True)
+    journal.record(dest, "failed", id=fid)
+    return None
+
+def download_pairs(
+    pairs: Iterable[Tuple[str, str]],
+    city: str,
+    workers: int = DOWNLOAD_WORKERS,
+    on_stage: Optional[Callable[[str], None]] = None,
+    on_progress: Optional[Callable[[Dict], None]] = None,
+    should_cancel: Optional[Callable[[], bool]] = None,
+) -> Dict:
     """
     pairs: (fetch_id -> Mapillary image id, dest_name -> UUID)
     city: City name (e.g., "berlin", "paris", "washington", "singapore")
-    Downloads original (thumb_original_url) and saves as images/{city}/{uuid}.jpg
+    Downloads original (thumb_original_url) and saves as images/{city}/{uuid}.jpg.
+    URLs are resolved in batches (utils/mapillary.py), then `workers` images are
+    fetched at a time over one pooled session. Ids whose lookup keeps failing count as
+    missing_meta, like ids without a URL, and the other images are still downloaded.
+    on_stage gets "resolving" / "downloading"; on_progress gets the counts (total, skipped,
+    done, failed, missing_meta, bytes, bytes_per_s) after each image. Once should_cancel()
+    is true no further downloads start; the images in flight still finish.
     Prints: 'Image <fetch_id> downloaded and saved under <path>'
     """
     city = city.lower()
-    
+
     # Create city-specific directory
     city_dir = IMAGES_DIR / city
     city_dir.mkdir(parents=True, exist_ok=True)
-    
+
     # de-dupe + clean
     seen = set()
     uniq_pairs: List[Tuple[str, str]] = []
@@ -54,42 +89,89 @@ def download_pairs(pairs: Iterable[Tuple[str, str]], city: str) -> Dict:
         if fid and dest and (fid, dest) not in seen:
             seen.add((fid, dest))
             uniq_pairs.append((fid, dest))
-    
-    # skip existing
+
+    # skip existing: journaled downloads without a stat, older files by checking the disk once
+    journal = get_journal(city_dir / JOURNAL_NAME)
+    done = journal.done()
     to_fetch = []
     skipped_existing = 0
     for fid, dest in uniq_pairs:
+        if dest in done:
+            skipped_existing += 1
+            continue
         path = _local_path(dest, city)
         if path.exists() and path.stat().st_size > 0:
+            journal.record(dest, "exists", id=fid)
             skipped_existing += 1
         else:
             to_fetch.append((fid, dest))
-    
+
     downloaded = 0
     missing_meta, failed = [], []
-    
-    for fid, dest in to_fetch:
-        # 1) per-id metadata call (works like your curl)
-        url = _fetch_url_single(fid)
-        if not url:
-            missing_meta.append(fid)
-            continue
-        
-        # 2) download
-        try:
-            resp = requests.get(url, timeout=20)
-            if resp.status_code == 200 and resp.content:
-                path = _local_path(dest, city)
-                path.write_bytes(resp.content)
-                downloaded += 1
-                print(f"Image {fid} downloaded and saved under {path}", flush=True)
-            else:
-                failed.append((fid, dest))
-                print(f"[FAIL] download HTTP {resp.status_code} for id={fid}", flush=True)
-        except requests.RequestException as e:
-            failed.append((fid, dest))
-            print(f"[FAIL] exception for id={fid}: {e}", flush=True)
-    
+    progress = {"total": len(uniq_pairs), "skipped": skipped_existing, "done": 0, "failed": 0, "missing_meta": 0, "bytes": 0}
+    started = time.perf_counter()
+
+    def report():
+        if on_progress:
+            elapsed = time.perf_counter() - started
+            on_progress({**progress, "bytes_per_s": round(progress["bytes"] / elapsed) if elapsed > 0 else 0})
+
+    report()
+
+    def cancelled():
+        return bool(should_cancel and should_cancel())
+
+    if to_fetch and not cancelled():
+        workers = max(1, min(workers, len(to_fetch)))
+        with make_session(workers) as session:
+            if on_stage:
+                on_stage("resolving")
+            urls = resolve_urls([fid for fid, _ in to_fetch], URL_FIELD, TOKEN, session,
+                                api_base=GRAPH_BASE, cache=url_cache, should_cancel=should_cancel)
+            resolved = []
+            # ids a cancelled lookup never reached are not missing, just not done
+            for fid, dest in ([] if cancelled() else to_fetch):
+                if urls.get(fid):
+                    resolved.append((fid, dest))
+                else:
+                    missing_meta.append(fid)
+                    journal.record(dest, "no_url", id=fid)
+            progress["missing_meta"] = len(missing_meta)
+            report()
+
+            if on_stage and not cancelled():
+                on_stage("downloading")
+            sizes = {}
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = {
+                    pool.submit(_download_one, session, fid, dest, city, urls[fid], journal): i
+                    for i, (fid, dest) in enumerate(resolved)
+                }
+                stopping = False
+                for future in as_completed(futures):
+                    if future.cancelled():
+                        continue
+                    sizes[futures[future]] = size = future.result()
+                    if size is None:
+                        progress["failed"] += 1
+                    else:
+                        progress["done"] += 1
+                        progress["bytes"] += size
+                    report()
+                    if not stopping and cancelled():
+                        # drop the queued downloads; the ones in flight finish and are still counted
+                        stopping = True
+                        for pending in futures:
+                            pending.cancel()
+            # in to_fetch order, so failed lists the same ids as a sequential run
+            for i, (fid, dest) in enumerate(resolved):
+                if i not in sizes:
+                    continue
+                if sizes[i] is None:
+                    failed.append((fid, dest))
+                else:
+                    downloaded += 1
+
     return {
         "city": city,
         "requested_pairs": len(uniq_pairs),
@@ -99,4 +181,4 @@ def download_pairs(pairs: Iterable[Tuple[str, str]], city: str) -> Dict:
         "missing_meta": missing_meta[:5],
         "failed": failed[:5],
         "images_dir": str(city_dir.resolve()),
-    }
\ No newline at end of file
+    }
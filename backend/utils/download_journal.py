@@ -0,0 +1,103 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Set
+
+# Entries with these statuses are finished; anything else is retried by the next run
+DONE_STATUSES = ("ok", "exists")
+
+
+@contextmanager
+def atomic_open(path: Path):
+    """
+    Binary file handle for path that only appears under its final name once the block
+    completes: written to a hidden temp file in the same directory, then renamed over path.
+    A killed run leaves a stray .part file, never a truncated image.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.part")
+    try:
+        with open(tmp, "wb") as f:
+            yield f
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+def atomic_write_bytes(path: Path, data: bytes) -> None:
+    with atomic_open(path) as f:
+        f.write(data)
+
+
+class DownloadJournal:
+    """
+    Append-only JSON-lines log of download outcomes, one line per finished item:
+    {"key": ..., "status": "ok" | "exists" | "failed" | ..., "t": ..., **fields}.
+    Lines are flushed as they are written, so a killed run keeps everything it finished;
+    the last line for a key wins. A restarted run skips done() keys without touching their files.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._entries: Dict[str, dict] = {}
+        self._load()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # line cut short by a crash
+                self._entries[entry["key"]] = entry
+
+    def record(self, key: str, status: str, **fields) -> None:
+        entry = {"key": str(key), "status": status, "t": round(time.time(), 3), **fields}
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self._entries[entry["key"]] = entry
+
+    def entries(self) -> Dict[str, dict]:
+        """key -> latest entry."""
+        with self._lock:
+            return dict(self._entries)
+
+    def done(self) -> Set[str]:
+        with self._lock:
+            return {key for key, entry in self._entries.items() if entry["status"] in DONE_STATUSES}
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_journals: Dict[Path, DownloadJournal] = {}
+_journals_lock = threading.Lock()
+
+
+def get_journal(path: Path) -> DownloadJournal:
+    """Process-wide journal for path, so concurrent downloads into one folder share its lock and state."""
+    path = Path(path).resolve()
+    with _journals_lock:
+        journal = _journals.get(path)
+        if journal is None:
+            journal = _journals[path] = DownloadJournal(path)
+        return journal
@@ -0,0 +1,137 @@
+import json
+import math
+import time
+
+from sqlalchemy import text
+
+from config import ESTIMATE_SAMPLE_ANCHORS
+from utils.create_slice import CITY_EPSG, area_filter_sql, slice_geom_sql
+from utils.db import get_db_connection
+
+Z_95 = 1.96
+
+
+def bernoulli_estimate(counts, fraction):
+    """
+    Horvitz-Thompson total from a Bernoulli sample that kept each row with probability fraction:
+    sum(counts) / fraction, with variance sum((1 - fraction) / fraction**2 * count**2).
+    Returns (estimate, standard_error).
+    """
+    if fraction >= 1:
+        return float(sum(counts)), 0.0
+    estimate = sum(counts) / fraction
+    variance = (1 - fraction) / fraction ** 2 * sum(c * c for c in counts)
+    return estimate, math.sqrt(variance)
+
+
+def sample_mean_estimate(counts, population):
+    """
+    Total over population anchors from a simple random sample of their pair counts:
+    population * mean, with the finite population correction. Returns (estimate, standard_error).
+    """
+    n = len(counts)
+    if n == 0:
+        return 0.0, 0.0
+    mean = sum(counts) / n
+    if n == 1 or n >= population:
+        return population * mean, 0.0
+    var = sum((c - mean) ** 2 for c in counts) / (n - 1)
+    return population * mean, population * math.sqrt((1 - n / population) * var / n)
+
+
+def sample_percent(sample_anchors, anchor_rows):
+    """TABLESAMPLE BERNOULLI percentage that keeps about sample_anchors of anchor_rows anchors."""
+    if not anchor_rows or anchor_rows <= 0:
+        return 100.0
+    return min(100.0, 100.0 * sample_anchors / anchor_rows)
+
+
+def _planned_anchor_rows(conn, city):
+    """
+    The planner's estimate of the city's high-quality anchors: the table's rows times the
+    selectivity of the quality filter, without counting them.
+    """
+    plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) SELECT 1 FROM {city} WHERE mly_quality_score >= 0.95")).scalar_one()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Plan"]["Plan Rows"]
+
+
+def _partner_count_sql(epsg, table_name):
+    """Pairs of one sampled anchor a, with the join conditions of query.py."""
+    return f"""
+        SELECT count(*)
+        FROM {table_name} AS b
+        WHERE b.mly_quality_score >= 0.95
+            AND b.uuid > a.uuid
+            AND b.geometry_comp_{epsg} && a.slice_geom
+            AND ST_Within(b.geometry_comp_{epsg}, a.slice_geom)
+            AND LEAST(
+                ABS(a.heading - b.heading),
+                360 - ABS(a.heading - b.heading)
+                ) <= 45
+    """
+
+
+def estimate_pairs(city, inner_buffer, outer_buffer, lat=None, lng=None, radius_m=None,
+                   sample_anchors=ESTIMATE_SAMPLE_ANCHORS, timeout_ms=5000):
+    """
+    Approximate number of pairs run_query would return, from the pair counts of about
+    sample_anchors sampled anchors. The slice polygons are only built for the sample.
+
+    Without an area, anchors are a TABLESAMPLE BERNOULLI of the city table sized from the
+    planner's estimate of the high-quality anchors. With an area, the anchors in it are counted exactly (the area
+    filter is indexed) and a random subset is sampled.
+    Returns a dict with estimate and a 95% interval (ci_low, ci_high).
+    """
+    city = city.lower()
+    if city not in CITY_EPSG:
+        raise ValueError(f"Invalid city '{city}'. Must be one of: {list(CITY_EPSG.keys())}")
+    epsg = CITY_EPSG[city]
+    slice_geom = slice_geom_sql(epsg, float(inner_buffer), float(outer_buffer))
+    has_area = lat is not None and lng is not None and radius_m is not None
+    
+    started = time.perf_counter()
+    with get_db_connection().begin() as conn:
+        conn.execute(text(f"SET LOCAL statement_timeout = {int(timeout_ms)}"))
+        if has_area:
+            area_filter = area_filter_sql(epsg, lat, lng, radius_m)
+            population = conn.execute(text(
+                f"SELECT count(*) FROM {city} WHERE mly_quality_score >= 0.95 {area_filter}"
+            )).scalar_one()
+            anchors = f"""
+                SELECT uuid, heading, {slice_geom} AS slice_geom
+                FROM {city}
+                WHERE mly_quality_score >= 0.95 {area_filter}
+                ORDER BY random()
+                LIMIT {int(sample_anchors)}
+            """
+        else:
+            # sized from the anchors, not all rows: only high-quality rows in the sample are kept
+            percent = sample_percent(sample_anchors, _planned_anchor_rows(conn, city))
+            anchors = f"""
+                SELECT uuid, heading, {slice_geom} AS slice_geom
+                FROM {city} TABLESAMPLE BERNOULLI ({percent})
+                WHERE mly_quality_score >= 0.95
+            """
+        counts = [int(c) for c in conn.execute(text(f"""
+            WITH a AS ({anchors})
+            SELECT ({_partner_count_sql(epsg, city)}) AS n FROM a
+        """)).scalars()]
+    
+    if has_area:
+        estimate, se = sample_mean_estimate(counts, population)
+        method = "random sample of area anchors"
+    else:
+        estimate, se = bernoulli_estimate(counts, percent / 100.0)
+        method = f"TABLESAMPLE BERNOULLI ({percent:.4g}%)"
+    return {
+        "estimate": round(estimate),
+        "ci_low": max(0, math.floor(estimate - Z_95 * se)),
+        "ci_high": math.ceil(estimate + Z_95 * se),
+        "confidence": 0.95,
+        "sampled_anchors": len(counts),
+        "method": method,
+        "exact": False,
+        "elapsed_s": round(time.perf_counter() - started, 3),
+    }
@@ -0,0 +1,118 @@
+import io
+import json
+import math
+import zlib
+from pathlib import Path
+from typing import Iterator
+
+import pyarrow.parquet as pq
+
+from config import EXPORT_BATCH_ROWS
+
+# format -> (media type, file suffix)
+EXPORT_FORMATS = {
+    "csv": ("text/csv", ".csv"),
+    "csv.gz": ("application/gzip", ".csv.gz"),
+    "parquet": ("application/vnd.apache.parquet", ".parquet"),
+    "geojson": ("application/geo+json", ".geojson"),
+}
+
+FILE_CHUNK_BYTES = 1024 * 1024
+
+# pair columns that become GeoJSON properties (the coordinates form the LineString)
+GEOJSON_PROPERTIES = ("uuid", "relation_uuid", "orig_id", "relation_orig_id", "h_1", "h_2",
+                      "distance_meters", "source", "relation_id")
+
+
+def result_attrs(path: Path) -> dict:
+    """The attrs pandas stored with a result file (city, slice_key, ...), without reading its rows."""
+    metadata = pq.read_schema(path).metadata or {}
+    raw = metadata.get(b"PANDAS_ATTRS")
+    return json.loads(raw) if raw else {}
+
+
+def export_filename(path: Path, query_id: str, fmt: str) -> str:
+    """Download name with the query parameters, e.g. berlin_inner_5_0_outer_20_0_3f2a9c1b.csv"""
+    def safe_num(val):
+        return "none" if val is None else str(val).replace(".", "_")
+
+    attrs = result_attrs(path)
+    parts = [attrs.get("city", "query")]
+    if attrs.get("slice_key"):
+        _, inner, outer, area = attrs["slice_key"]
+        parts += ["inner", safe_num(inner), "outer", safe_num(outer)]
+        if area:
+            lat, lng, radius_m = area
+            parts += ["lat", safe_num(lat), "lng", safe_num(lng), "r", safe_num(radius_m)]
+    parts.append(query_id[:8])
+    return "_".join(parts) + EXPORT_FORMATS[fmt][1]
+
+
+def _csv_chunks(path: Path, batch_rows: int) -> Iterator[bytes]:
+    header = True
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_rows):
+        buf = io.StringIO()
+        batch.to_pandas().to_csv(buf, header=header, index=False)
+        header = False
+        yield buf.getvalue().encode("utf-8")
+    if header:
+        # empty result: still send the column names
+        yield (",".join(pq.read_schema(path).names) + "\n").encode("utf-8")
+
+
+def _gzip(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def _file_chunks(path: Path) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        while chunk := f.read(FILE_CHUNK_BYTES):
+            yield chunk
+
+
+def _json_value(val):
+    if isinstance(val, float) and math.isnan(val):
+        return None
+    return val
+
+
+def _geojson_chunks(path: Path, batch_rows: int) -> Iterator[bytes]:
+    """One LineString feature per pair, from (lon_1, lat_1) to (lon_2, lat_2)."""
+    yield b'{"type": "FeatureCollection", "features": ['
+    first = True
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_rows):
+        features = []
+        for row in batch.to_pylist():
+            features.append(json.dumps({
+                "type": "Feature",
+                "geometry": {
+                    "type": "LineString",
+                    "coordinates": [[row["lon_1"], row["lat_1"]], [row["lon_2"], row["lat_2"]]],
+                },
+                "properties": {k: _json_value(row.get(k)) for k in GEOJSON_PROPERTIES},
+            }, allow_nan=False))
+        if features:
+            yield (("" if first else ",") + ",".join(features)).encode("utf-8")
+            first = False
+    yield b"]}"
+
+
+def iter_export(path: Path, fmt: str, batch_rows: int = EXPORT_BATCH_ROWS) -> Iterator[bytes]:
+    """
+    The stored result at path (Parquet) in the given EXPORT_FORMATS format, as byte chunks.
+    Rows are read batch_rows at a time, so the whole result is never in memory.
+    """
+    if fmt == "parquet":
+        return _file_chunks(path)
+    if fmt == "csv":
+        return _csv_chunks(path, batch_rows)
+    if fmt == "csv.gz":
+        return _gzip(_csv_chunks(path, batch_rows))
+    if fmt == "geojson":
+        return _geojson_chunks(path, batch_rows)
+    raise ValueError(f"Unknown export format '{fmt}'. Must be one of: {list(EXPORT_FORMATS)}")
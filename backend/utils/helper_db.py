@@ -1,8 +1,36 @@
+import base64
+import json
+import math
 import sqlite3
-from pathlib import Path
+import threading
+from contextlib import contextmanager
 
 DB_PATH = "liked.db"
 
+# Applied to every pooled connection. WAL lets reads run alongside the writer and
+# NORMAL sync skips the fsync on each commit (WAL is still safe if the app crashes).
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+LIKE_UPSERT = """
+    INSERT INTO liked (uuid_1, uuid_2, orig_id_1, orig_id_2, distance, city, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT(uuid_1, uuid_2) DO UPDATE SET
+        distance = excluded.distance,
+        city = excluded.city,
+        created_at = CURRENT_TIMESTAMP
+"""
+LIKE_DELETE = "DELETE FROM liked WHERE uuid_1 = ? AND uuid_2 = ?"
+
+_local = threading.local()
+# DB_PATH -> column names of its liked table (older databases lack city/created_at)
+_liked_columns = {}
+
 def init_db():
     """Initialize the database with a fresh schema including city support"""
     con = sqlite3.connect(DB_PATH)
@@ -27,4 +55,182 @@ def init_db():
     print("Database initialized successfully")
 
 # Initialize database when module is imported
-init_db()
\ No newline at end of file
+init_db()
+
+def get_connection():
+    """
+    Return this thread's connection to DB_PATH, opening it on first use.
+    FastAPI runs sync endpoints on a fixed thread pool, so connections are reused across requests.
+    """
+    con = getattr(_local, "con", None)
+    if con is None or _local.path != DB_PATH:
+        con = sqlite3.connect(DB_PATH, timeout=5)
+        for pragma in PRAGMAS:
+            con.execute(pragma)
+        _local.con, _local.path = con, DB_PATH
+    return con
+
+@contextmanager
+def transaction():
+    """Run a block in one IMMEDIATE transaction on this thread's connection."""
+    con = get_connection()
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        yield con
+    except BaseException:
+        con.rollback()
+        raise
+    else:
+        con.commit()
+
+def _sql_value(val):
+    """Convert numpy scalars and NaN coming from query results into sqlite-friendly values."""
+    if hasattr(val, "item"):
+        val = val.item()
+    if isinstance(val, float) and math.isnan(val):
+        return None
+    return val
+
+def apply_likes(changes):
+    """
+    Apply like toggles in a single transaction.
+    changes: iterable of (liked, uuid_1, uuid_2, orig_id_1, orig_id_2, distance, city)
+    """
+    with transaction() as con:
+        for liked, uuid_1, uuid_2, orig_id_1, orig_id_2, distance, city in changes:
+            if liked:
+                params = (uuid_1, uuid_2, orig_id_1, orig_id_2, distance, city)
+                con.execute(LIKE_UPSERT, tuple(_sql_value(v) for v in params))
+            else:
+                con.execute(LIKE_DELETE, (uuid_1, uuid_2))
+
+def liked_columns():
+    """Column names of the liked table, read with PRAGMA table_info once per database."""
+    columns = _liked_columns.get(DB_PATH)
+    if columns is None:
+        columns = [row[1] for row in get_connection().execute("PRAGMA table_info(liked)")]
+        _liked_columns[DB_PATH] = columns
+    return columns
+
+# created_at given to likes saved before the column had a default; they sort as the oldest
+UNKNOWN_CREATED_AT = "1970-01-01 00:00:00"
+
+def ensure_liked_indexes():
+    """
+    Indexes backing keyset pagination of /liked/ (newest first, optionally per city).
+    Rows without created_at are backfilled first: a NULL never compares below the cursor,
+    so they would drop out of every page after the first.
+    """
+    columns = liked_columns()
+    if "created_at" not in columns:
+        return
+    with transaction() as con:
+        con.execute("UPDATE liked SET created_at = ? WHERE created_at IS NULL", (UNKNOWN_CREATED_AT,))
+        con.execute("CREATE INDEX IF NOT EXISTS liked_recent ON liked (created_at, uuid_1, uuid_2)")
+        if "city" in columns:
+            con.execute("CREATE INDEX IF NOT EXISTS liked_city_recent ON liked (city, created_at, uuid_1, uuid_2)")
+
+def _decode(val):
+    if isinstance(val, bytes):
+        try:
+            return val.decode("utf-8")
+        except UnicodeDecodeError:
+            return str(val)
+    return val
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError for anything it did not produce."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(key, list):
+        raise ValueError("Invalid cursor")
+    return key
+
+def fetch_liked_page(city=None, limit=None, cursor=None):
+    """
+    Liked pairs, newest first, optionally filtered by city.
+    Keyset pagination on (created_at, uuid_1, uuid_2): pass the returned cursor
+    back to get the next page. Without a limit all matching rows are returned.
+    Returns (items, next_cursor, total); total is only counted for the first page.
+    """
+    columns = liked_columns()
+    has_created_at = "created_at" in columns
+    has_city = "city" in columns
+    
+    select_cols = ["uuid_1", "uuid_2", "orig_id_1", "orig_id_2", "distance"]
+    if has_city:
+        select_cols.append("city")
+    if has_created_at:
+        select_cols.append("created_at")
+    key_cols = (["created_at"] if has_created_at else []) + ["uuid_1", "uuid_2"]
+    
+    where = []
+    params = []
+    if city and has_city:
+        where.append("city = ?")
+        params.append(city.lower())
+    where_sql = f" WHERE {' AND '.join(where)}" if where else ""
+    
+    con = get_connection()
+    total = None
+    if cursor is None:
+        total = con.execute(f"SELECT count(*) FROM liked{where_sql}", params).fetchone()[0]
+    
+    if cursor is not None:
+        key = decode_cursor(cursor)
+        if len(key) != len(key_cols):
+            raise ValueError("Invalid cursor")
+        where.append(f"({', '.join(key_cols)}) < ({', '.join('?' * len(key_cols))})")
+        params.extend(key)
+    
+    query = f"SELECT {', '.join(select_cols)} FROM liked"
+    if where:
+        query += f" WHERE {' AND '.join(where)}"
+    query += " ORDER BY " + ", ".join(f"{c} DESC" for c in key_cols)
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    
+    rows = con.execute(query, params).fetchall()
+    items = [dict(zip(select_cols, map(_decode, row))) for row in rows]
+    
+    next_cursor = None
+    if limit is not None and len(rows) == limit:
+        next_cursor = encode_cursor(items[-1][c] for c in key_cols)
+    return items, next_cursor, total
+
+class LikedIndex:
+    """
+    In-memory set of liked (uuid_1, uuid_2) pairs.
+    Loaded once from the liked table and kept in sync by /like/, so marking a
+    page of pairs costs one set lookup per pair regardless of how many likes exist.
+    """
+
+    def __init__(self):
+        self._pairs = set()
+        self._lock = threading.Lock()
+
+    def load(self):
+        rows = get_connection().execute("SELECT uuid_1, uuid_2 FROM liked").fetchall()
+        with self._lock:
+            self._pairs = {(row[0], row[1]) for row in rows}
+        return self
+
+    def add(self, uuid_1, uuid_2):
+        with self._lock:
+            self._pairs.add((uuid_1, uuid_2))
+
+    def discard(self, uuid_1, uuid_2):
+        with self._lock:
+            self._pairs.discard((uuid_1, uuid_2))
+
+    def __contains__(self, pair):
+        return pair in self._pairs
+
+    def __len__(self):
+        return len(self._pairs)
@@ -0,0 +1,62 @@
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Optional
+
+from fastapi import Request, Response
+from fastapi.responses import FileResponse
+
+# Files addressed by uuid never change, so clients may keep them for a year without revalidating
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def file_etag(stat_result: os.stat_result) -> str:
+    """Strong ETag from size and mtime (ns), so a rewritten file gets a new tag."""
+    return f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # weak comparison is what If-None-Match uses
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in candidates
+
+
+def _not_modified_since(if_modified_since: str, mtime: float) -> bool:
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since is None or since.tzinfo is None:
+        return False
+    return int(mtime) <= since.timestamp()
+
+
+def cached_file_response(request: Request, path: Path, media_type: str,
+                         cache_control: str = IMMUTABLE_CACHE_CONTROL,
+                         stat_result: Optional[os.stat_result] = None) -> Response:
+    """
+    FileResponse with validators and caching headers.
+    Answers If-None-Match / If-Modified-Since with 304 and leaves Range / If-Range
+    handling to FileResponse, which reuses the same ETag.
+    """
+    stat_result = stat_result or os.stat(path)
+    etag = file_etag(stat_result)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "Cache-Control": cache_control,
+    }
+
+    # If-None-Match takes precedence over If-Modified-Since (RFC 9110 13.2.2)
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        not_modified = _etag_matches(if_none_match, etag)
+    else:
+        if_modified_since = request.headers.get("if-modified-since")
+        not_modified = if_modified_since is not None and _not_modified_since(if_modified_since, stat_result.st_mtime)
+
+    if not_modified and request.method in ("GET", "HEAD"):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat_result)
@@ -0,0 +1,67 @@
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+from config import IMAGES_DIR, CITIES
+
+# Key for images stored directly in IMAGES_DIR (old berlin layout)
+ROOT = ""
+
+
+class ImageIndex:
+    """
+    uuid -> on-disk image path, so /image can resolve a file without stat calls.
+    Built by scanning IMAGES_DIR/{city}/*.jpg and IMAGES_DIR/*.jpg once, then kept
+    current by download_pairs as it writes files.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self._paths: Dict[str, Dict[str, Path]] = {}
+        self._lock = threading.Lock()
+
+    def build(self) -> "ImageIndex":
+        paths: Dict[str, Dict[str, Path]] = {}
+        if self.root.is_dir():
+            self._scan(self.root, ROOT, paths)
+            with os.scandir(self.root) as it:
+                for entry in it:
+                    if entry.is_dir():
+                        self._scan(Path(entry.path), entry.name.lower(), paths)
+        with self._lock:
+            self._paths = paths
+        return self
+
+    @staticmethod
+    def _scan(directory: Path, city: str, paths: Dict[str, Dict[str, Path]]) -> None:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.name.endswith(".jpg") and entry.is_file():
+                    paths.setdefault(entry.name[:-4], {})[city] = Path(entry.path)
+
+    def add(self, uuid: str, city: Optional[str], path: Path) -> None:
+        with self._lock:
+            self._paths.setdefault(uuid, {})[city.lower() if city else ROOT] = Path(path)
+
+    def lookup(self, uuid: str, city: Optional[str] = None) -> Optional[Path]:
+        """
+        Path for uuid in the given city's folder, or, without a city, the first hit
+        in CITIES order and then the IMAGES_DIR root.
+        """
+        locations = self._paths.get(uuid)
+        if not locations:
+            return None
+        if city:
+            return locations.get(city.lower())
+        for name in CITIES:
+            if name in locations:
+                return locations[name]
+        return locations.get(ROOT)
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+
+# Shared by the API and the downloader
+image_index = ImageIndex(IMAGES_DIR)
@@ -0,0 +1,153 @@
+import asyncio
+import json
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Dict, Optional
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """Raised inside a job function (via Job.check_cancelled) to stop it early."""
+
+
+class Job:
+    """State of one background job, updated by the worker and read by status endpoints."""
+
+    def __init__(self, kind: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = QUEUED
+        self.stage: Optional[str] = None
+        self.progress: Dict = {}
+        self.result = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    def set_stage(self, stage: str) -> None:
+        with self._lock:
+            self.stage = stage
+            self.progress.setdefault("stages", []).append({"stage": stage, "started_at": time.time()})
+
+    def stage_timings(self) -> Dict[str, float]:
+        """Seconds spent per stage; a stage lasts until the next one starts or the job finishes."""
+        with self._lock:
+            return self._stage_timings()
+
+    def _stage_timings(self) -> Dict[str, float]:
+        stages = self.progress.get("stages", [])
+        end = self.finished_at or time.time()
+        timings: Dict[str, float] = {}
+        for current, following in zip(stages, stages[1:] + [None]):
+            stop = following["started_at"] if following else end
+            timings[current["stage"]] = round(timings.get(current["stage"], 0.0) + stop - current["started_at"], 3)
+        return timings
+
+    def update(self, **progress) -> None:
+        with self._lock:
+            self.progress.update(progress)
+
+    def cancel(self) -> None:
+        self._cancel.set()
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel.is_set()
+
+    def check_cancelled(self) -> None:
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            now = self.finished_at or time.time()
+            return {
+                "job_id": self.id,
+                "kind": self.kind,
+                "status": self.status,
+                "stage": self.stage,
+                "progress": {k: (list(v) if isinstance(v, list) else v) for k, v in self.progress.items()},
+                "timings": self._stage_timings(),
+                "result": self.result,
+                "error": self.error,
+                "created_at": self.created_at,
+                "elapsed_s": round(now - (self.started_at or now), 3),
+            }
+
+
+async def job_events(job: Job, interval: float = 0.5) -> AsyncIterator[str]:
+    """
+    Server-Sent Events for a job: its to_dict() as a "progress" event every interval seconds
+    while it changes, then one final event named after the finished status.
+    """
+    last = None
+    while True:
+        state = job.to_dict()
+        if state["status"] in FINISHED:
+            yield f"event: {state['status']}\ndata: {json.dumps(state)}\n\n"
+            return
+        # elapsed_s and the running stage's timing grow on every call, so compare without them
+        snapshot = (state["status"], state["stage"], state["progress"])
+        if snapshot != last:
+            last = snapshot
+            yield f"event: progress\ndata: {json.dumps(state)}\n\n"
+        await asyncio.sleep(interval)
+
+
+class JobManager:
+    """
+    Runs jobs on a bounded thread pool so long database work never blocks the event loop.
+    Finished jobs are kept for ttl_seconds so clients can still read their result.
+    """
+
+    def __init__(self, max_workers: int, ttl_seconds: float = 3600):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self.ttl_seconds = ttl_seconds
+
+    def submit(self, kind: str, fn: Callable, *args, **kwargs) -> Job:
+        """Run fn(job, *args, **kwargs) in the pool; its return value becomes job.result."""
+        job = Job(kind)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job: Job, fn: Callable, args, kwargs) -> None:
+        job.started_at = time.time()
+        job.status = RUNNING
+        try:
+            job.check_cancelled()
+            job.result = fn(job, *args, **kwargs)
+            job.status = DONE
+        except JobCancelled:
+            job.status = CANCELLED
+        except Exception as e:
+            job.error = getattr(e, "detail", None) or str(e)
+            job.status = FAILED
+            traceback.print_exc()
+        finally:
+            job.finished_at = time.time()
+
+    def _prune(self) -> None:
+        cutoff = time.time() - self.ttl_seconds
+        for job_id in [j.id for j in self._jobs.values() if j.finished_at and j.finished_at < cutoff]:
+            del self._jobs[job_id]
@@ -0,0 +1,130 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional
+
+import requests
+
+from config import MAPILLARY_BATCH_IDS, MAPILLARY_METADATA_WORKERS, MAPILLARY_RETRIES, MAPILLARY_RETRY_BACKOFF
+
+GRAPH_BASE = "https://graph.mapillary.com"
+# The Graph API answers these when an id in the lookup does not exist or is malformed
+INVALID_ID_STATUSES = (400, 404)
+
+
+class BatchError(Exception):
+    """A multi-id lookup the API rejected because of its ids (one bad id fails the batch)."""
+
+
+class MetadataError(Exception):
+    """A lookup that still failed after MAPILLARY_RETRIES retries, or that retrying cannot fix (e.g. 401)."""
+
+
+def _retry_delay(r, attempt: int) -> float:
+    try:
+        return float(r.headers["Retry-After"])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return MAPILLARY_RETRY_BACKOFF * 2 ** attempt
+
+
+def _fetch_batch(session, api_base: str, token: str, ids: List[str], field: str) -> Dict[str, Optional[str]]:
+    """
+    One ?ids= lookup. Rate limits (429), server errors and network errors are retried with
+    exponential backoff; BatchError if the API rejects the ids, MetadataError once retries run out.
+    """
+    params = {"ids": ",".join(ids), "fields": f"id,{field}", "access_token": token}
+    for attempt in range(MAPILLARY_RETRIES + 1):
+        r = None
+        try:
+            r = session.get(f"{api_base}/", params=params, timeout=20)
+        except requests.RequestException as e:
+            error = str(e)
+        else:
+            if r.status_code == 200:
+                try:
+                    data = r.json()
+                except ValueError as e:
+                    error = f"invalid JSON: {e}"
+                else:
+                    return {i: (data.get(i) or {}).get(field) for i in ids}
+            elif r.status_code in INVALID_ID_STATUSES:
+                raise BatchError(f"HTTP {r.status_code} body={r.text[:200]}")
+            elif r.status_code == 429 or r.status_code >= 500:
+                error = f"HTTP {r.status_code} body={r.text[:200]}"
+            else:
+                raise MetadataError(f"HTTP {r.status_code} body={r.text[:200]}")
+        if attempt < MAPILLARY_RETRIES:
+            time.sleep(_retry_delay(r, attempt))
+    raise MetadataError(f"{len(ids)} ids from {ids[0]}: {error} (after {MAPILLARY_RETRIES + 1} attempts)")
+
+
+def _resolve_batch(session, api_base: str, token: str, ids: List[str], field: str) -> Dict[str, Optional[str]]:
+    """One batch; if the API rejects its ids, the halves are looked up until the bad ids are isolated."""
+    try:
+        return _fetch_batch(session, api_base, token, ids, field)
+    except BatchError as e:
+        if len(ids) == 1:
+            print(f"[META-FAIL] id={ids[0]} {e}", flush=True)
+            return {ids[0]: None}
+    mid = len(ids) // 2
+    return {
+        **_resolve_batch(session, api_base, token, ids[:mid], field),
+        **_resolve_batch(session, api_base, token, ids[mid:], field),
+    }
+
+
+def resolve_urls(
+    image_ids: Iterable[str],
+    field: str,
+    token: str,
+    session: requests.Session = None,
+    batch_size: int = MAPILLARY_BATCH_IDS,
+    workers: int = MAPILLARY_METADATA_WORKERS,
+    api_base: str = GRAPH_BASE,
+    cache=None,
+    should_cancel: Optional[Callable[[], bool]] = None,
+) -> Dict[str, Optional[str]]:
+    """
+    image id -> value of field (e.g. "thumb_1024_url"), None where the id has no such field
+    or cannot be resolved. Ids are looked up batch_size at a time with the Graph API's
+    ?ids=a,b,c form, `workers` batches concurrently over one session.
+    With a cache (utils/url_cache.py), unexpired URLs come from it and new ones are stored;
+    expired entries are purged first, so the file does not grow with every run.
+    A batch that still fails after its retries (MetadataError) gives None for its ids, like
+    missing ones, but nothing is cached for them, so a rerun looks them up again.
+    Once should_cancel() is true no further batches are started; their ids are left out.
+    """
+    ids = list(dict.fromkeys(str(i) for i in image_ids))
+    cached = {}
+    if cache is not None and ids:
+        cache.purge_expired()
+        cached = cache.get_many(ids, field)
+    ids = [i for i in ids if i not in cached]
+    if not ids:
+        return cached
+    batches = [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+    own_session = session is None
+    session = session or requests.Session()
+
+    def lookup(batch):
+        if should_cancel and should_cancel():
+            return {}
+        try:
+            return _resolve_batch(session, api_base, token, batch, field)
+        except MetadataError as e:
+            print(f"[META-FAIL] {e}", flush=True)
+            return dict.fromkeys(batch)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(batches)))) as pool:
+            urls = {}
+            for found in pool.map(lookup, batches):
+                urls.update(found)
+    finally:
+        if own_session:
+            session.close()
+    for image_id, url in urls.items():
+        if url is None:
+            print(f"[META-MISS] id={image_id} has no {field}", flush=True)
+    if cache is not None:
+        cache.put_many(field, urls)
+    return {**cached, **urls}
@@ -0,0 +1,67 @@
+from typing import Container, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+def _values(df: pd.DataFrame, column: str) -> List:
+    """Column as a list of native Python values with None for missing entries."""
+    if column not in df.columns:
+        return [None] * len(df)
+    s = df[column]
+    values = s.tolist()
+    missing = s.isna().to_numpy()
+    if missing.any():
+        for i in np.flatnonzero(missing):
+            values[i] = None
+    return values
+
+
+def _floats(df: pd.DataFrame, column: str) -> List[Optional[float]]:
+    if column not in df.columns:
+        return [None] * len(df)
+    s = df[column]
+    if s.dtype.kind != "f":
+        s = pd.to_numeric(s, errors="coerce").astype(float)
+    return _values(s.to_frame(), column)
+
+
+def _image(uuid, orig_id, lat, lng) -> dict:
+    image = {"uuid": uuid, "orig_id": orig_id}
+    if lat is not None:
+        image["lat"] = lat
+    if lng is not None:
+        image["lng"] = lng
+    return image
+
+
+def build_page_items(slice_df: pd.DataFrame, liked_pairs: Container[Tuple[str, str]], city: Optional[str]) -> List[dict]:
+    """
+    Serialize a page of pairs for /pairs/.
+    Columns are converted to plain lists once (NaN -> None) and the items are
+    built in a single pass over them, instead of per-row pandas access.
+    """
+    distance_col = "distance_meters" if "distance_meters" in slice_df.columns else "distance"
+    columns = zip(
+        _values(slice_df, "uuid"),
+        _values(slice_df, "relation_uuid"),
+        _values(slice_df, "orig_id"),
+        _values(slice_df, "relation_orig_id"),
+        _floats(slice_df, "lat_1"),
+        _floats(slice_df, "lon_1"),
+        _floats(slice_df, "lat_2"),
+        _floats(slice_df, "lon_2"),
+        _values(slice_df, distance_col),
+    )
+
+    return [
+        {
+            "id": f"{u1}|{u2}",
+            "left": _image(u1, o1, lat1, lng1),
+            "right": _image(u2, o2, lat2, lng2),
+            "liked": (u1, u2) in liked_pairs,
+            "distance": dist,
+            "city": city,
+        }
+        for u1, u2, o1, o2, lat1, lng1, lat2, lng2, dist in columns
+    ]
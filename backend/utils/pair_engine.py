@@ -0,0 +1,201 @@
+import threading
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from sqlalchemy import text
+
+from utils.create_slice import CITY_EPSG
+from utils.db import get_db_connection
+from utils.query import ID_COLUMNS, pairs_frame
+from utils.query_cache import query_cache
+
+# PostGIS ST_Buffer approximates a circle with 4 * quad_segs = 32 segments
+BUFFER_SEGMENTS = 32
+EARTH_RADIUS_M = 6371008.8
+
+# Anchors handled per KD-tree query; bounds memory for the candidate pairs of one block
+ANCHOR_BLOCK = 20_000
+
+PAIR_COLUMNS = [
+    "uuid", "relation_uuid", "orig_id", "relation_orig_id", "h_1", "h_2",
+    "lon_1", "lon_2", "lat_1", "lat_2", "distance_meters", "source", "relation_id",
+    "x_1", "y_1", "x_2", "y_2",
+]
+
+
+def inside_buffer(dx, dy, radius):
+    """
+    True where (dx, dy) lies strictly inside the 32-gon PostGIS builds for ST_Buffer(point, radius):
+    vertices on the circle at multiples of 2*pi/32, so an edge is radius*cos(pi/32) from the centre.
+    """
+    step = 2 * np.pi / BUFFER_SEGMENTS
+    theta = np.mod(np.arctan2(dy, dx), step)
+    return np.hypot(dx, dy) * np.cos(theta - step / 2) < radius * np.cos(step / 2)
+
+
+def slice_mask(dx, dy, heading, inner_buffer, outer_buffer):
+    """
+    Vectorized ST_Within(b, slice_geom) for offsets (dx, dy) from an anchor with heading (degrees):
+    inside the outer buffer and outside the square-capped corridor of half-width inner_buffer
+    along the heading. The inner disc lies inside the corridor, so it needs no separate test.
+    """
+    h = np.radians(heading)
+    offset = np.abs(dx * np.cos(h) - dy * np.sin(h))
+    return inside_buffer(dx, dy, outer_buffer) & (offset > inner_buffer)
+
+
+def heading_mask(h_1, h_2):
+    diff = np.abs(h_1 - h_2)
+    return np.minimum(diff, 360 - diff) <= 45
+
+
+def ring_contains(wider_key, key):
+    """
+    True if every pair for slice_key key is also a pair for wider_key: same city and area,
+    and a ring that is no wider (inner >= wider inner, outer <= wider outer). The slice
+    (buffer minus heading corridor) then shrinks on both sides.
+    """
+    city, inner, outer, area = key
+    w_city, w_inner, w_outer, w_area = wider_key
+    same_area = (tuple(w_area) if w_area else None) == (tuple(area) if area else None)
+    return w_city == city and same_area and w_inner <= inner and w_outer >= outer
+
+
+def narrow_pairs(df, inner_buffer, outer_buffer):
+    """
+    The pairs of df (a result for a wider ring, see ring_contains) that also lie in the slice
+    for inner_buffer/outer_buffer. Needs the projected x_1/y_1/x_2/y_2 columns; the uuid and
+    heading conditions are unchanged, so only the slice test is repeated.
+    """
+    dx = df["x_2"].to_numpy(dtype=float) - df["x_1"].to_numpy(dtype=float)
+    dy = df["y_2"].to_numpy(dtype=float) - df["y_1"].to_numpy(dtype=float)
+    keep = slice_mask(dx, dy, df["h_1"].to_numpy(dtype=float), float(inner_buffer), float(outer_buffer))
+    return df[keep].reset_index(drop=True)
+
+
+def haversine_m(lat_1, lng_1, lat_2, lng_2):
+    lat_1, lng_1, lat_2, lng_2 = map(np.radians, (lat_1, lng_1, lat_2, lng_2))
+    a = np.sin((lat_2 - lat_1) / 2) ** 2 + np.cos(lat_1) * np.cos(lat_2) * np.sin((lng_2 - lng_1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+class PairEngine:
+    """
+    The pair join of create_slice.py + query.py in memory: the high-quality points of one city
+    in a KD-tree over their projected coordinates, with the slice and heading predicates
+    evaluated with NumPy instead of building a slice polygon per point in PostGIS.
+
+    points needs columns uuid, orig_id, heading, x, y (projected, metres), lon, lat and source.
+    b.uuid > a.uuid compares code points, i.e. the C collation.
+    """
+
+    def __init__(self, points: pd.DataFrame):
+        points = points.dropna(subset=["x", "y"]).sort_values("uuid", kind="stable").reset_index(drop=True)
+        self.points = points
+        self.uuid = points["uuid"].astype(str).to_numpy()
+        # equal uuids share a rank, so "rank_b > rank_a" is exactly "b.uuid > a.uuid"
+        self.rank = np.unique(self.uuid, return_inverse=True)[1]
+        self.xy = points[["x", "y"]].to_numpy(dtype=float)
+        self.heading = points["heading"].to_numpy(dtype=float)
+        self.tree = cKDTree(self.xy)
+        self.generation = None
+
+    @classmethod
+    def from_db(cls, city: str) -> "PairEngine":
+        city = city.lower()
+        if city not in CITY_EPSG:
+            raise ValueError(f"Invalid city '{city}'. Must be one of: {list(CITY_EPSG.keys())}")
+        epsg = CITY_EPSG[city]
+        query = f"""
+        SELECT
+            uuid,
+            orig_id_x AS orig_id,
+            heading,
+            ST_X(geometry_comp_{epsg}) AS x,
+            ST_Y(geometry_comp_{epsg}) AS y,
+            comp_lon AS lon,
+            comp_lat AS lat,
+            source_x AS source
+        FROM {city}
+        WHERE mly_quality_score >= 0.95
+        """
+        with get_db_connection().connect() as conn:
+            result = conn.execute(text(query))
+            # orig_id as nullable Int64, so one NULL does not turn the ids into floats
+            points = pairs_frame(result.fetchall(), list(result.keys()))
+        return cls(points)
+
+    def __len__(self):
+        return len(self.points)
+
+    def _anchors(self, lat, lng, radius_m):
+        if lat is None or lng is None or radius_m is None:
+            return np.arange(len(self.points))
+        # geodesic stand-in for ST_Intersects with the geography buffer around (lat, lng)
+        dist = haversine_m(self.points["lat"].to_numpy(dtype=float), self.points["lon"].to_numpy(dtype=float), lat, lng)
+        return np.flatnonzero(dist <= radius_m)
+
+    def _pair_indices(self, anchors, inner_buffer, outer_buffer):
+        a_parts, b_parts, d_parts = [], [], []
+        for start in range(0, len(anchors), ANCHOR_BLOCK):
+            block = anchors[start:start + ANCHOR_BLOCK]
+            near = cKDTree(self.xy[block]).sparse_distance_matrix(self.tree, outer_buffer, output_type="ndarray")
+            a, b, dist = block[near["i"]], near["j"], near["v"]
+            keep = self.rank[b] > self.rank[a]
+            a, b, dist = a[keep], b[keep], dist[keep]
+
+            dx = self.xy[b, 0] - self.xy[a, 0]
+            dy = self.xy[b, 1] - self.xy[a, 1]
+            keep = slice_mask(dx, dy, self.heading[a], inner_buffer, outer_buffer)
+            keep &= heading_mask(self.heading[a], self.heading[b])
+            a_parts.append(a[keep])
+            b_parts.append(b[keep])
+            d_parts.append(dist[keep])
+        if not a_parts:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0)
+        a, b, dist = np.concatenate(a_parts), np.concatenate(b_parts), np.concatenate(d_parts)
+        order = np.lexsort((b, a))
+        return a[order], b[order], dist[order]
+
+    def pairs(self, inner_buffer, outer_buffer, lat=None, lng=None, radius_m=None) -> pd.DataFrame:
+        """Pairs for these slice parameters, with the columns of run_query()."""
+        anchors = self._anchors(lat, lng, radius_m)
+        a, b, dist = self._pair_indices(anchors, float(inner_buffer), float(outer_buffer))
+        left, right = self.points.iloc[a], self.points.iloc[b]
+        df = pd.DataFrame({
+            "uuid": left["uuid"].to_numpy(),
+            "relation_uuid": right["uuid"].to_numpy(),
+            "orig_id": left["orig_id"].array,
+            "relation_orig_id": right["orig_id"].array,
+            "h_1": left["heading"].to_numpy(),
+            "h_2": right["heading"].to_numpy(),
+            "lon_1": left["lon"].to_numpy(),
+            "lon_2": right["lon"].to_numpy(),
+            "lat_1": left["lat"].to_numpy(),
+            "lat_2": right["lat"].to_numpy(),
+            "distance_meters": dist,
+            "source": left["source"].to_numpy(),
+            "x_1": left["x"].to_numpy(),
+            "y_1": left["y"].to_numpy(),
+            "x_2": right["x"].to_numpy(),
+            "y_2": right["y"].to_numpy(),
+        }, columns=PAIR_COLUMNS)
+        df["relation_id"] = df["uuid"].astype(str) + "__" + df["relation_uuid"].astype(str)
+        return df.astype({name: "Int64" for name in ID_COLUMNS})
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+def get_pair_engine(city: str) -> PairEngine:
+    """The city's engine, loaded on first use and reloaded after rows were deleted (see query_cache)."""
+    city = city.lower()
+    generation = query_cache.generation(city)
+    with _engines_lock:
+        engine = _engines.get(city)
+        if engine is None or engine.generation != generation:
+            engine = PairEngine.from_db(city)
+            engine.generation = generation
+            _engines[city] = engine
+        return engine
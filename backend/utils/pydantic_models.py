@@ -1,10 +1,30 @@
 from typing import Optional, List, Dict
-from pydantic import BaseModel, Field, model_validator
+from pydantic import BaseModel, Field, field_validator, model_validator
 
 class PairsRequest(BaseModel):
     limit: int = Field(default=50, ge=1, le=200)
     cursor: Optional[str] = None
     user_id: str = "default"
+    query_id: Optional[str] = None
+    city: Optional[str] = None
+
+    @field_validator("cursor", mode="before")
+    @classmethod
+    def _cursor_to_str(cls, v):
+        # the frontend sends the numeric nextCursor back as-is
+        if isinstance(v, int) and not isinstance(v, bool):
+            return str(v)
+        return v
+
+class LikeItem(BaseModel):
+    id: str
+    liked: bool = True
+
+class LikeBatchRequest(BaseModel):
+    items: List[LikeItem] = Field(..., min_length=1, max_length=1000)
+    city: Optional[str] = None
+    query_id: Optional[str] = None
+    user_id: str = "default"
 
 class InteractionItem(BaseModel):
     pairId: str
@@ -30,6 +50,9 @@ class PlotRequest(BaseModel):
     inner_buffer: Optional[float] = Field(None, ge=0)
     outer_buffer: Optional[float] = Field(None, ge=0)
     area: Optional[Circle] = None
+    user_id: str = "default"
+    # also capture the join's EXPLAIN plan (EXPLAIN ANALYZE only with QUERY_EXPLAIN_ANALYZE set)
+    explain: bool = False
 
     @model_validator(mode="after")
     def _normalize_range(self):
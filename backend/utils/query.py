@@ -1,26 +1,79 @@
+import json
+import math
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import text
+from config import QUERY_FETCH_ROWS, QUERY_TILES_PER_WORKER
+from utils.create_slice import CITY_EPSG
 from utils.db import get_db_connection
 
-def run_query(city):
-    # Validate city and get EPSG code
-    city_epsg = {
-        "berlin": 32633,
-        "paris": 32631,
-        "washington": 32618,
-        "singapore": 32648
-    }
-    
+# Column types of the pair query, fixed so that streamed chunks share one Parquet schema
+PAIR_SCHEMA = pa.schema([
+    ("uuid", pa.string()),
+    ("relation_uuid", pa.string()),
+    # Mapillary ids: int64, so they stay exact past 2**53 and print without ".0"
+    ("orig_id", pa.int64()),
+    ("relation_orig_id", pa.int64()),
+    ("h_1", pa.float64()),
+    ("h_2", pa.float64()),
+    ("lon_1", pa.float64()),
+    ("lon_2", pa.float64()),
+    ("lat_1", pa.float64()),
+    ("lat_2", pa.float64()),
+    ("distance_meters", pa.float64()),
+    ("source", pa.string()),
+    ("relation_id", pa.string()),
+    # projected coordinates (city EPSG, metres), so narrower rings can be cut from this result
+    ("x_1", pa.float64()),
+    ("y_1", pa.float64()),
+    ("x_2", pa.float64()),
+    ("y_2", pa.float64()),
+])
+ID_COLUMNS = ("orig_id", "relation_orig_id")
+
+def pairs_frame(rows, columns):
+    """
+    DataFrame of fetched rows. The id columns are built as nullable Int64 from the raw
+    values: pandas would turn ints mixed with NULLs into float64 and round ids past 2**53.
+    """
+    df = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+    for i, name in enumerate(columns):
+        if name in ID_COLUMNS:
+            df[name] = pd.array([row[i] for row in rows], dtype="Int64")
+    return df
+
+def _epsg(city):
     city = city.lower()
-    if city not in city_epsg:
-        raise ValueError(f"Invalid city '{city}'. Must be one of: {list(city_epsg.keys())}")
-    
-    epsg = city_epsg[city]
+    if city not in CITY_EPSG:
+        raise ValueError(f"Invalid city '{city}'. Must be one of: {list(CITY_EPSG.keys())}")
+    return CITY_EPSG[city]
+
+def _pair_query(city, slice_table=None, tile=None, halo=0.0):
+    """
+    tile: optional (xmin, ymin, xmax, ymax) in the city's projected CRS; only anchors in
+    [xmin, xmax) x [ymin, ymax) are joined, against partners within halo of the tile.
+    """
+    epsg = _epsg(city)
     
     # Dynamic table and view names based on city
-    view_name = f"{city}_slice"
-    table_name = city
+    view_name = slice_table or f"{city.lower()}_slice"
+    table_name = city.lower()
+    
+    tile_filter = ""
+    if tile is not None:
+        xmin, ymin, xmax, ymax = tile
+        tile_filter = f"""
+    WHERE ST_X(a.geometry_comp_{epsg}) >= {xmin} AND ST_X(a.geometry_comp_{epsg}) < {xmax}
+        AND ST_Y(a.geometry_comp_{epsg}) >= {ymin} AND ST_Y(a.geometry_comp_{epsg}) < {ymax}
+        AND b.geometry_comp_{epsg} && ST_MakeEnvelope({xmin - halo}, {ymin - halo}, {xmax + halo}, {ymax + halo}, {epsg})"""
     
-    QUERY = f"""
+    return f"""
     WITH high_q AS (
         SELECT *
         FROM {table_name}
@@ -39,7 +92,11 @@ def run_query(city):
         b.comp_lat          AS lat_2,
         a.geometry_comp_{epsg} <-> b.geometry_comp_{epsg} AS distance_meters,
         a.source_x          AS source,
-        CONCAT(a.uuid, '__', b.uuid) AS relation_id
+        CONCAT(a.uuid, '__', b.uuid) AS relation_id,
+        ST_X(a.geometry_comp_{epsg}) AS x_1,
+        ST_Y(a.geometry_comp_{epsg}) AS y_1,
+        ST_X(b.geometry_comp_{epsg}) AS x_2,
+        ST_Y(b.geometry_comp_{epsg}) AS y_2
     FROM {view_name} AS a
     JOIN high_q AS b
     ON  b.uuid > a.uuid
@@ -48,10 +105,256 @@ def run_query(city):
         AND LEAST(
             ABS(a.heading - b.heading),
             360 - ABS(a.heading - b.heading)
-            ) <= 45;"""
+            ) <= 45{tile_filter};"""
+
+def run_query(city, on_stage=None, slice_table=None):
+    """
+    slice_table: slice table to join against (see SliceCache), defaults to the {city}_slice view.
+    on_stage: optional callback, called with "joining" and "fetching" as work proceeds.
+    """
+    QUERY = _pair_query(city, slice_table)
     
     engine = get_db_connection()
     with engine.connect() as conn:
-        df = pd.read_sql_query(QUERY, conn)
+        if on_stage:
+            on_stage("joining")
+        result = conn.execute(text(QUERY))
+        if on_stage:
+            on_stage("fetching")
+        df = pd.DataFrame.from_records(result.fetchall(), columns=list(result.keys()), coerce_float=True)
     
-    return df.shape[0], df
\ No newline at end of file
+    return df.shape[0], df
+
+class _PairFileWriter:
+    """
+    Appends pair chunks to a Parquet file (PAIR_SCHEMA) and optionally a CSV.
+    attrs are stored with the Parquet file and read back by pandas as df.attrs.
+    """
+
+    def __init__(self, city, parquet_path, csv_path=None, attrs=None):
+        attrs = {"city": city.lower(), **(attrs or {})}
+        # pandas metadata with Int64 ids, so reading the file back keeps them integers even with NULLs
+        empty = pd.DataFrame({name: pd.array([], dtype="Int64") for name in ID_COLUMNS})
+        pandas_meta = pa.Schema.from_pandas(empty, preserve_index=False).metadata[b"pandas"]
+        pandas_meta = json.loads(pandas_meta)
+        pandas_meta["columns"] = [c for c in pandas_meta["columns"] if c["name"] in ID_COLUMNS]
+        self.schema = PAIR_SCHEMA.with_metadata({
+            "pandas": json.dumps(pandas_meta),
+            "PANDAS_ATTRS": json.dumps(attrs),
+        })
+        self.csv_path = csv_path
+        self.count = 0
+        self.write_seconds = 0.0
+        self._parquet = pq.ParquetWriter(parquet_path, self.schema)
+        self._csv = open(csv_path, "w", newline="", encoding="utf-8") if csv_path else None
+
+    def write(self, chunk):
+        if chunk.empty:
+            return self.count
+        start = time.perf_counter()
+        chunk = chunk.astype({name: "Int64" for name in ID_COLUMNS if name in chunk.columns})
+        self._parquet.write_table(pa.Table.from_pandas(chunk, schema=self.schema, preserve_index=False))
+        if self._csv:
+            chunk.to_csv(self._csv, header=self.count == 0, index=False)
+        self.write_seconds += time.perf_counter() - start
+        self.count += len(chunk)
+        return self.count
+
+    def close(self):
+        if self._csv:
+            if self.count == 0:
+                pd.DataFrame(columns=self.schema.names).to_csv(self._csv, index=False)
+            self._csv.close()
+        self._parquet.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def stream_query(city, parquet_path, csv_path=None, chunk_rows=QUERY_FETCH_ROWS, on_stage=None, on_progress=None,
+                 slice_table=None, stats=None, attrs=None):
+    """
+    run_query for large results: fetches through a server-side cursor chunk_rows at a time
+    and appends each chunk to parquet_path (and csv_path), so only one chunk is held in memory.
+    on_progress: optional callback, called with the number of rows written so far.
+    stats: optional dict, gets write_s, the part of the fetching stage spent writing files.
+    attrs: optional metadata stored with the Parquet file (see _PairFileWriter).
+    Returns the number of pairs.
+    """
+    QUERY = _pair_query(city, slice_table)
+    
+    engine = get_db_connection()
+    with engine.connect() as conn, _PairFileWriter(city, parquet_path, csv_path, attrs) as writer:
+        if on_stage:
+            on_stage("joining")
+        result = conn.execution_options(stream_results=True, max_row_buffer=chunk_rows).execute(text(QUERY))
+        columns = list(result.keys())
+        if on_stage:
+            on_stage("fetching")
+        for rows in result.partitions(chunk_rows):
+            count = writer.write(pairs_frame(rows, columns))
+            if on_progress:
+                on_progress(count)
+    
+    if stats is not None:
+        stats["write_s"] = round(writer.write_seconds, 3)
+    return writer.count
+
+def tile_grid(extent, n_tiles):
+    """
+    Split extent (xmin, ymin, xmax, ymax) into about n_tiles equal grid tiles. Bounds are
+    half-open, so each point lies in exactly one tile; the last row and column reach past
+    the extent to include points on its maximum edge.
+    """
+    xmin, ymin, xmax, ymax = extent
+    cols = max(1, math.ceil(math.sqrt(n_tiles)))
+    rows = max(1, math.ceil(n_tiles / cols))
+    xs = [xmin + (xmax - xmin) * i / cols for i in range(cols)] + [xmax + 1.0]
+    ys = [ymin + (ymax - ymin) * j / rows for j in range(rows)] + [ymax + 1.0]
+    return [(xs[i], ys[j], xs[i + 1], ys[j + 1]) for i in range(cols) for j in range(rows)]
+
+def _slice_extent(city, slice_table=None):
+    """Bounding box of the anchors in the slice table, or None if it is empty."""
+    epsg = _epsg(city)
+    view_name = slice_table or f"{city.lower()}_slice"
+    with get_db_connection().connect() as conn:
+        row = conn.execute(text(f"""
+            SELECT ST_XMin(e), ST_YMin(e), ST_XMax(e), ST_YMax(e)
+            FROM (SELECT ST_Extent(geometry_comp_{epsg}) AS e FROM {view_name}) AS s
+        """)).one()
+    return None if row[0] is None else tuple(float(v) for v in row)
+
+# put on the chunk queue by a tile worker once its tile is fully fetched
+_TILE_DONE = object()
+
+def _put(chunks, item, stop):
+    """Blocking put that gives up once stop is set, so workers never hang on a full queue."""
+    while not stop.is_set():
+        try:
+            chunks.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+# how often the merge loop checks on the tile workers while the queue is empty
+_POLL_SECONDS = 0.5
+
+def _check_tile_workers(futures, chunks):
+    """
+    Raise what a tile worker died with (a BaseException skips its own error reporting), or an
+    error if every worker has exited and the queue is empty while tiles are still unfinished.
+    """
+    for future in futures:
+        if future.done() and not future.cancelled() and future.exception() is not None:
+            raise future.exception()
+    if all(future.done() for future in futures) and chunks.empty():
+        raise RuntimeError("tile workers exited without finishing their tiles")
+
+def _stream_tile(query, chunks, chunk_rows, stop):
+    """Fetch one tile through a server-side cursor, chunk_rows at a time, onto the chunks queue."""
+    try:
+        with get_db_connection().connect() as conn:
+            result = conn.execution_options(stream_results=True, max_row_buffer=chunk_rows).execute(text(query))
+            columns = list(result.keys())
+            for rows in result.partitions(chunk_rows):
+                if not _put(chunks, pairs_frame(rows, columns), stop):
+                    return
+        _put(chunks, _TILE_DONE, stop)
+    except Exception as e:
+        _put(chunks, e, stop)
+
+def stream_query_sharded(city, parquet_path, csv_path=None, halo=0.0, workers=4, tiles_per_worker=QUERY_TILES_PER_WORKER,
+                         chunk_rows=QUERY_FETCH_ROWS, on_stage=None, on_progress=None, slice_table=None, stats=None,
+                         attrs=None):
+    """
+    stream_query split over grid tiles of the anchors' extent, joined concurrently on up to
+    workers pooled connections (one Postgres backend each). halo is the outer buffer: partners
+    of a tile's anchors lie within it. Anchors are split on half-open tile bounds, so each pair
+    comes from exactly one tile and chunks are merged by appending them as they arrive.
+    Each tile streams chunk_rows at a time through a queue of at most workers chunks, so
+    memory stays bounded as in stream_query.
+    Returns the number of pairs.
+    """
+    if on_stage:
+        on_stage("joining")
+    extent = _slice_extent(city, slice_table)
+    with _PairFileWriter(city, parquet_path, csv_path, attrs) as writer:
+        if extent is None:
+            return 0
+        # more tiles than workers, so one dense tile doesn't leave the others idle
+        tiles = tile_grid(extent, workers * tiles_per_worker)
+        chunks = queue.Queue(maxsize=workers)
+        stop = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="query-tile")
+        try:
+            futures = [
+                executor.submit(_stream_tile, _pair_query(city, slice_table, tile, halo), chunks, chunk_rows, stop)
+                for tile in tiles
+            ]
+            remaining = len(tiles)
+            fetching = False
+            while remaining:
+                try:
+                    item = chunks.get(timeout=_POLL_SECONDS)
+                except queue.Empty:
+                    _check_tile_workers(futures, chunks)
+                    continue
+                if item is _TILE_DONE:
+                    remaining -= 1
+                    continue
+                if isinstance(item, Exception):
+                    raise item
+                if on_stage and not fetching:
+                    on_stage("fetching")
+                    fetching = True
+                count = writer.write(item)
+                if on_progress:
+                    on_progress(count)
+        finally:
+            stop.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+    if stats is not None:
+        stats["write_s"] = round(writer.write_seconds, 3)
+    return writer.count
+
+def explain_query(city, slice_table=None, analyze=False):
+    """
+    EXPLAIN (FORMAT JSON) of the pair join: the planner's estimates, without running it.
+    With analyze it is EXPLAIN (ANALYZE, BUFFERS), which runs the join once more (without
+    sending rows back), so this roughly doubles the join time of a query.
+    """
+    options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+    with get_db_connection().connect() as conn:
+        plan = conn.execute(text(f"EXPLAIN ({options}) {_pair_query(city, slice_table)}")).scalar_one()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]
+
+def _plan_nodes(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from _plan_nodes(child)
+
+def summarize_plan(plan):
+    """
+    The numbers worth comparing between runs of an EXPLAIN (FORMAT JSON) plan; the execution
+    time, actual rows and buffer counts are only there with ANALYZE, BUFFERS.
+    """
+    root = plan["Plan"]
+    nodes = list(_plan_nodes(root))
+    joins = [n["Node Type"] for n in nodes if n["Node Type"] in ("Nested Loop", "Hash Join", "Merge Join")]
+    return {
+        "planning_ms": plan.get("Planning Time"),
+        "execution_ms": plan.get("Execution Time"),
+        "root_node": root["Node Type"],
+        "join_node": joins[0] if joins else None,
+        "scans": sorted({f'{n["Node Type"]} on {n["Relation Name"]}' for n in nodes if "Relation Name" in n}),
+        "estimated_rows": root.get("Plan Rows"),
+        "total_cost": root.get("Total Cost"),
+        "rows": root.get("Actual Rows"),
+        "shared_hit_blocks": root.get("Shared Hit Blocks"),
+        "shared_read_blocks": root.get("Shared Read Blocks"),
+    }
@@ -0,0 +1,158 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from config import QUERY_CACHE_DIR, QUERY_CACHE_MAX_BYTES
+from utils.create_slice import slice_table_name
+
+
+class QueryCache:
+    """
+    Pair-query results on disk as Parquet, keyed by the canonical slice_key
+    (city, rounded buffers, rounded area): {root}/{city}/{name}.parquet plus a
+    small JSON sidecar. Least recently read files are evicted past max_bytes.
+
+    Each city has a generation counter; invalidate_city() bumps it and deletes
+    the city's files, and put() refuses results computed under an older
+    generation, so a query racing a row deletion cannot re-cache stale pairs.
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _city_dir(self, city: str) -> Path:
+        return self.root / city.lower()
+
+    def path_for(self, key: Tuple) -> Path:
+        return self._city_dir(key[0]) / f"{slice_table_name(key)}.parquet"
+
+    def generation(self, city: str) -> int:
+        try:
+            return int((self._city_dir(city) / "GENERATION").read_text().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def get(self, key: Tuple) -> Optional[Tuple[pd.DataFrame, Dict]]:
+        """Return (df, meta) for key, or None on a miss."""
+        path = self.path_for(key)
+        try:
+            df = pd.read_parquet(path)
+            os.utime(path)  # mark as recently used
+        except (FileNotFoundError, OSError):
+            return None
+        try:
+            meta = json.loads(path.with_suffix(".json").read_text())
+        except (FileNotFoundError, ValueError):
+            meta = {}
+        return df, meta
+
+    def count(self, key: Tuple) -> Optional[int]:
+        """Number of cached pairs for key, read from the Parquet footer; None on a miss."""
+        try:
+            return pq.ParquetFile(self.path_for(key)).metadata.num_rows
+        except (FileNotFoundError, OSError):
+            return None
+
+    def keys(self, city: str) -> List[Tuple]:
+        """slice_keys of the results cached for city, read from the sidecars."""
+        keys = []
+        for sidecar in self._city_dir(city).glob("*.json"):
+            try:
+                city_, inner, outer, area = json.loads(sidecar.read_text())["key"]
+            except (FileNotFoundError, ValueError, KeyError):
+                continue
+            keys.append((city_, inner, outer, tuple(area) if area else None))
+        return keys
+
+    def put(self, key: Tuple, df: pd.DataFrame, generation: int, meta: Optional[Dict] = None) -> Optional[Path]:
+        """
+        Store df for key. generation is the city's generation read before the query
+        started; if rows were deleted since then, nothing is stored and None is returned.
+        """
+        return self._store(key, generation, meta, lambda tmp: df.to_parquet(tmp, index=False))
+
+    def put_file(self, key: Tuple, src: Path, generation: int, meta: Optional[Dict] = None) -> Optional[Path]:
+        """Like put() for a result already written to the Parquet file src, which is hard-linked when possible."""
+        def link(tmp):
+            os.unlink(tmp)
+            try:
+                os.link(src, tmp)
+            except OSError:
+                shutil.copyfile(src, tmp)
+        return self._store(key, generation, meta, link)
+
+    def _store(self, key: Tuple, generation: int, meta: Optional[Dict], write: Callable[[str], None]) -> Optional[Path]:
+        city = key[0]
+        city_dir = self._city_dir(city)
+        city_dir.mkdir(parents=True, exist_ok=True)
+        path = self.path_for(key)
+        with self._lock:
+            if self.generation(city) != generation:
+                return None
+            fd, tmp = tempfile.mkstemp(dir=city_dir, suffix=".part")
+            os.close(fd)
+            try:
+                write(tmp)
+                os.replace(tmp, path)
+            except BaseException:
+                Path(tmp).unlink(missing_ok=True)
+                raise
+            path.with_suffix(".json").write_text(json.dumps({"key": list(key), **(meta or {})}))
+            self._evict()
+        return path
+
+    def update_meta(self, key: Tuple, **meta) -> None:
+        path = self.path_for(key).with_suffix(".json")
+        try:
+            current = json.loads(path.read_text())
+        except (FileNotFoundError, ValueError):
+            return
+        current.update(meta)
+        path.write_text(json.dumps(current))
+
+    def invalidate_city(self, city: str) -> int:
+        """Drop every cached result for city. Returns the number of results removed."""
+        city_dir = self._city_dir(city)
+        city_dir.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            (city_dir / "GENERATION").write_text(str(self.generation(city) + 1))
+            removed = 0
+            for path in city_dir.glob("*.parquet"):
+                path.unlink(missing_ok=True)
+                path.with_suffix(".json").unlink(missing_ok=True)
+                removed += 1
+        return removed
+
+    def _evict(self) -> None:
+        files = []
+        for path in self.root.glob("*/*.parquet"):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            path.with_suffix(".json").unlink(missing_ok=True)
+            total -= size
+
+
+# Shared by the API and the modify/* scripts that delete rows
+query_cache = QueryCache(QUERY_CACHE_DIR, QUERY_CACHE_MAX_BYTES)
+
+
+def invalidate_city(city: str) -> int:
+    """Forget cached query results for city, e.g. after rows were deleted from its table."""
+    return query_cache.invalidate_city(city)
@@ -0,0 +1,101 @@
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from config import QUERY_HISTORY_PATH
+from utils.helper_db import PRAGMAS, _sql_value
+
+# Telemetry of /query/ runs, in its own file so liked.db only holds user data
+DB_PATH = str(QUERY_HISTORY_PATH)
+
+# query_history columns stored as JSON text
+HISTORY_JSON_COLUMNS = ("area", "timings", "plan_summary", "plan")
+
+_local = threading.local()
+
+def get_connection():
+    """This thread's connection to DB_PATH, opened on first use (as helper_db.get_connection)."""
+    con = getattr(_local, "con", None)
+    if con is None or _local.path != DB_PATH:
+        con = sqlite3.connect(DB_PATH, timeout=5)
+        for pragma in PRAGMAS:
+            con.execute(pragma)
+        _local.con, _local.path = con, DB_PATH
+    return con
+
+@contextmanager
+def transaction():
+    con = get_connection()
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        yield con
+    except BaseException:
+        con.rollback()
+        raise
+    else:
+        con.commit()
+
+def ensure_query_history():
+    """Table of finished /query/ runs: parameters, stage timings and, if requested, the EXPLAIN plan."""
+    with transaction() as con:
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS query_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                query_id TEXT,
+                city TEXT NOT NULL,
+                inner_buffer FLOAT,
+                outer_buffer FLOAT,
+                area TEXT,
+                engine TEXT,
+                cached INTEGER,
+                count INTEGER,
+                total_s FLOAT,
+                timings TEXT,
+                plan_summary TEXT,
+                plan TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        con.execute("CREATE INDEX IF NOT EXISTS query_history_city ON query_history (city, id)")
+        con.execute("CREATE INDEX IF NOT EXISTS query_history_query_id ON query_history (query_id)")
+
+def record_query(entry):
+    """Insert one query_history row; entry maps column names to values (JSON columns as objects)."""
+    entry = {k: (json.dumps(v) if k in HISTORY_JSON_COLUMNS and v is not None else _sql_value(v)) for k, v in entry.items()}
+    columns = list(entry)
+    with transaction() as con:
+        con.execute(
+            f"INSERT INTO query_history ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            [entry[c] for c in columns],
+        )
+
+def fetch_query_history(city=None, limit=50, query_id=None, with_plan=False):
+    """query_history rows, newest first. The full plan is only included with with_plan."""
+    columns = ["id", "query_id", "city", "inner_buffer", "outer_buffer", "area", "engine", "cached",
+               "count", "total_s", "timings", "plan_summary", "created_at"]
+    if with_plan:
+        columns.append("plan")
+    where = []
+    params = []
+    if city:
+        where.append("city = ?")
+        params.append(city.lower())
+    if query_id:
+        where.append("query_id = ?")
+        params.append(query_id)
+    query = f"SELECT {', '.join(columns)} FROM query_history"
+    if where:
+        query += f" WHERE {' AND '.join(where)}"
+    query += " ORDER BY id DESC LIMIT ?"
+    params.append(limit)
+
+    items = []
+    for row in get_connection().execute(query, params):
+        item = dict(zip(columns, row))
+        for c in HISTORY_JSON_COLUMNS:
+            if item.get(c) is not None:
+                item[c] = json.loads(item[c])
+        item["cached"] = bool(item["cached"])
+        items.append(item)
+    return items
@@ -0,0 +1,164 @@
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+
+def read_frame(path: Path) -> pd.DataFrame:
+    """Read a stored result: Parquet by extension, pickle otherwise."""
+    if Path(path).suffix == ".parquet":
+        return pd.read_parquet(path)
+    return pd.read_pickle(path)
+
+
+class ResultEntry:
+    """A loaded query result plus a lazily built (uuid, relation_uuid) -> row index."""
+
+    def __init__(self, df: pd.DataFrame, path: Optional[Path] = None):
+        self.df = df
+        self.path = Path(path) if path is not None else None
+        self.nbytes = int(df.memory_usage(index=True, deep=True).sum())
+        self.last_access = time.time()
+        self._pair_index: Optional[Dict[Tuple[str, str], int]] = None
+        self._lock = threading.Lock()
+
+    def row_for(self, uuid_1: str, uuid_2: str) -> Optional[pd.Series]:
+        """Return the row for a pair in O(1) after the first lookup, or None."""
+        if self._pair_index is None:
+            with self._lock:
+                if self._pair_index is None:
+                    keys = zip(self.df["uuid"].tolist(), self.df["relation_uuid"].tolist())
+                    index: Dict[Tuple[str, str], int] = {}
+                    for pos, key in enumerate(keys):
+                        index.setdefault(key, pos)
+                    self._pair_index = index
+        pos = self._pair_index.get((uuid_1, uuid_2))
+        if pos is None:
+            return None
+        return self.df.iloc[pos]
+
+
+class ResultStore:
+    """
+    Keeps query results in memory so each one is unpickled at most once.
+    Entries are evicted least-recently-used first once the byte budget is exceeded;
+    the most recently used entry is always kept, even if it alone exceeds the budget.
+    With ttl_seconds set, entries (and their backing files) expire after that long
+    without being accessed. The last access of an evicted entry is remembered here rather
+    than written to its file's mtime: result files can be hard links into the query cache,
+    which orders its own eviction by mtime.
+    """
+
+    def __init__(self, max_bytes: int, ttl_seconds: Optional[float] = None):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, ResultEntry]" = OrderedDict()
+        # resolved file path -> last access of its evicted entry
+        self._file_access: Dict[Path, float] = {}
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    @property
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(e.nbytes for e in self._entries.values())
+
+    def _is_expired(self, last_access: float, now: float) -> bool:
+        return self.ttl_seconds is not None and now - last_access > self.ttl_seconds
+
+    def _file_last_access(self, path: Path) -> float:
+        """Last access of the entry backed by path, or the file's mtime if it was never evicted here."""
+        with self._lock:
+            last_access = self._file_access.get(path.resolve())
+        return last_access if last_access is not None else path.stat().st_mtime
+
+    def get(self, key: str) -> Optional[ResultEntry]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._is_expired(entry.last_access, now):
+                del self._entries[key]
+                return None
+            entry.last_access = now
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, df: pd.DataFrame, path: Optional[Path] = None) -> ResultEntry:
+        """
+        Store df under key, replacing (and thereby invalidating) any previous entry.
+        path is the file backing the entry, so it can be reloaded after eviction.
+        """
+        entry = ResultEntry(df, path)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            self._evict()
+        return entry
+
+    def entries(self) -> List[ResultEntry]:
+        """Snapshot of the entries held in memory, most recently used last."""
+        with self._lock:
+            return list(self._entries.values())
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def load(self, key: str, path: Path, expires: bool = True) -> Optional[ResultEntry]:
+        """
+        Return the cached entry for key, reading it from the file at path on a miss.
+        A file not touched within the TTL counts as expired unless expires=False.
+        """
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+        with self._load_lock:
+            # another request may have loaded it while we waited
+            entry = self.get(key)
+            if entry is not None:
+                return entry
+            path = Path(path)
+            if not path.exists():
+                return None
+            if expires and self._is_expired(self._file_last_access(path), time.time()):
+                return None
+            with self._lock:
+                self._file_access.pop(path.resolve(), None)
+            return self.put(key, read_frame(path), path)
+
+    def purge_expired(self, directory: Path, pattern: str = "*") -> int:
+        """Delete expired entries and the expired result files in directory. Returns files removed."""
+        if self.ttl_seconds is None:
+            return 0
+        now = time.time()
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if self._is_expired(e.last_access, now)]:
+                del self._entries[key]
+            live = {e.path.resolve() for e in self._entries.values() if e.path is not None}
+        removed = 0
+        for path in Path(directory).glob(pattern):
+            if not path.is_file() or path.resolve() in live:
+                continue
+            try:
+                if self._is_expired(self._file_last_access(path), now):
+                    path.unlink()
+                    removed += 1
+                    with self._lock:
+                        self._file_access.pop(path.resolve(), None)
+            except OSError:
+                pass
+        return removed
+
+    def _evict(self) -> None:
+        total = sum(e.nbytes for e in self._entries.values())
+        while total > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            total -= evicted.nbytes
+            if evicted.path is not None:
+                # load() and purge_expired() measure the TTL from here, not from the file's mtime
+                self._file_access[evicted.path.resolve()] = evicted.last_access
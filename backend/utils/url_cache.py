@@ -0,0 +1,87 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+from config import URL_CACHE_PATH, URL_CACHE_TTL_SECONDS
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+)
+
+# ids per IN (...) lookup, below SQLite's bound-parameter limit
+CHUNK = 500
+
+
+class UrlCache:
+    """
+    (image id, field) -> (url, fetched_at) in a SQLite file, so reruns of the downloaders
+    skip metadata calls for URLs resolved less than ttl_seconds ago.
+    """
+
+    def __init__(self, path: Path, ttl_seconds: float):
+        self.path = Path(path)
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.path, timeout=5)
+            for pragma in PRAGMAS:
+                con.execute(pragma)
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS url_cache (
+                    image_id TEXT NOT NULL,
+                    field TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    PRIMARY KEY (image_id, field)
+                ) WITHOUT ROWID
+            """)
+            con.commit()
+            self._local.con = con
+        return con
+
+    def get_many(self, image_ids: Iterable[str], field: str, now: Optional[float] = None) -> Dict[str, str]:
+        """Cached URLs of field for image_ids that have not expired; unknown ids are left out."""
+        ids = [str(i) for i in image_ids]
+        oldest = (time.time() if now is None else now) - self.ttl_seconds
+        con = self._connection()
+        found = {}
+        for start in range(0, len(ids), CHUNK):
+            chunk = ids[start:start + CHUNK]
+            rows = con.execute(
+                f"SELECT image_id, url FROM url_cache WHERE field = ? AND fetched_at >= ? "
+                f"AND image_id IN ({','.join('?' * len(chunk))})",
+                (field, oldest, *chunk),
+            )
+            found.update(rows)
+        return found
+
+    def put_many(self, field: str, urls: Dict[str, Optional[str]], now: Optional[float] = None) -> None:
+        """Store resolved URLs of field (None values are skipped, so misses are asked again)."""
+        fetched_at = time.time() if now is None else now
+        rows = [(str(i), field, url, fetched_at) for i, url in urls.items() if url]
+        if not rows:
+            return
+        con = self._connection()
+        with con:
+            con.executemany(
+                "INSERT OR REPLACE INTO url_cache (image_id, field, url, fetched_at) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+
+    def purge_expired(self, now: Optional[float] = None) -> int:
+        """Delete entries past the TTL; returns how many were removed."""
+        oldest = (time.time() if now is None else now) - self.ttl_seconds
+        con = self._connection()
+        with con:
+            return con.execute("DELETE FROM url_cache WHERE fetched_at < ?", (oldest,)).rowcount
+
+
+# Shared by download_pairs, modify/download_thumb.py and modify/laplacian.py
+url_cache = UrlCache(URL_CACHE_PATH, URL_CACHE_TTL_SECONDS)
@@ -0,0 +1,108 @@
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image, ImageOps
+
+from config import IMAGES_DIR
+
+# Resized copies live under images/variants/w{width}/{city}/{uuid}.{ext}
+VARIANTS_DIR = IMAGES_DIR / "variants"
+
+# Named sizes accepted by /image (target width in px, None = original file)
+SIZE_PRESETS = {
+    "tile": 480,
+    "medium": 1024,
+    "full": None,
+}
+MIN_WIDTH = 32
+MAX_WIDTH = 4096
+
+FORMATS = {
+    "jpeg": ("jpg", "JPEG", "image/jpeg"),
+    "webp": ("webp", "WEBP", "image/webp"),
+}
+QUALITY = 82
+# EXIF orientations that swap width and height
+_ROTATED = {5, 6, 7, 8}
+
+# Striped render locks, so concurrent requests for one variant render it only once
+_locks = [threading.Lock() for _ in range(64)]
+
+
+def media_type(fmt: str) -> str:
+    return FORMATS[fmt][2]
+
+
+def variant_path(src: Path, width: Optional[int], fmt: str) -> Path:
+    """Cache location for src resized to width in fmt (width None keeps the original size)."""
+    src = Path(src)
+    ext = FORMATS[fmt][0]
+    city = src.parent.name if src.parent != IMAGES_DIR else "_root"
+    size_dir = f"w{width}" if width else "orig"
+    return VARIANTS_DIR / size_dir / city / f"{src.stem}.{ext}"
+
+
+def _lock_for(path: Path) -> threading.Lock:
+    return _locks[hash(str(path)) % len(_locks)]
+
+
+def _render(src: Path, dest: Path, width: Optional[int], fmt: str, src_mtime_ns: int) -> None:
+    with Image.open(src) as img:
+        w, h = img.size
+        if img.getexif().get(0x0112) in _ROTATED:
+            w, h = h, w
+        if width and w > width:
+            # let the JPEG decoder downscale by 1/2..1/8 while decoding
+            target = (width, max(1, round(h * width / w)))
+            img.draft("RGB", target if w == img.width else target[::-1])
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        if width and img.width > width:
+            img.thumbnail((width, MAX_WIDTH * 8), Image.Resampling.LANCZOS)
+
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=dest.parent, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                img.save(f, FORMATS[fmt][1], quality=QUALITY, optimize=True)
+            # stamped with the source's mtime, which is how get_variant tells it is current
+            os.utime(tmp, ns=(src_mtime_ns, src_mtime_ns))
+            os.replace(tmp, dest)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+
+
+def _is_current(dest: Path, src_mtime_ns: int) -> bool:
+    try:
+        return dest.stat().st_mtime_ns == src_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+def get_variant(src: Path, width: Optional[int], fmt: str = "jpeg") -> Path:
+    """
+    Path of src at the requested width and format, rendering it on first request.
+    The original file is returned untouched for JPEG requests that need no resizing.
+    A variant carries its source's mtime, so a re-downloaded source is rendered again.
+    Raises FileNotFoundError if src is gone, and OSError (PIL's UnidentifiedImageError
+    among them) if it cannot be decoded.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format '{fmt}'. Must be one of: {list(FORMATS)}")
+    if width is None and fmt == "jpeg":
+        return Path(src)
+
+    dest = variant_path(src, width, fmt)
+    src_mtime_ns = Path(src).stat().st_mtime_ns
+    if _is_current(dest, src_mtime_ns):
+        return dest
+    # one render per variant even when a gallery page asks for it several times at once
+    with _lock_for(dest):
+        if not _is_current(dest, src_mtime_ns):
+            _render(Path(src), dest, width, fmt, src_mtime_ns)
+    return dest